@@ -12,7 +12,7 @@ from app.config import get_settings
 from app.database import engine, Base, get_db
 from app.routers import auth, home, groups, orders, admin, votes
 from app.routers import templates as templates_router
-from app.services.auth import get_current_user_optional
+from app.services.auth import get_current_user_optional_sync
 
 settings = get_settings()
 
@@ -32,6 +32,7 @@ async def lifespan(app: FastAPI):
     from app.models import treat  # noqa: F401 - Phase 3 請客記錄
     from app.models import vote  # noqa: F401 - Phase 3 投票系統
     from app.models import template  # noqa: F401 - Phase 5 開團模板
+    from app.models import sales  # noqa: F401 - 品項銷量彙總
     
     Base.metadata.create_all(bind=engine)
     
@@ -110,6 +111,31 @@ async def lifespan(app: FastAPI):
     add_column_if_not_exists("groups", "auto_remind_minutes", "INTEGER")
     add_column_if_not_exists("groups", "last_remind_at", "TIMESTAMP")
     
+    # 訂單金額（舊資料為 NULL，啟動時回填）
+    add_column_if_not_exists("order_items", "line_total", "NUMERIC(10,2)")
+    add_column_if_not_exists("orders", "items_subtotal", "NUMERIC(10,2)")
+    add_column_if_not_exists("orders", "total_amount", "NUMERIC(10,2)")
+    
+    # 品項規格 key（購物車合併、店家總項彙總；舊資料由下方訂單金額回填一起補）
+    add_column_if_not_exists("order_items", "spec_key", "VARCHAR(40)")
+    add_column_if_not_exists("order_items", "spec_label", "VARCHAR(300)")
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order_spec ON order_items (order_id, spec_key)"))
+    except Exception as e:
+        print(f"Index ix_order_items_order_spec check: {e}")
+    
+    # 團單訂單計數（舊資料為 NULL，啟動時回填）
+    add_column_if_not_exists("groups", "submitted_orders", "INTEGER")
+    add_column_if_not_exists("groups", "pending_orders", "INTEGER")
+    add_column_if_not_exists("groups", "submitted_subtotal", "NUMERIC(10,2)")
+    
+    # 團單內容版本（ETag）
+    add_column_if_not_exists("groups", "version", "INTEGER DEFAULT 0")
+    
+    # 截止方式（舊資料視為手動截止，不會因為改截止時間而重新開放）
+    add_column_if_not_exists("groups", "closed_by_deadline", "BOOLEAN DEFAULT FALSE")
+    
     # Phase 7: 投票可見性欄位
     add_column_if_not_exists("votes", "is_public", "BOOLEAN DEFAULT TRUE")
     
@@ -262,12 +288,75 @@ async def lifespan(app: FastAPI):
         # 表可能不存在，SQLAlchemy 會自動建立
         print(f"system_settings check: {e}")
     
+    # 截止很久的舊團標記為已截止（以前只看截止時間、沒寫 is_closed），不讓截止排程把整個歷史當成剛截止處理
+    from app.database import SessionLocal
+    from app.services.deadline_scheduler import close_expired_groups
+    db = SessionLocal()
+    try:
+        closed = close_expired_groups(db)
+        if closed:
+            print(f"Closed expired groups: {closed}")
+    except Exception as e:
+        db.rollback()
+        print(f"Expired groups check: {e}")
+    finally:
+        db.close()
+    
+    # 回填訂單金額（含品項規格 key）、團單訂單計數、品項銷量彙總、截止團單的結算快照（只處理還沒算過的；計數會加總訂單金額，要先補金額）
+    from app.services.order_total_service import backfill_order_totals
+    from app.services.group_counter_service import recompute_group_counters
+    from app.services.sales_rollup_service import backfill_sales_rollup
+    from app.services.affinity_service import backfill_user_store_affinity
+    from app.services.group_settlement import backfill_settlement_snapshots
+    db = SessionLocal()
+    try:
+        filled = backfill_order_totals(db, only_missing=True)
+        if filled:
+            print(f"Backfilled order totals: {filled} orders")
+        filled = recompute_group_counters(db, only_missing=True)
+        if filled:
+            print(f"Backfilled group counters: {filled} groups")
+        filled = backfill_sales_rollup(db)
+        if filled:
+            print(f"Backfilled item sales rollup: {filled} rows")
+        filled = backfill_user_store_affinity(db)
+        if filled:
+            print(f"Backfilled user-store affinity: {filled} rows")
+        filled = backfill_settlement_snapshots(db)
+        if filled:
+            print(f"Backfilled settlement snapshots: {filled} groups")
+    except Exception as e:
+        db.rollback()
+        print(f"Order totals / group counters / sales rollup backfill: {e}")
+    finally:
+        db.close()
+    
     # 確保目錄存在
     os.makedirs("app/static/images", exist_ok=True)
     os.makedirs("app/static/uploads/stores", exist_ok=True)
+    os.makedirs(settings.logo_cache_dir, exist_ok=True)
+    
+    # def 路由（同步 DB 查詢）在 threadpool 執行，調整可同時執行的數量
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.threadpool_workers
+    
+    # 用戶活動時間背景寫回
+    import asyncio
+    from app.services.activity_service import activity_flush_loop, flush_activity
+    activity_task = asyncio.create_task(activity_flush_loop(settings.activity_flush_seconds))
+    
+    # 團單截止排程（截止、抽獎、湊團延長、自動催單）
+    from app.services.deadline_scheduler import deadline_scheduler_loop
+    deadline_task = asyncio.create_task(deadline_scheduler_loop(settings.deadline_resync_seconds))
     
     yield
     # Shutdown
+    activity_task.cancel()
+    deadline_task.cancel()
+    from app.services.export_executor import shutdown_export_executor
+    shutdown_export_executor()
+    flushed = flush_activity()
+    logger.info(f"關機前寫回活動時間：{flushed} 筆")
 
 
 app = FastAPI(
@@ -329,8 +418,8 @@ if settings.debug:
 
 
 @app.get("/")
-async def root(request: Request, db: Session = Depends(get_db)):
-    user, new_token = await get_current_user_optional(request, db)
+def root(request: Request, db: Session = Depends(get_db)):
+    user, new_token = get_current_user_optional_sync(request, db)
     if not user:
         return templates.TemplateResponse("login.html", {"request": request})
     
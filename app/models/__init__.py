@@ -7,6 +7,8 @@ from app.models.department import Department, UserDepartment, GroupDepartment, D
 from app.models.treat import TreatRecord
 from app.models.vote import Vote, VoteOption, VoteRecord
 from app.models.template import GroupTemplate
+from app.models.sales import ItemSalesDaily, UserStoreAffinity
+from app.models.settlement import GroupSettlementSnapshot
 
 __all__ = [
     "User",
@@ -30,4 +32,7 @@ __all__ = [
     "VoteOption",
     "VoteRecord",
     "GroupTemplate",
+    "ItemSalesDaily",
+    "UserStoreAffinity",
+    "GroupSettlementSnapshot",
 ]
@@ -20,6 +20,7 @@ class Group(Base):
     category: Mapped[CategoryType] = mapped_column(Enum(CategoryType))
     deadline: Mapped[datetime] = mapped_column(DateTime)
     is_closed: Mapped[bool] = mapped_column(Boolean, default=False)
+    closed_by_deadline: Mapped[bool] = mapped_column(Boolean, default=False)  # 由截止排程關閉（編輯成未來的截止時間可重新開放；團主提早結單的不行）
     is_public: Mapped[bool] = mapped_column(Boolean, default=True)  # 是否公開（所有人可見）
     
     # 外送費
@@ -44,7 +45,15 @@ class Group(Base):
     
     # Phase 5：自動催單
     auto_remind_minutes: Mapped[int | None] = mapped_column(Integer, nullable=True)  # 截止前 N 分鐘催單
-    last_remind_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # 上次催單時間
+    last_remind_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # 上次自動催單時間（台北時間，與 deadline 相同）
+    
+    # 訂單計數（寫入時由 group_counter_service 維護，卡片 / 列表不用載入 orders）
+    submitted_orders: Mapped[int | None] = mapped_column(Integer, nullable=True, default=0)  # 已結單人數
+    pending_orders: Mapped[int | None] = mapped_column(Integer, nullable=True, default=0)  # 購物車有東西但未結單
+    submitted_subtotal: Mapped[Decimal | None] = mapped_column(Numeric(10, 2), nullable=True, default=0)  # 已結單應付合計（不含外送費）
+    
+    # 內容版本（訂單、品項、折扣、請客、截止等異動時 +1，團單頁片段的 ETag 用）
+    version: Mapped[int] = mapped_column(Integer, default=0)
     
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
@@ -68,8 +77,7 @@ class Group(Base):
     @property
     def submitted_count(self) -> int:
         """已結單的人數"""
-        from app.models.order import OrderStatus
-        return len([o for o in self.orders if o.status == OrderStatus.SUBMITTED])
+        return self.submitted_orders or 0
     
     @property
     def has_enough_members(self) -> bool:
@@ -88,8 +96,7 @@ class Group(Base):
     @property
     def pending_count(self) -> int:
         """正在點餐的人數（購物車有東西但未結單）"""
-        from app.models.order import OrderStatus
-        return len([o for o in self.orders if o.status in (OrderStatus.DRAFT, OrderStatus.EDITING) and len(o.items) > 0])
+        return self.pending_orders or 0
     
     @property
     def delivery_fee_per_person(self) -> Decimal:
@@ -101,12 +108,7 @@ class Group(Base):
     @property
     def total_amount(self) -> Decimal:
         """團單總金額（含外送費）"""
-        from app.models.order import OrderStatus
-        subtotal = sum(
-            o.total_amount for o in self.orders 
-            if o.status == OrderStatus.SUBMITTED
-        )
-        return subtotal + (self.delivery_fee or Decimal("0"))
+        return (self.submitted_subtotal or Decimal("0")) + (self.delivery_fee or Decimal("0"))
     
     @property
     def store_display_name(self) -> str:
@@ -154,12 +156,12 @@ class Group(Base):
         if user.is_admin:
             return True
         
-        # 檢查部門是否交集
-        from app.models.department import GroupDepartment, UserDepartment
-        group_dept_ids = {gd.department_id for gd in db.query(GroupDepartment).filter(GroupDepartment.group_id == self.id).all()}
-        user_dept_ids = {ud.department_id for ud in db.query(UserDepartment).filter(UserDepartment.user_id == user.id).all()}
-        
-        return bool(group_dept_ids & user_dept_ids)
+        # 檢查部門是否交集（單一 EXISTS 查詢）
+        from app.services.visibility_service import group_visible_clause
+        return db.query(Group.id).filter(
+            Group.id == self.id,
+            group_visible_clause(user),
+        ).first() is not None
 
 
 # Avoid circular import
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import String, DateTime, Integer, ForeignKey, Enum, JSON, Text, Numeric
+from sqlalchemy import String, DateTime, Integer, ForeignKey, Enum, JSON, Text, Numeric, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.database import Base
 from decimal import Decimal
@@ -22,6 +22,9 @@ class Order(Base):
     snapshot: Mapped[dict | None] = mapped_column(JSON, nullable=True)  # 修改時保留原訂單
     discount_amount: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=0)  # 團主手動折扣金額
     discount_note: Mapped[str | None] = mapped_column(String(100), nullable=True)  # 折扣說明（如「搭主餐」）
+    # 金額（寫入時由 order_total_service 維護，單一真相，所有顯示處共用）
+    items_subtotal: Mapped[Decimal | None] = mapped_column(Numeric(10, 2), nullable=True, default=0)  # 折扣前的品項原價總和
+    total_amount: Mapped[Decimal | None] = mapped_column(Numeric(10, 2), nullable=True, default=0)  # 應付金額 = 原價總和 - 團主折扣
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -30,17 +33,6 @@ class Order(Base):
     user: Mapped["User"] = relationship(back_populates="orders")
     items: Mapped[list["OrderItem"]] = relationship(back_populates="order", cascade="all, delete-orphan")
     
-    @property
-    def items_subtotal(self) -> Decimal:
-        """折扣前的品項原價總和"""
-        return sum(item.subtotal for item in self.items)
-
-    @property
-    def total_amount(self) -> Decimal:
-        """應付金額 = 品項原價總和 - 團主折扣（單一真相，所有顯示處共用）"""
-        total = self.items_subtotal - (self.discount_amount or Decimal("0"))
-        return total if total > 0 else Decimal("0")
-    
     @property
     def total_quantity(self) -> int:
         return sum(item.quantity for item in self.items)
@@ -48,6 +40,9 @@ class Order(Base):
 
 class OrderItem(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        Index("ix_order_items_order_spec", "order_id", "spec_key"),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True)
     order_id: Mapped[int] = mapped_column(ForeignKey("orders.id"))
@@ -59,6 +54,9 @@ class OrderItem(Base):
     quantity: Mapped[int] = mapped_column(Integer, default=1)
     unit_price: Mapped[Decimal] = mapped_column(Numeric(10, 2))
     note: Mapped[str | None] = mapped_column(Text, nullable=True)
+    line_total: Mapped[Decimal | None] = mapped_column(Numeric(10, 2), nullable=True, default=0)  # 小計（寫入時維護）
+    spec_key: Mapped[str | None] = mapped_column(String(40), nullable=True)  # 規格 key（寫入時維護，見 item_spec）
+    spec_label: Mapped[str | None] = mapped_column(String(300), nullable=True)  # 規格文字，如「L / 半糖 / 少冰 / +椰果」
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -79,7 +77,8 @@ class OrderItem(Base):
     
     @property
     def subtotal(self) -> Decimal:
-        return (self.unit_price + self.options_total + self.toppings_total) * self.quantity
+        """小計（單價 + 選項 + 加料）× 數量，讀 line_total 欄位"""
+        return self.line_total or Decimal("0")
 
 
 class OrderItemOption(Base):
@@ -0,0 +1,53 @@
+from datetime import date, datetime
+from sqlalchemy import String, Date, DateTime, ForeignKey, Integer, Index, JSON, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+from app.database import Base
+
+
+class ItemSalesDaily(Base):
+    """品項每日銷量彙總（店家 × 品項 × 規格 × 用戶 × 日）
+
+    只計已結單的訂單，由 sales_rollup_service 在結單 / 修改 / 刪除時增減；
+    熱門品項、常點品項都從這裡查，不用再 GROUP BY order_items。
+    同一組 key 可能因同時寫入而有多列，查詢一律用 SUM。
+    """
+    __tablename__ = "item_sales_daily"
+    __table_args__ = (
+        Index("ix_item_sales_daily_store_date", "store_id", "sales_date"),
+        Index("ix_item_sales_daily_user_store", "user_id", "store_id"),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    sales_date: Mapped[date] = mapped_column(Date)  # 下單日（台北時間）
+    store_id: Mapped[int] = mapped_column(ForeignKey("stores.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    menu_item_id: Mapped[int | None] = mapped_column(Integer, nullable=True)  # 不設 FK，菜單重建後仍保留紀錄
+    item_name: Mapped[str] = mapped_column(String(100))
+    size: Mapped[str | None] = mapped_column(String(10), nullable=True)
+    sugar: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    ice: Mapped[str | None] = mapped_column(String(50), nullable=True)
+    quantity: Mapped[int] = mapped_column(Integer, default=0)  # 杯數 / 份數
+    line_count: Mapped[int] = mapped_column(Integer, default=0)  # 點了幾次（品項筆數）
+
+
+class UserStoreAffinity(Base):
+    """使用者在某店家的點餐習慣（每人每店一列）
+
+    團單頁「上次訂單」「常點」與複製上次訂單都只讀這一列，不用掃歷史訂單；
+    由 affinity_service 在訂單進入 / 離開「已結單」時更新。
+    """
+    __tablename__ = "user_store_affinity"
+    __table_args__ = (
+        UniqueConstraint("user_id", "store_id", name="uq_user_store_affinity"),
+    )
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    store_id: Mapped[int] = mapped_column(ForeignKey("stores.id"))
+    # 最近的已結單訂單 id（新到舊，最多 2 筆：在團單頁要排除目前這團的）；不設 FK，刪團不受影響
+    last_order_ids: Mapped[list] = mapped_column(JSON, default=list)
+    # 常點品項 [{menu_item_id, item_name, quantity, line_count}]（杯數、次數各自的前 N 名）
+    top_items: Mapped[list] = mapped_column(JSON, default=list)
+    # 每個品項最後一次的規格 {menu_item_id: {size, sugar, ice}}（舊到新）
+    last_specs: Mapped[dict] = mapped_column(JSON, default=dict)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,25 @@
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import DateTime, ForeignKey, Integer, JSON, Numeric, Text
+from sqlalchemy.orm import Mapped, mapped_column
+from app.database import Base
+
+
+class GroupSettlementSnapshot(Base):
+    """截止團單的結算快照（每團一列）
+
+    團單截止時由 group_settlement 寫入，內容是當時的 GroupSettlement（店家總項、每人應付、
+    外送費分攤、折扣、抽獎與請客）；匯出、歷史團單、我的訂單、後台列表讀這裡，不再掃訂單。
+    截止後仍有異動（請客、改截止時間重新開放）會讓 groups.version 變動，版本不同就重算覆寫。
+    """
+    __tablename__ = "group_settlements"
+    
+    group_id: Mapped[int] = mapped_column(ForeignKey("groups.id"), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)  # 寫入時的 groups.version
+    people_count: Mapped[int] = mapped_column(Integer, default=0)  # 已結單人數
+    total_qty: Mapped[int] = mapped_column(Integer, default=0)  # 總杯數 / 份數
+    grand_total: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=0)  # 每人應付合計 + 外送費
+    member_user_ids: Mapped[str | None] = mapped_column(Text, nullable=True)  # 已結單的 user_id（逗號分隔）
+    data: Mapped[dict] = mapped_column(JSON)  # 完整結算（見 group_settlement.settlement_to_json）
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
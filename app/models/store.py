@@ -49,6 +49,12 @@ class Store(Base):
     menus: Mapped[list["Menu"]] = relationship(back_populates="store", cascade="all, delete-orphan")
     groups: Mapped[list["Group"]] = relationship(back_populates="store")
     branches: Mapped[list["StoreBranch"]] = relationship(back_populates="store", cascade="all, delete-orphan")
+    
+    @property
+    def logo_src(self) -> str | None:
+        """頁面用的 logo 網址（本機縮圖，還沒抓好時用原網址，見 logo_assets）"""
+        from app.services.logo_assets import logo_src
+        return logo_src(self.logo_url)
 
 
 class StoreBranch(Base):
@@ -5,6 +5,7 @@ from sqlalchemy.orm import Session, joinedload
 from pydantic import ValidationError
 from datetime import datetime, timedelta, timezone
 import json
+from urllib.parse import quote
 
 from app.database import get_db
 from app.config import get_settings
@@ -12,8 +13,11 @@ from app.models.store import Store, StoreOption, CategoryType, OptionType
 from app.models.menu import Menu, MenuCategory, MenuItem, ItemOption
 from app.models.group import Group
 from app.schemas.menu import MenuImport, FullImport, MenuContent
-from app.services.auth import get_admin_user
+from app.services.auth import get_admin_user, get_admin_user_sync, invalidate_auth_user, invalidate_token_version
 from app.services.import_service import import_store_and_menu, import_menu
+from app.services.home_board import invalidate_home_board
+from app.services.menu_cache import invalidate_store_menus
+from app.services.user_search import invalidate_user_search
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -218,6 +222,7 @@ async def activate_menu(store_id: int, menu_id: int, request: Request, db: Sessi
     if menu:
         menu.is_active = True
         db.commit()
+        invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}/menus", status_code=302)
 
@@ -377,13 +382,16 @@ async def do_import(
                 menu=menu_data
             )
             menu = import_menu(db, validated)
+            invalidate_store_menus(menu.store_id)
         elif "store" in data:
             # 完整匯入模式（新增店家 + 菜單）
             validated = FullImport(**data)
             store = import_store_and_menu(db, validated)
+            invalidate_store_menus(store.id)
         else:
             raise HTTPException(status_code=400, detail="JSON 格式錯誤")
         
+        invalidate_home_board("board")
         return RedirectResponse(url="/admin", status_code=302)
     except ValidationError as e:
         raise HTTPException(status_code=400, detail=f"資料驗證錯誤: {e}")
@@ -394,22 +402,42 @@ async def group_list(request: Request, db: Session = Depends(get_db)):
     """所有團單"""
     user = await get_admin_user(request, db)
     
-    groups = db.query(Group).order_by(Group.created_at.desc()).all()
+    groups = db.query(Group).options(
+        joinedload(Group.store),
+        joinedload(Group.owner),
+    ).order_by(Group.created_at.desc()).all()
+    
+    # 測試團標示（與清除測試團同規則：沒有團主以外的人下單），一次查出有別人下單的團
+    from app.models.order import Order
+    groups_with_others = {
+        group_id for group_id, in db.query(Order.group_id).join(Group, Group.id == Order.group_id).filter(
+            Order.user_id != Group.owner_id,
+        ).distinct()
+    }
+    # 截止團單的金額讀結算快照
+    from app.services.group_settlement import snapshot_summaries
+    summaries = snapshot_summaries(db, [g.id for g in groups if g.is_closed])
     
     return templates.TemplateResponse("admin/groups.html", {
         "request": request,
         "user": user,
         "groups": groups,
+        "groups_with_others": groups_with_others,
+        "summaries": summaries,
     })
 
 
 def _delete_group_cascade(db: Session, group: Group):
-    """安全刪團（含 FK 連鎖：請客記錄 / 部門關聯 / 訂單 / 訂單項目的選項與加料）"""
+    """安全刪團（含 FK 連鎖：請客記錄 / 部門關聯 / 結算快照 / 訂單 / 訂單項目的選項與加料）"""
     from app.models.treat import TreatRecord
     from app.models.department import GroupDepartment
     from app.models.order import Order, OrderItemOption, OrderItemTopping
+    from app.models.settlement import GroupSettlementSnapshot
+    from app.services.sales_rollup_service import remove_group_sales
     db.query(TreatRecord).filter(TreatRecord.group_id == group.id).delete()
     db.query(GroupDepartment).filter(GroupDepartment.group_id == group.id).delete()
+    db.query(GroupSettlementSnapshot).filter(GroupSettlementSnapshot.group_id == group.id).delete()
+    remove_group_sales(db, group.id)
     orders = db.query(Order).filter(Order.group_id == group.id).all()
     for order in orders:
         for item in order.items:
@@ -432,6 +460,7 @@ async def cleanup_test_groups(request: Request, db: Session = Depends(get_db)):
             _delete_group_cascade(db, g)
             removed += 1
     db.commit()
+    invalidate_home_board("board")
     return RedirectResponse(url=f"/admin/groups?cleaned={removed}", status_code=302)
 
 
@@ -443,6 +472,7 @@ async def admin_delete_group(group_id: int, request: Request, db: Session = Depe
     if group:
         _delete_group_cascade(db, group)
         db.commit()
+        invalidate_home_board("group_removed", group_id)
     return RedirectResponse(url="/admin/groups", status_code=302)
 
 
@@ -455,6 +485,7 @@ async def toggle_store(store_id: int, request: Request, db: Session = Depends(ge
     if store:
         store.is_active = not store.is_active
         db.commit()
+        invalidate_home_board("board")
     
     # 檢查來源頁面，回到對應頁面
     referer = request.headers.get("referer", "")
@@ -522,9 +553,13 @@ async def delete_store(store_id: int, request: Request, db: Session = Depends(ge
     db.execute(_sql("DELETE FROM store_toppings WHERE store_id = :sid"), {"sid": sid})
     db.execute(_sql("DELETE FROM store_options WHERE store_id = :sid"), {"sid": sid})
     db.execute(_sql("DELETE FROM store_branches WHERE store_id = :sid"), {"sid": sid})
+    db.execute(_sql("DELETE FROM item_sales_daily WHERE store_id = :sid"), {"sid": sid})
+    db.execute(_sql("DELETE FROM user_store_affinity WHERE store_id = :sid"), {"sid": sid})
     db.execute(_sql("DELETE FROM stores WHERE id = :sid"), {"sid": sid})
 
     db.commit()
+    invalidate_store_menus(store_id)
+    invalidate_home_board("board")
     return RedirectResponse(url="/admin/stores", status_code=302)
 
 
@@ -557,6 +592,7 @@ async def update_store_visibility(
             db.add(sd)
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url=f"/admin/stores/{store_id}", status_code=302)
 
@@ -665,6 +701,7 @@ async def update_store(
             store.logo_url = logo_url
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/stores", status_code=302)
 
@@ -724,6 +761,7 @@ async def toggle_user_admin(user_id: int, request: Request, db: Session = Depend
     
     target_user.is_admin = not target_user.is_admin
     db.commit()
+    invalidate_auth_user(target_user.id)
     
     return RedirectResponse(url="/admin/users", status_code=302)
 
@@ -800,7 +838,10 @@ async def cleanup_guest_users(request: Request, db: Session = Depends(get_db)):
 
     params = {"ids": tuple(guest_ids)}
     def _exec(sql):
-        db.execute(_sql(sql).bindparams(bindparam("ids", expanding=True)), params)
+        return db.execute(_sql(sql).bindparams(bindparam("ids", expanding=True)), params)
+
+    # 刪訂單前記下受影響的團，刪完重算團單計數
+    affected_group_ids = [gid for (gid,) in _exec("SELECT DISTINCT group_id FROM orders WHERE user_id IN :ids").all()]
 
     # 依子→父順序斷鏈刪除（訪客的訂單樹）
     _exec("""
@@ -817,13 +858,19 @@ async def cleanup_guest_users(request: Request, db: Session = Depends(get_db)):
     """)
     _exec("DELETE FROM order_items WHERE order_id IN (SELECT id FROM orders WHERE user_id IN :ids)")
     _exec("DELETE FROM orders WHERE user_id IN :ids")
-    for tbl in ["user_departments", "user_favorites", "user_presets"]:
+    for tbl in ["user_departments", "user_favorites", "user_presets", "item_sales_daily", "user_store_affinity"]:
         try:
             _exec(f"DELETE FROM {tbl} WHERE user_id IN :ids")
         except Exception:
             pass
     _exec("DELETE FROM users WHERE id IN :ids")
+    from app.services.group_counter_service import refresh_group_counters
+    for group_id in affected_group_ids:
+        refresh_group_counters(db, group_id)
     db.commit()
+    invalidate_home_board("board")
+    invalidate_auth_user()
+    invalidate_user_search()
 
     return RedirectResponse(
         url=f"/admin/users-duplicates?cleaned={len(guest_ids)}",
@@ -882,6 +929,7 @@ async def logout_all_users(request: Request, db: Session = Depends(get_db)):
         old_version = system_setting.token_version
         system_setting.token_version += 1
         db.commit()
+        invalidate_token_version()
         logger.info(f"管理員 {admin.display_name} 執行一鍵登出，token_version: {old_version} → {system_setting.token_version}")
     
     return RedirectResponse(url="/admin/users?logout_all=success", status_code=302)
@@ -912,6 +960,7 @@ async def add_branch(
     )
     db.add(branch)
     db.commit()
+    invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}", status_code=302)
 
@@ -935,6 +984,7 @@ async def delete_branch(
     if branch:
         db.delete(branch)
         db.commit()
+        invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}", status_code=302)
 
@@ -963,6 +1013,7 @@ async def update_branch(
         branch.phone = phone.strip() if phone else None
         branch.address = address.strip() if address else None
         db.commit()
+        invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}", status_code=302)
 
@@ -986,6 +1037,7 @@ async def toggle_branch(
     if branch:
         branch.is_active = not branch.is_active
         db.commit()
+        invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}", status_code=302)
 
@@ -1020,6 +1072,7 @@ async def add_topping(
     )
     db.add(topping)
     db.commit()
+    invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}/edit", status_code=302)
 
@@ -1043,6 +1096,7 @@ async def delete_topping(
     if topping:
         db.delete(topping)
         db.commit()
+        invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}/edit", status_code=302)
 
@@ -1066,6 +1120,7 @@ async def toggle_topping(
     if topping:
         topping.is_active = not topping.is_active
         db.commit()
+        invalidate_store_menus(store_id)
     
     return RedirectResponse(url=f"/admin/stores/{store_id}/edit", status_code=302)
 
@@ -1090,10 +1145,80 @@ async def update_announcement(
         db.add(settings)
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url="/admin", status_code=302)
 
 
+@router.get("/export-stats")
+async def export_stats_view(request: Request, db: Session = Depends(get_db)):
+    """匯出執行器狀態（各種匯出的排隊數、執行中、平均耗時）"""
+    await get_admin_user(request, db)
+    
+    from app.services.export_executor import export_stats
+    return export_stats()
+
+
+EXCEL_RANGE_MAX_DAYS = 366
+
+
+@router.get("/export/orders.xlsx")
+def export_orders_range(
+    request: Request,
+    start: str | None = None,
+    end: str | None = None,
+    layout: str = "store",
+    db: Session = Depends(get_db),
+):
+    """匯出日期區間（依截止日，台北時間，含頭尾）所有團單的訂單明細，串流下載
+
+    layout=store 每個店家一個工作表，layout=flat 全部放在同一個工作表。
+    """
+    get_admin_user_sync(request, db)
+    db.close()  # 串流時自己開 session，不佔著請求的連線
+
+    from starlette.background import BackgroundTask
+    from fastapi.responses import StreamingResponse
+    from app.services.excel_service import EXCEL_LAYOUTS, stream_orders_excel
+    from app.services.export_executor import acquire_export_slot
+
+    today = datetime.now(timezone(timedelta(hours=8))).date()
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else today.replace(day=1)
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else today
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日期格式錯誤（YYYY-MM-DD）")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="結束日期不能早於開始日期")
+    if (end_date - start_date).days >= EXCEL_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"一次最多匯出 {EXCEL_RANGE_MAX_DAYS} 天")
+    if layout not in EXCEL_LAYOUTS:
+        raise HTTPException(status_code=400, detail="不支援的匯出格式")
+
+    slot = acquire_export_slot("excel_range")
+
+    def body():
+        ok = False
+        try:
+            yield from stream_orders_excel(
+                datetime.combine(start_date, datetime.min.time()),
+                datetime.combine(end_date + timedelta(days=1), datetime.min.time()),
+                layout,
+            )
+            ok = True
+        finally:
+            slot.release(ok)
+
+    filename = f"訂單_{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}.xlsx"
+    return StreamingResponse(
+        body(),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+        # 沒開始傳就斷線時 generator 不會執行，由 background task 歸還名額（release 可重複呼叫）
+        background=BackgroundTask(slot.release, False),
+    )
+
+
 @router.get("/feedbacks")
 async def feedback_list(request: Request, db: Session = Depends(get_db)):
     """問題回報列表"""
@@ -1187,29 +1312,21 @@ async def department_detail(request: Request, dept_id: int, db: Session = Depend
     user = await get_admin_user(request, db)
     
     from app.models.department import Department, UserDepartment
-    from app.models.user import User
     
     department = db.query(Department).filter(Department.id == dept_id).first()
     if not department:
         raise HTTPException(status_code=404, detail="部門不存在")
     
+    # 新增成員的候選名單由 /users/search 依輸入搜尋（排除已加入的），不再載入全部用戶
     members = db.query(UserDepartment).filter(
         UserDepartment.department_id == dept_id
     ).all()
     
-    # 取得尚未加入此部門的用戶
-    member_ids = [m.user_id for m in members]
-    available_users = db.query(User).filter(
-        User.is_guest == False,
-        ~User.id.in_(member_ids) if member_ids else True
-    ).order_by(User.display_name).all()
-    
     return templates.TemplateResponse("admin/department_detail.html", {
         "request": request,
         "user": user,
         "department": department,
         "members": members,
-        "available_users": available_users,
     })
 
 
@@ -1377,6 +1494,7 @@ async def create_announcement(
     _sync_announcement_from_active(db)
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/announcements", status_code=302)
 
@@ -1393,6 +1511,7 @@ async def toggle_announcement(ann_id: int, request: Request, db: Session = Depen
         ann.is_active = not ann.is_active
         _sync_announcement_from_active(db)
         db.commit()
+        invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/announcements", status_code=302)
 
@@ -1409,6 +1528,7 @@ async def pin_announcement(ann_id: int, request: Request, db: Session = Depends(
         ann.is_pinned = True
         _sync_announcement_from_active(db)
         db.commit()
+        invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/announcements", status_code=302)
 
@@ -1425,6 +1545,7 @@ async def unpin_announcement(ann_id: int, request: Request, db: Session = Depend
         ann.is_pinned = False
         _sync_announcement_from_active(db)
         db.commit()
+        invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/announcements", status_code=302)
 
@@ -1441,6 +1562,7 @@ async def delete_announcement(ann_id: int, request: Request, db: Session = Depen
         db.delete(ann)
         _sync_announcement_from_active(db)
         db.commit()
+        invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/announcements", status_code=302)
 
@@ -1501,6 +1623,7 @@ async def update_announcement(
     
     _sync_announcement_from_active(db)
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/announcements", status_code=302)
 
@@ -1600,6 +1723,7 @@ async def approve_recommendation(
     rec.created_store_id = new_store.id
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url="/admin/recommendations", status_code=302)
 
@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Request, Depends, Form, HTTPException
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from sqlalchemy.orm import Session, joinedload
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal, InvalidOperation
 from urllib.parse import quote
-import qrcode
-import io
 import base64
 
 from app.config import get_settings
@@ -14,10 +12,25 @@ from app.database import get_db
 from app.models.group import Group
 from app.models.store import Store, StoreBranch, CategoryType
 from app.models.menu import Menu, MenuItem
-from app.models.order import Order, OrderItem, OrderStatus
+from app.models.order import Order, OrderStatus
 from app.models.user import User
-from app.services.auth import get_current_user, get_current_user_optional
+from app.services.auth import get_current_user_sync, get_current_user_optional_sync
+from app.services.visibility_service import store_visible_clause
 from app.services.export_service import generate_order_text, generate_payment_text
+from app.services.group_settlement import freeze_settlements, get_settlement
+from app.services.home_board import invalidate_home_board
+from app.services.group_counter_service import refresh_group_counters
+from app.services.group_version import bump_group_version
+from app.services.group_page import load_group_page
+from app.services.menu_cache import render_menu_section
+from app.services.order_wall_events import queue_order_wall_event, publish_wall_refresh
+from app.services.deadline_scheduler import pick_lucky_winners, schedule_group
+from app.services.receipt_cache import get_receipt_pdf, get_receipt_png, prewarm_receipts
+from app.services.export_executor import render_qrcode_png, run_export
+from app.services.order_total_service import refresh_order_totals
+from app.services.user_search import invalidate_user_search
+from app.services.sales_rollup_service import remove_group_sales
+from app.services import order_commands
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -41,35 +54,19 @@ templates.env.filters['taipei'] = to_taipei_time
 
 
 @router.get("/new")
-async def new_group_page(request: Request, store_id: int = None, db: Session = Depends(get_db)):
+def new_group_page(request: Request, store_id: int = None, db: Session = Depends(get_db)):
     """開團頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
-    # 取得用戶的部門 IDs
-    from app.models.department import Department, UserDepartment, StoreDepartment
-    user_dept_ids = [ud.department_id for ud in db.query(UserDepartment).filter(
-        UserDepartment.user_id == user.id
-    ).all()]
+    from app.models.department import Department
     
-    # 取得啟用中的店家（含分店）
-    all_stores = db.query(Store).options(
+    # 取得啟用中且用戶可見的店家（含分店）
+    stores = db.query(Store).options(
         joinedload(Store.branches)
-    ).filter(Store.is_active == True).all()
-    
-    # 過濾用戶可見的店家
-    visible_stores = []
-    for s in all_stores:
-        if s.is_public:
-            visible_stores.append(s)
-        elif user.is_admin:
-            visible_stores.append(s)
-        else:
-            store_dept_ids = {sd.department_id for sd in db.query(StoreDepartment).filter(
-                StoreDepartment.store_id == s.id
-            ).all()}
-            if store_dept_ids & set(user_dept_ids):
-                visible_stores.append(s)
-    stores = visible_stores
+    ).filter(
+        Store.is_active == True,
+        store_visible_clause(user),
+    ).all()
     
     # 取得啟用中的部門
     departments = db.query(Department).filter(Department.is_active == True).all()
@@ -91,7 +88,7 @@ async def new_group_page(request: Request, store_id: int = None, db: Session = D
 
 
 @router.post("")
-async def create_group(
+def create_group(
     request: Request,
     store_id: int = Form(...),
     name: str = Form(...),
@@ -111,16 +108,13 @@ async def create_group(
     auto_extend: bool = Form(False),
     auto_remind_minutes: int = Form(None),
     i_treat: bool = Form(False),
+    department_ids: list[str] = Form(default=[]),
     db: Session = Depends(get_db),
 ):
     """建立團單"""
     from decimal import Decimal
     
-    user = await get_current_user(request, db)
-    
-    # 取得 department_ids（多選）
-    form_data = await request.form()
-    department_ids = form_data.getlist("department_ids")
+    user = get_current_user_sync(request, db)
     
     # 取得店家
     store = db.query(Store).filter(Store.id == store_id).first()
@@ -179,17 +173,17 @@ async def create_group(
             db.add(gd)
     
     db.commit()
+    invalidate_home_board("group_opened", group.id)
     db.refresh(group)
+    schedule_group(group)
     
     return RedirectResponse(url=f"/groups/{group.id}", status_code=302)
 
 
 @router.get("/{group_id}")
-async def group_page(group_id: int, request: Request, db: Session = Depends(get_db)):
+def group_page(group_id: int, request: Request, db: Session = Depends(get_db)):
     """團單頁面"""
-    from app.models.user import User
-    
-    user, new_token = await get_current_user_optional(request, db)
+    user, new_token = get_current_user_optional_sync(request, db)
     
     # 未登入：導向登入頁面，登入後回來
     if not user:
@@ -199,179 +193,29 @@ async def group_page(group_id: int, request: Request, db: Session = Depends(get_
             status_code=302
         )
     
-    group = db.query(Group).filter(Group.id == group_id).first()
-    if not group:
+    page = load_group_page(db, group_id, user)
+    if not page:
         raise HTTPException(status_code=404, detail="團單不存在")
-    
-    # 載入 store 及其 toppings（用於加料選項）
-    from app.models.store import Store, StoreTopping
-    store = db.query(Store).filter(Store.id == group.store_id).options(
-        joinedload(Store.toppings),
-        joinedload(Store.branches)
-    ).first()
-    
-    # 如果團單已過期且啟用隨機免單但尚未抽獎，進行抽獎
-    if not group.is_open and group.enable_lucky_draw and not group.lucky_winner_ids:
-        import random
-        submitted_for_draw = db.query(Order).filter(
-            Order.group_id == group_id,
-            Order.status == OrderStatus.SUBMITTED
-        ).all()
-        if submitted_for_draw:
-            winner_count = min(group.lucky_draw_count, len(submitted_for_draw))
-            winners = random.sample(submitted_for_draw, winner_count)
-            group.lucky_winner_ids = ",".join(str(o.user_id) for o in winners)
-            db.commit()
-    
-    # 取得已結單的訂單（訂單牆）- 使用 eager loading
-    submitted_orders = db.query(Order).filter(
-        Order.group_id == group_id,
-        Order.status == OrderStatus.SUBMITTED,
-    ).options(
-        joinedload(Order.user),
-        joinedload(Order.items).joinedload(OrderItem.selected_options),
-        joinedload(Order.items).joinedload(OrderItem.selected_toppings)
-    ).all()
-    
-    # 取得我的訂單 - 使用 eager loading
-    my_order = db.query(Order).filter(
-        Order.group_id == group_id,
-        Order.user_id == user.id,
-    ).options(
-        joinedload(Order.items).joinedload(OrderItem.selected_options),
-        joinedload(Order.items).joinedload(OrderItem.selected_toppings)
-    ).first()
-    
-    # 統計未結單人數
-    pending_count = db.query(Order).filter(
-        Order.group_id == group_id,
-        Order.status.in_([OrderStatus.DRAFT, OrderStatus.EDITING])
-    ).count()
-    
-    # 取得未結單的訂單（用於催單）
-    pending_orders = []
-    if group.owner_id == user.id or user.is_admin:
-        pending_orders = db.query(Order).filter(
-            Order.group_id == group_id,
-            Order.status.in_([OrderStatus.DRAFT, OrderStatus.EDITING])
-        ).options(
-            joinedload(Order.user),
-            joinedload(Order.items)
-        ).all()
-        # 只保留有品項的訂單
-        pending_orders = [o for o in pending_orders if len(o.items) > 0]
-    
-    # 取得用戶在同店家的上次訂單（用於複製上次訂單）
-    last_order = None
-    last_order_items = []
-    previous_order = db.query(Order).join(Group).filter(
-        Group.store_id == group.store_id,
-        Order.user_id == user.id,
-        Order.status == OrderStatus.SUBMITTED,
-        Order.group_id != group_id  # 排除當前團
-    ).order_by(Order.created_at.desc()).first()
-    
-    if previous_order:
-        last_order = previous_order
-        last_order_items = previous_order.items
-    
-    # 取得用戶在同店家的常點品項（統計前 5 名）
-    from sqlalchemy import func
-    favorite_items = db.query(
-        OrderItem.item_name,
-        OrderItem.menu_item_id,
-        func.count(OrderItem.id).label('count')
-    ).join(Order).join(Group).filter(
-        Group.store_id == group.store_id,
-        Order.user_id == user.id,
-        Order.status == OrderStatus.SUBMITTED
-    ).group_by(OrderItem.item_name, OrderItem.menu_item_id).order_by(
-        func.count(OrderItem.id).desc()
-    ).limit(5).all()
-    
-    # 取得該店家熱門品項（全站統計，最近 30 天）
-    from datetime import timedelta
-    thirty_days_ago = datetime.now(TAIPEI_TZ).replace(tzinfo=None) - timedelta(days=30)
-    hot_items = db.query(
-        OrderItem.item_name,
-        OrderItem.menu_item_id,
-        func.sum(OrderItem.quantity).label('total_qty')
-    ).join(Order).join(Group).filter(
-        Group.store_id == group.store_id,
-        Order.status == OrderStatus.SUBMITTED,
-        Order.created_at >= thirty_days_ago
-    ).group_by(OrderItem.item_name, OrderItem.menu_item_id).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(5).all()
-    
-    # 取得菜單品項（含分類）
-    menu = group.menu
-
-    # 個人常點（此使用者在此店家點過最多的品項，對應到目前菜單中可點的）
-    my_freq_rows = db.query(
-        OrderItem.menu_item_id,
-        func.sum(OrderItem.quantity).label('cnt')
-    ).join(Order).join(Group).filter(
-        Order.user_id == user.id,
-        Group.store_id == group.store_id,
-        OrderItem.menu_item_id.isnot(None)
-    ).group_by(OrderItem.menu_item_id).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(8).all()
-    _freq_ids = [r[0] for r in my_freq_rows]
-    _menu_items_by_id = {}
-    for _cat in menu.categories:
-        for _it in _cat.items:
-            _menu_items_by_id[_it.id] = _it
-    my_frequent = [_menu_items_by_id[i] for i in _freq_ids if i in _menu_items_by_id][:4]
-    
-    # 取得所有用戶（用於轉移團主）
-    all_users = []
-    if group.owner_id == user.id or user.is_admin:
-        all_users = db.query(User).order_by(User.display_name).all()
-    
-    # 檢查是否已收藏此店家
-    from app.models.user import UserFavorite
-    is_favorited = db.query(UserFavorite).filter(
-        UserFavorite.user_id == user.id,
-        UserFavorite.store_id == group.store_id
-    ).first() is not None
-    
-    # 取得請客者資訊
-    treat_user = None
-    if group.treat_user_id:
-        treat_user = db.query(User).filter(User.id == group.treat_user_id).first()
-    
+    group = page.group
+    # 截止後的抽獎由截止排程處理（deadline_scheduler），這裡只讀
+    menu = page.menu
     return templates.TemplateResponse("group.html", {
         "request": request,
         "user": user,
-        "group": group,
-        "store": store,
-        "branch": next((b for b in store.branches if b.id == group.branch_id), None) if group.branch_id else None,
-        "menu": menu,
-        "submitted_orders": submitted_orders,
-        "my_order": my_order,
-        "pending_count": pending_count,
-        "pending_orders": pending_orders,
-        "last_order": last_order,
-        "last_order_items": last_order_items,
-        "favorite_items": favorite_items,
-        "hot_items": hot_items,
-        "my_frequent": my_frequent,
+        **page.as_context(),
+        "branch": menu.get_branch(group.branch_id) if menu else None,
+        "menu_html": render_menu_section(menu) if menu and group.is_open else "",
+        "menu_asset_url": menu.asset_url if menu else None,
         "is_owner": group.owner_id == user.id,
         "is_admin": user.is_admin,
         "is_open": group.is_open,
-        "all_users": all_users,
-        "is_favorited": is_favorited,
-        "treat_user": treat_user,
     })
 
 
 @router.post("/{group_id}/close")
-async def close_group(group_id: int, request: Request, db: Session = Depends(get_db)):
+def close_group(group_id: int, request: Request, db: Session = Depends(get_db)):
     """提前截止團單"""
-    import random
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -381,6 +225,7 @@ async def close_group(group_id: int, request: Request, db: Session = Depends(get
         raise HTTPException(status_code=403, detail="只有團主可以截止團單")
     
     group.is_closed = True
+    group.closed_by_deadline = False  # 團主手動截止：之後改截止時間也不會重新開放
     
     # 如果啟用隨機免單，進行抽獎
     if group.enable_lucky_draw and not group.lucky_winner_ids:
@@ -393,19 +238,22 @@ async def close_group(group_id: int, request: Request, db: Session = Depends(get
         
         if submitted_orders:
             # 抽選幸運兒
-            winner_count = min(group.lucky_draw_count, len(submitted_orders))
-            winners = random.sample(submitted_orders, winner_count)
-            group.lucky_winner_ids = ",".join(str(o.user_id) for o in winners)
+            group.lucky_winner_ids = pick_lucky_winners([o.user_id for o in submitted_orders], group.lucky_draw_count)
     
+    bump_group_version(group)
     db.commit()
+    freeze_settlements([group_id])
+    invalidate_home_board("group_closed", group_id)
+    publish_wall_refresh(group_id)
+    prewarm_receipts(group_id)
     
     return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
 
 @router.post("/{group_id}/delete")
-async def delete_group(group_id: int, request: Request, db: Session = Depends(get_db)):
+def delete_group(group_id: int, request: Request, db: Session = Depends(get_db)):
     """刪除團單"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -422,8 +270,13 @@ async def delete_group(group_id: int, request: Request, db: Session = Depends(ge
     from app.models.department import GroupDepartment
     db.query(GroupDepartment).filter(GroupDepartment.group_id == group_id).delete()
     
-    # 刪除相關訂單和訂單項目
+    # 刪除結算快照
+    from app.models.settlement import GroupSettlementSnapshot
+    db.query(GroupSettlementSnapshot).filter(GroupSettlementSnapshot.group_id == group_id).delete()
+    
+    # 刪除相關訂單和訂單項目（先從銷量彙總扣掉）
     from app.models.order import OrderItemOption, OrderItemTopping
+    remove_group_sales(db, group_id)
     orders = db.query(Order).filter(Order.group_id == group_id).all()
     for order in orders:
         for item in order.items:
@@ -436,14 +289,15 @@ async def delete_group(group_id: int, request: Request, db: Session = Depends(ge
     
     db.delete(group)
     db.commit()
+    invalidate_home_board("group_removed", group_id)
     
     return RedirectResponse(url="/home", status_code=302)
 
 
 @router.post("/{group_id}/treat")
-async def set_treat(group_id: int, request: Request, db: Session = Depends(get_db)):
+def set_treat(group_id: int, request: Request, db: Session = Depends(get_db)):
     """設定請客"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -470,15 +324,17 @@ async def set_treat(group_id: int, request: Request, db: Session = Depends(get_d
         amount=group.total_amount
     )
     db.add(treat_record)
+    bump_group_version(group)
     db.commit()
+    publish_wall_refresh(group_id)
     
     return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
 
 @router.post("/{group_id}/cancel-treat")
-async def cancel_treat(group_id: int, request: Request, db: Session = Depends(get_db)):
+def cancel_treat(group_id: int, request: Request, db: Session = Depends(get_db)):
     """取消請客"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -496,15 +352,17 @@ async def cancel_treat(group_id: int, request: Request, db: Session = Depends(ge
     ).delete()
     
     group.treat_user_id = None
+    bump_group_version(group)
     db.commit()
+    publish_wall_refresh(group_id)
     
     return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
 
 @router.get("/{group_id}/treat-history")
-async def treat_history(group_id: int, request: Request, db: Session = Depends(get_db)):
+def treat_history(group_id: int, request: Request, db: Session = Depends(get_db)):
     """查看請客記錄"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -535,7 +393,7 @@ async def treat_history(group_id: int, request: Request, db: Session = Depends(g
 
 
 @router.get("/{group_id}/qrcode")
-async def group_qrcode(group_id: int, db: Session = Depends(get_db)):
+def group_qrcode(group_id: int, db: Session = Depends(get_db)):
     """產生 QR Code"""
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -543,16 +401,8 @@ async def group_qrcode(group_id: int, db: Session = Depends(get_db)):
     
     url = f"{settings.base_url}/groups/{group_id}"
     
-    # 產生 QR Code
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # 轉為 base64
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    img_str = base64.b64encode(buffer.getvalue()).decode()
+    # 產生 QR Code（匯出執行器），轉為 base64
+    img_str = base64.b64encode(run_export("qrcode", render_qrcode_png, url)).decode()
     
     return HTMLResponse(
         content=f'<img src="data:image/png;base64,{img_str}" alt="QR Code" />',
@@ -561,75 +411,16 @@ async def group_qrcode(group_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/{group_id}/orders/copy-last")
-async def copy_last_order(group_id: int, request: Request, db: Session = Depends(get_db)):
+def copy_last_order(group_id: int, request: Request, db: Session = Depends(get_db)):
     """複製上次訂單到購物車"""
-    user = await get_current_user(request, db)
-    
-    group = db.query(Group).filter(Group.id == group_id).first()
-    if not group:
-        raise HTTPException(status_code=404, detail="團單不存在")
-    
-    if not group.is_open:
-        raise HTTPException(status_code=400, detail="團單已截止")
-    
-    # 找到上次在同店家的訂單
-    previous_order = db.query(Order).join(Group).filter(
-        Group.store_id == group.store_id,
-        Order.user_id == user.id,
-        Order.status == OrderStatus.SUBMITTED,
-        Order.group_id != group_id
-    ).order_by(Order.created_at.desc()).first()
-    
-    if not previous_order:
-        raise HTTPException(status_code=404, detail="找不到上次訂單")
-    
-    # 取得或建立當前訂單
-    my_order = db.query(Order).filter(
-        Order.group_id == group_id,
-        Order.user_id == user.id
-    ).first()
-    
-    if not my_order:
-        my_order = Order(
-            group_id=group_id,
-            user_id=user.id,
-            status=OrderStatus.DRAFT,
-        )
-        db.add(my_order)
-        db.flush()
-    elif my_order.status == OrderStatus.SUBMITTED:
-        # 已結單，先改為編輯狀態
-        my_order.status = OrderStatus.EDITING
-    
-    # 複製品項
-    for old_item in previous_order.items:
-        # 檢查品項是否還在菜單上
-        menu_item = db.query(MenuItem).filter(
-            MenuItem.id == old_item.menu_item_id,
-            MenuItem.menu_id == group.menu_id
-        ).first()
-        
-        if menu_item:  # 品項還存在才複製
-            new_item = OrderItem(
-                order_id=my_order.id,
-                menu_item_id=old_item.menu_item_id,
-                item_name=old_item.item_name,
-                size=old_item.size,
-                price=old_item.price,
-                sugar=old_item.sugar,
-                ice=old_item.ice,
-                quantity=old_item.quantity,
-                note=old_item.note,
-            )
-            db.add(new_item)
-    
-    db.commit()
+    user = get_current_user_sync(request, db)
+    order_commands.copy_last(db, group_id, user.id)
     
     return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
 
 @router.post("/{group_id}/orders/{order_id}/discount")
-async def set_order_discount(
+def set_order_discount(
     group_id: int,
     order_id: int,
     request: Request,
@@ -638,7 +429,7 @@ async def set_order_discount(
     db: Session = Depends(get_db),
 ):
     """團主/管理員對某人訂單設定折扣（店家優惠，連動所有金額處）"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
 
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -666,15 +457,18 @@ async def set_order_discount(
 
     order.discount_amount = amt
     order.discount_note = (discount_note.strip()[:100] or None) if amt > 0 else None
+    refresh_order_totals(db, order)
+    refresh_group_counters(db, group_id)
+    queue_order_wall_event(db, group_id, order.id)
     db.commit()
 
     return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
 
 @router.get("/{group_id}/copy")
-async def copy_group_page(group_id: int, request: Request, db: Session = Depends(get_db)):
+def copy_group_page(group_id: int, request: Request, db: Session = Depends(get_db)):
     """複製開團頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -697,9 +491,9 @@ async def copy_group_page(group_id: int, request: Request, db: Session = Depends
 
 
 @router.get("/{group_id}/export/order")
-async def export_order(group_id: int, request: Request, db: Session = Depends(get_db)):
+def export_order(group_id: int, request: Request, db: Session = Depends(get_db)):
     """匯出點餐文字"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -721,9 +515,9 @@ async def export_order(group_id: int, request: Request, db: Session = Depends(ge
 
 
 @router.get("/{group_id}/export/payment")
-async def export_payment(group_id: int, request: Request, db: Session = Depends(get_db)):
+def export_payment(group_id: int, request: Request, db: Session = Depends(get_db)):
     """匯出收款文字"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -745,7 +539,7 @@ async def export_payment(group_id: int, request: Request, db: Session = Depends(
 
 
 @router.post("/{group_id}/edit")
-async def edit_group(
+def edit_group(
     group_id: int,
     request: Request,
     name: str = Form(...),
@@ -757,7 +551,7 @@ async def edit_group(
     """編輯團單"""
     from decimal import Decimal
     
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -779,17 +573,29 @@ async def edit_group(
     if deadline:
         try:
             deadline_dt = datetime.fromisoformat(deadline)
+            now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+            # 截止排程關掉的團改到未來 = 重新開團；團主手動截止的團維持截止
+            if group.is_closed and group.closed_by_deadline and now < deadline_dt:
+                group.is_closed = False
+                group.closed_by_deadline = False
+                # 重新開放後有新訂單：截止時重新抽獎、重新催單
+                group.lucky_winner_ids = None
+                group.last_remind_at = None
             group.deadline = deadline_dt
+            schedule_group(group)
         except ValueError:
             pass
     
+    bump_group_version(group)
     db.commit()
+    invalidate_home_board("group_updated", group_id)
+    publish_wall_refresh(group_id)
     
     return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
 
 @router.post("/{group_id}/transfer")
-async def transfer_group(
+def transfer_group(
     group_id: int,
     request: Request,
     new_owner_id: int = Form(...),
@@ -800,7 +606,7 @@ async def transfer_group(
     import logging
     logger = logging.getLogger("groups")
     
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -817,7 +623,9 @@ async def transfer_group(
     
     old_owner_name = group.owner.display_name
     group.owner_id = new_owner_id
+    bump_group_version(group)
     db.commit()
+    invalidate_home_board("group_updated", group_id)
     
     logger.info(f"團單 {group_id} 團主從 {old_owner_name} 轉移到 {new_owner.display_name}")
     
@@ -825,15 +633,12 @@ async def transfer_group(
 
 
 @router.get("/{group_id}/export/excel")
-async def export_excel(request: Request, group_id: int, db: Session = Depends(get_db)):
+def export_excel(request: Request, group_id: int, db: Session = Depends(get_db)):
     """匯出訂單為 Excel"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
-    group = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.orders).joinedload(Order.user),
-        joinedload(Group.orders).joinedload(Order.items)
-    ).filter(Group.id == group_id).first()
+    # 訂單由團單結算查（同一版本只查一次）
+    group = db.query(Group).filter(Group.id == group_id).first()
     
     if not group:
         raise HTTPException(status_code=404, detail="團單不存在")
@@ -842,16 +647,16 @@ async def export_excel(request: Request, group_id: int, db: Session = Depends(ge
     if group.owner_id != user.id and not user.is_admin:
         raise HTTPException(status_code=403, detail="只有團主可以匯出")
     
-    from app.services.excel_service import export_orders_to_excel
+    from app.services.excel_service import excel_snapshot, render_orders_excel
     
-    excel_file = export_orders_to_excel(group, group.orders)
+    excel_bytes = run_export("excel", render_orders_excel, excel_snapshot(get_settlement(db, group)))
     
     # 檔名
     filename = f"{group.name}_{group.deadline.strftime('%Y%m%d')}.xlsx"
     encoded_filename = quote(filename)
     
-    return StreamingResponse(
-        excel_file,
+    return Response(
+        excel_bytes,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={
             "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
@@ -860,28 +665,24 @@ async def export_excel(request: Request, group_id: int, db: Session = Depends(ge
 
 
 @router.get("/{group_id}/export/receipt.pdf")
-async def export_receipt_pdf(request: Request, group_id: int, db: Session = Depends(get_db)):
+def export_receipt_pdf(request: Request, group_id: int, db: Session = Depends(get_db)):
     """匯出訂單核對單 PDF（給團主跟店家核對）"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
 
-    group = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.orders).joinedload(Order.user),
-        joinedload(Group.orders).joinedload(Order.items),
-    ).filter(Group.id == group_id).first()
+    # 訂單由核對單自己查（快取命中時完全不用查）
+    group = db.query(Group).filter(Group.id == group_id).first()
 
     if not group:
         raise HTTPException(status_code=404, detail="團單不存在")
     if group.owner_id != user.id and not user.is_admin:
         raise HTTPException(status_code=403, detail="只有團主可以匯出")
 
-    from app.services.receipt_service import generate_receipt_pdf
-    pdf_file = generate_receipt_pdf(db, group)
+    pdf_bytes = get_receipt_pdf(db, group)
 
     filename = f"{group.name}_核對單_{group.deadline.strftime('%Y%m%d')}.pdf"
     encoded_filename = quote(filename)
-    return StreamingResponse(
-        pdf_file,
+    return Response(
+        pdf_bytes,
         media_type="application/pdf",
         headers={
             "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
@@ -890,28 +691,23 @@ async def export_receipt_pdf(request: Request, group_id: int, db: Session = Depe
 
 
 @router.get("/{group_id}/export/receipt.png")
-async def export_receipt_png(request: Request, group_id: int, db: Session = Depends(get_db)):
+def export_receipt_png(request: Request, group_id: int, db: Session = Depends(get_db)):
     """匯出訂單核對單 PNG（方便貼 LINE 給店家）"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
 
-    group = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.orders).joinedload(Order.user),
-        joinedload(Group.orders).joinedload(Order.items),
-    ).filter(Group.id == group_id).first()
+    group = db.query(Group).filter(Group.id == group_id).first()
 
     if not group:
         raise HTTPException(status_code=404, detail="團單不存在")
     if group.owner_id != user.id and not user.is_admin:
         raise HTTPException(status_code=403, detail="只有團主可以匯出")
 
-    from app.services.receipt_service import generate_receipt_png
-    png_file = generate_receipt_png(db, group)
+    png_bytes = get_receipt_png(db, group)
 
     filename = f"{group.name}_核對單_{group.deadline.strftime('%Y%m%d')}.png"
     encoded_filename = quote(filename)
-    return StreamingResponse(
-        png_file,
+    return Response(
+        png_bytes,
         media_type="image/png",
         headers={
             "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
@@ -926,10 +722,10 @@ GUEST_MODE_ENABLED = False
 
 
 @router.post("/{group_id}/guest-link")
-async def generate_guest_link(group_id: int, request: Request, db: Session = Depends(get_db)):
+def generate_guest_link(group_id: int, request: Request, db: Session = Depends(get_db)):
     """產生分享連結（點連結的人需用自己的 LINE 登入才能跟團）"""
     import hashlib
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
 
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
@@ -946,7 +742,7 @@ async def generate_guest_link(group_id: int, request: Request, db: Session = Dep
 
 
 @router.get("/{group_id}/guest")
-async def guest_access(group_id: int, token: str, request: Request, db: Session = Depends(get_db)):
+def guest_access(group_id: int, token: str, request: Request, db: Session = Depends(get_db)):
     """分享連結存取：驗證 token 後，未登入導去 LINE 登入、登入後回團單"""
     import hashlib
 
@@ -962,8 +758,7 @@ async def guest_access(group_id: int, token: str, request: Request, db: Session
         raise HTTPException(status_code=403, detail="無效的連結")
 
     # 已登入 → 直接進團單
-    from app.services.auth import get_current_user_optional
-    user, _ = await get_current_user_optional(request, db)
+    user, _ = get_current_user_optional_sync(request, db)
     if user:
         return RedirectResponse(url=f"/groups/{group_id}", status_code=302)
 
@@ -973,7 +768,7 @@ async def guest_access(group_id: int, token: str, request: Request, db: Session
 
 
 @router.post("/{group_id}/guest")
-async def guest_enter(
+def guest_enter(
     group_id: int,
     token: str = Form(...),
     guest_name: str = Form(...),
@@ -1010,6 +805,7 @@ async def guest_enter(
     db.add(guest_user)
     db.commit()
     db.refresh(guest_user)
+    invalidate_user_search()
     
     # 建立 JWT token
     from app.services.auth import create_access_token
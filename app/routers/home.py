@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Depends, Form, HTTPException, UploadFile, File
+from fastapi import APIRouter, Request, Depends, Form, HTTPException, UploadFile, File, Query
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session, joinedload
@@ -9,8 +9,11 @@ from app.database import get_db
 from app.models.group import Group
 from app.models.order import Order, OrderItem, OrderStatus
 from app.models.store import CategoryType, Store
-from app.models.user import SystemSetting
-from app.services.auth import get_current_user
+from app.services.auth import get_current_user_sync, load_user, invalidate_auth_user
+from app.services.visibility_service import group_visible_clause, get_user_department_ids, filter_visible_groups
+from app.services.group_settlement import load_settlement_snapshots, snapshot_summaries
+from app.services.home_board import build_home_context, get_home_board
+from app.services.user_search import invalidate_user_search
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -29,303 +32,70 @@ def to_taipei_time(dt):
 templates.env.filters['taipei'] = to_taipei_time
 
 
-def get_hot_items(db: Session, limit: int = 10):
-    """取得全站熱門品項（最近 30 天）"""
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
-    hot_items = db.query(
-        OrderItem.item_name,
-        Store.name.label('store_name'),
-        Store.logo_url.label('store_logo'),
-        func.sum(OrderItem.quantity).label('total_qty'),
-    ).join(Order).join(Group).join(Store).filter(
-        Order.status == OrderStatus.SUBMITTED,
-        Order.created_at >= thirty_days_ago,
-    ).group_by(
-        OrderItem.item_name,
-        Store.name,
-        Store.logo_url,
-    ).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(limit).all()
-    
-    return hot_items
-
-
 @router.get("/home")
-async def home(request: Request, db: Session = Depends(get_db)):
+def home(request: Request, db: Session = Depends(get_db)):
     """首頁 - 團列表"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
-    # 使用台北時間（因為 deadline 存的是台北時間）
-    taipei_tz = timezone(timedelta(hours=8))
-    now = datetime.now(taipei_tz).replace(tzinfo=None)
-    
-    # 取得用戶的部門 IDs
-    from app.models.department import UserDepartment, GroupDepartment
-    user_dept_ids = [ud.department_id for ud in db.query(UserDepartment).filter(
-        UserDepartment.user_id == user.id
-    ).all()]
-    
-    def filter_visible_groups(groups):
-        """過濾用戶可見的團單"""
-        visible = []
-        for g in groups:
-            # 公開團：所有人可見
-            if g.is_public:
-                visible.append(g)
-                continue
-            # 團主自己可見
-            if g.owner_id == user.id:
-                visible.append(g)
-                continue
-            # 管理員可見
-            if user.is_admin:
-                visible.append(g)
-                continue
-            # 部門交集
-            group_dept_ids = {gd.department_id for gd in db.query(GroupDepartment).filter(
-                GroupDepartment.group_id == g.id
-            ).all()}
-            if group_dept_ids & set(user_dept_ids):
-                visible.append(g)
-        return visible
-    
-    # 開放中的飲料團（eager load orders 和 store）
-    drink_groups_raw = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.owner),
-        joinedload(Group.orders)
-    ).filter(
-        Group.category == CategoryType.DRINK,
-        Group.is_closed == False,
-        Group.deadline > now,
-    ).order_by(Group.deadline.asc()).all()
-    drink_groups = filter_visible_groups(drink_groups_raw)
-    
-    # 開放中的訂餐團
-    meal_groups_raw = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.owner),
-        joinedload(Group.orders)
-    ).filter(
-        Group.category == CategoryType.MEAL,
-        Group.is_closed == False,
-        Group.deadline > now,
-    ).order_by(Group.deadline.asc()).all()
-    meal_groups = filter_visible_groups(meal_groups_raw)
-    
-    # 開放中的團購團（新類型，可能不存在）
-    try:
-        groupbuy_groups_raw = db.query(Group).options(
-            joinedload(Group.store),
-            joinedload(Group.owner),
-            joinedload(Group.orders)
-        ).filter(
-            Group.category == CategoryType.GROUP_BUY,
-            Group.is_closed == False,
-            Group.deadline > now,
-        ).order_by(Group.deadline.asc()).all()
-        groupbuy_groups = filter_visible_groups(groupbuy_groups_raw)
-    except Exception:
-        db.rollback()
-        groupbuy_groups = []
-    
-    # 我的進行中（開放團中，我是團主或已下單）
-    my_active = []
-    for g in (drink_groups + meal_groups + groupbuy_groups):
-        mo = next((o for o in g.orders if o.user_id == user.id), None)
-        if mo:
-            my_active.append({"group": g, "status": mo.status.value})
-        elif g.owner_id == user.id:
-            my_active.append({"group": g, "status": "owner"})
-    my_active.sort(key=lambda x: x["group"].deadline)
-
-    # 已截止的團（最近 10 個）
-    closed_groups_raw = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.owner)
-    ).filter(
-        or_(Group.is_closed == True, Group.deadline <= now)
-    ).order_by(Group.deadline.desc()).limit(20).all()
-    closed_groups = filter_visible_groups(closed_groups_raw)[:10]
-    
-    # 超夯清單（全站熱門）
-    hot_items = get_hot_items(db, limit=10)
-    
-    # 公告
-    settings = db.query(SystemSetting).first()
-    announcement = settings.announcement if settings else None
-    
-    # 進行中的投票
-    from app.models.vote import Vote, VoteOption
-    active_votes = db.query(Vote).options(
-        joinedload(Vote.creator),
-        joinedload(Vote.options).joinedload(VoteOption.voters)
-    ).filter(
-        Vote.is_closed == False,
-        Vote.deadline > now
-    ).order_by(Vote.deadline.asc()).limit(4).all()
-    
-    # 店家列表（啟用中，根據部門過濾）
-    from app.models.department import StoreDepartment
-    all_stores = db.query(Store).options(
-        joinedload(Store.branches)
-    ).filter(Store.is_active == True).order_by(Store.name).all()
-    
-    # 過濾用戶可見的店家
-    def filter_visible_stores(stores_list):
-        visible = []
-        for s in stores_list:
-            # 公開店家：所有人可見
-            if s.is_public:
-                visible.append(s)
-                continue
-            # 管理員可見所有
-            if user.is_admin:
-                visible.append(s)
-                continue
-            # 部門交集
-            store_dept_ids = {sd.department_id for sd in db.query(StoreDepartment).filter(
-                StoreDepartment.store_id == s.id
-            ).all()}
-            if store_dept_ids & set(user_dept_ids):
-                visible.append(s)
-        return visible
-    
-    stores = filter_visible_stores(all_stores)
+    # 共用快照 + 套用使用者可見性（平常只需查用戶部門一次）
+    context = build_home_context(db, user)
     
     return templates.TemplateResponse("home.html", {
         "request": request,
         "user": user,
-        "drink_groups": drink_groups,
-        "meal_groups": meal_groups,
-        "groupbuy_groups": groupbuy_groups,
-        "closed_groups": closed_groups,
-        "hot_items": hot_items,
-        "announcement": announcement,
-        "active_votes": active_votes,
-        "stores": stores,
-        "my_active": my_active,
-        "now": now,
+        **context,
     })
 
 
 @router.get("/home/groups")
-async def home_groups_partial(request: Request, db: Session = Depends(get_db)):
+def home_groups_partial(request: Request, db: Session = Depends(get_db)):
     """首頁團單列表（HTMX partial）"""
-    user = await get_current_user(request, db)
-    
-    # 使用台北時間（因為 deadline 存的是台北時間）
-    taipei_tz = timezone(timedelta(hours=8))
-    now = datetime.now(taipei_tz).replace(tzinfo=None)
-    
-    # 開放中的飲料團
-    drink_groups = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.owner),
-        joinedload(Group.orders)
-    ).filter(
-        Group.category == CategoryType.DRINK,
-        Group.is_closed == False,
-        Group.deadline > now,
-    ).order_by(Group.deadline.asc()).all()
-    
-    # 開放中的訂餐團
-    meal_groups = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.owner),
-        joinedload(Group.orders)
-    ).filter(
-        Group.category == CategoryType.MEAL,
-        Group.is_closed == False,
-        Group.deadline > now,
-    ).order_by(Group.deadline.asc()).all()
+    user = get_current_user_sync(request, db)
     
-    # 開放中的團購團
-    try:
-        groupbuy_groups = db.query(Group).options(
-            joinedload(Group.store),
-            joinedload(Group.owner),
-            joinedload(Group.orders)
-        ).filter(
-            Group.category == CategoryType.GROUP_BUY,
-            Group.is_closed == False,
-            Group.deadline > now,
-        ).order_by(Group.deadline.asc()).all()
-    except Exception:
-        db.rollback()
-        groupbuy_groups = []
-    
-    # 已截止的團（最近 10 個）
-    closed_groups = db.query(Group).options(
-        joinedload(Group.store),
-        joinedload(Group.owner)
-    ).filter(
-        or_(Group.is_closed == True, Group.deadline <= now)
-    ).order_by(Group.deadline.desc()).limit(10).all()
-    
-    # 超夯清單
-    hot_items = get_hot_items(db, limit=10)
-    
-    # 公告
-    settings = db.query(SystemSetting).first()
-    announcement = settings.announcement if settings else None
-    
-    # 進行中的投票
-    from app.models.vote import Vote, VoteOption
-    active_votes = db.query(Vote).options(
-        joinedload(Vote.creator),
-        joinedload(Vote.options).joinedload(VoteOption.voters)
-    ).filter(
-        Vote.is_closed == False,
-        Vote.deadline > now
-    ).order_by(Vote.deadline.asc()).limit(4).all()
-    
-    # 取得用戶的部門 IDs
-    from app.models.department import UserDepartment, StoreDepartment
-    user_dept_ids = [ud.department_id for ud in db.query(UserDepartment).filter(
-        UserDepartment.user_id == user.id
-    ).all()]
-    
-    # 店家列表（根據部門過濾）
-    all_stores = db.query(Store).options(
-        joinedload(Store.branches)
-    ).filter(Store.is_active == True).order_by(Store.name).all()
-    
-    # 過濾用戶可見的店家
-    visible_stores = []
-    for s in all_stores:
-        if s.is_public:
-            visible_stores.append(s)
-        elif user.is_admin:
-            visible_stores.append(s)
-        else:
-            store_dept_ids = {sd.department_id for sd in db.query(StoreDepartment).filter(
-                StoreDepartment.store_id == s.id
-            ).all()}
-            if store_dept_ids & set(user_dept_ids):
-                visible_stores.append(s)
-    stores = visible_stores
+    context = build_home_context(db, user)
     
     return templates.TemplateResponse("partials/home_groups.html", {
         "request": request,
         "user": user,
-        "drink_groups": drink_groups,
-        "meal_groups": meal_groups,
-        "groupbuy_groups": groupbuy_groups,
-        "closed_groups": closed_groups,
-        "hot_items": hot_items,
-        "announcement": announcement,
-        "active_votes": active_votes,
-        "stores": stores,
+        **context,
+    })
+
+
+@router.get("/home/events")
+async def home_events_stream(request: Request):
+    """首頁即時事件（SSE）"""
+    from app.services.event_hub import sse_response
+    from app.services.home_events import HOME_CHANNEL
+
+    return await sse_response(request, HOME_CHANNEL, lambda db: get_current_user_sync(request, db))
+
+
+@router.get("/home/cards/{group_id}")
+def home_group_card(group_id: int, request: Request, db: Session = Depends(get_db)):
+    """首頁單張團單卡片（收到 group_opened / group_updated 事件時取用）"""
+    user = get_current_user_sync(request, db)
+
+    # 從首頁快照找（很多人同時來取時只重建一次）
+    board = get_home_board(db)
+    now = datetime.now(timezone(timedelta(hours=8))).replace(tzinfo=None)
+    groups = [g for g in board.open_groups if g.id == group_id and not g.is_closed and g.deadline > now]
+    if groups:
+        user_dept_ids = get_user_department_ids(db, user.id) if not groups[0].is_public else set()
+        groups = filter_visible_groups(groups, user, user_dept_ids, board.group_dept_ids)
+    if not groups:
+        raise HTTPException(status_code=404, detail="團單不存在或已截止")
+
+    return templates.TemplateResponse("partials/group_card.html", {
+        "request": request,
+        "user": user,
+        "group": groups[0],
     })
 
 
 @router.get("/my/groups")
-async def my_groups(request: Request, db: Session = Depends(get_db)):
+def my_groups(request: Request, db: Session = Depends(get_db)):
     """我參與過的團單"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     # 我開的團 + 我有下單的團
     my_group_ids = db.query(Order.group_id).filter(Order.user_id == user.id).distinct()
@@ -345,9 +115,9 @@ async def my_groups(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/profile")
-async def profile_page(request: Request, db: Session = Depends(get_db)):
+def profile_page(request: Request, db: Session = Depends(get_db)):
     """個人資料頁面"""
-    user = await get_current_user(request, db)
+    user = load_user(db, get_current_user_sync(request, db))
     
     # 統計資料
     order_count = db.query(Order).filter(Order.user_id == user.id).count()
@@ -362,9 +132,9 @@ async def profile_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/welcome")
-async def welcome_page(request: Request, db: Session = Depends(get_db)):
+def welcome_page(request: Request, db: Session = Depends(get_db)):
     """首次登入歡迎頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     return templates.TemplateResponse("welcome.html", {
         "request": request,
@@ -373,13 +143,13 @@ async def welcome_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/welcome")
-async def complete_welcome(
+def complete_welcome(
     request: Request,
     nickname: str = Form(""),
     db: Session = Depends(get_db),
 ):
     """完成首次設定"""
-    user = await get_current_user(request, db)
+    user = load_user(db, get_current_user_sync(request, db))
     
     # 設定暱稱（空白則用 LINE 名稱，但標記為已設定）
     nickname = nickname.strip()
@@ -390,32 +160,34 @@ async def complete_welcome(
         user.nickname = user.display_name
     
     db.commit()
+    invalidate_auth_user(user.id)
+    invalidate_user_search()
     
     return RedirectResponse(url="/home", status_code=302)
 
 
 @router.post("/profile")
-async def update_profile(
+def update_profile(
     request: Request,
     nickname: str = Form(...),
     db: Session = Depends(get_db),
 ):
     """更新個人資料"""
-    from app.models.user import User
-    
-    user = await get_current_user(request, db)
+    user = load_user(db, get_current_user_sync(request, db))
     
     # 更新暱稱（系統顯示名）
     user.nickname = nickname.strip() if nickname else None
     db.commit()
+    invalidate_auth_user(user.id)
+    invalidate_user_search()
     
     return RedirectResponse(url="/profile?success=1", status_code=302)
 
 
 @router.get("/history")
-async def history(request: Request, page: int = 1, db: Session = Depends(get_db)):
+def history(request: Request, page: int = 1, db: Session = Depends(get_db)):
     """歷史團單列表"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     taipei_tz = timezone(timedelta(hours=8))
     now = datetime.now(taipei_tz).replace(tzinfo=None)
@@ -428,14 +200,14 @@ async def history(request: Request, page: int = 1, db: Session = Depends(get_db)
         or_(Group.is_closed == True, Group.deadline <= now)
     ).count()
     
-    # 分頁查詢
+    # 分頁查詢（人數、金額讀結算快照，不載入訂單）
     closed_groups = db.query(Group).options(
         joinedload(Group.store),
         joinedload(Group.owner),
-        joinedload(Group.orders)
     ).filter(
         or_(Group.is_closed == True, Group.deadline <= now)
     ).order_by(Group.deadline.desc()).offset(offset).limit(per_page).all()
+    summaries = snapshot_summaries(db, [g.id for g in closed_groups if g.is_closed])
     
     total_pages = (total + per_page - 1) // per_page
     
@@ -443,6 +215,7 @@ async def history(request: Request, page: int = 1, db: Session = Depends(get_db)
         "request": request,
         "user": user,
         "groups": closed_groups,
+        "summaries": summaries,
         "page": page,
         "total_pages": total_pages,
         "total": total,
@@ -450,9 +223,9 @@ async def history(request: Request, page: int = 1, db: Session = Depends(get_db)
 
 
 @router.get("/my-orders")
-async def my_orders(request: Request, page: int = 1, db: Session = Depends(get_db)):
+def my_orders(request: Request, page: int = 1, db: Session = Depends(get_db)):
     """我的訂單歷史"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     per_page = 20
     offset = (page - 1) * per_page
@@ -467,12 +240,26 @@ async def my_orders(request: Request, page: int = 1, db: Session = Depends(get_d
         Order.user_id == user.id
     ).order_by(Order.created_at.desc()).offset(offset).limit(per_page).all()
     
+    # 品項摘要：截止的團讀結算快照，其他（進行中、沒結單的草稿）一次查訂單品項
+    snapshots = load_settlement_snapshots(db, list({o.group_id for o in orders if o.group.is_closed}))
+    order_lines = {}
+    for order in orders:
+        settlement = snapshots.get(order.group_id)
+        person = next((p for p in settlement.people if p.user_id == user.id), None) if settlement else None
+        if person is not None and order.status == OrderStatus.SUBMITTED:
+            order_lines[order.id] = person.items
+    live_ids = [o.id for o in orders if o.id not in order_lines]
+    if live_ids:
+        for item in db.query(OrderItem).filter(OrderItem.order_id.in_(live_ids)).order_by(OrderItem.id):
+            order_lines.setdefault(item.order_id, []).append(item)
+    
     total_pages = (total + per_page - 1) // per_page
     
     return templates.TemplateResponse("my_orders.html", {
         "request": request,
         "user": user,
         "orders": orders,
+        "order_lines": order_lines,
         "page": page,
         "total_pages": total_pages,
         "total": total,
@@ -480,9 +267,9 @@ async def my_orders(request: Request, page: int = 1, db: Session = Depends(get_d
 
 
 @router.get("/feedback")
-async def feedback_page(request: Request, db: Session = Depends(get_db)):
+def feedback_page(request: Request, db: Session = Depends(get_db)):
     """問題回報頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.user import Feedback
     
@@ -499,13 +286,13 @@ async def feedback_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/feedback")
-async def submit_feedback(
+def submit_feedback(
     request: Request,
     content: str = Form(...),
     db: Session = Depends(get_db)
 ):
     """提交問題回報"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.user import Feedback
     
@@ -520,9 +307,9 @@ async def submit_feedback(
 
 
 @router.get("/favorites")
-async def favorites_page(request: Request, db: Session = Depends(get_db)):
+def favorites_page(request: Request, db: Session = Depends(get_db)):
     """收藏店家頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.user import UserFavorite
     
@@ -540,13 +327,13 @@ async def favorites_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/favorites/{store_id}")
-async def toggle_favorite(
+def toggle_favorite(
     request: Request,
     store_id: int,
     db: Session = Depends(get_db)
 ):
     """切換收藏狀態"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.user import UserFavorite
     
@@ -570,9 +357,9 @@ async def toggle_favorite(
 # ============ 用戶部門管理 ============
 
 @router.get("/my-departments")
-async def my_departments_page(request: Request, db: Session = Depends(get_db)):
+def my_departments_page(request: Request, db: Session = Depends(get_db)):
     """我的部門頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.department import Department, UserDepartment
     
@@ -599,9 +386,9 @@ async def my_departments_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/my-departments/{dept_id}/join")
-async def join_department(request: Request, dept_id: int, db: Session = Depends(get_db)):
+def join_department(request: Request, dept_id: int, db: Session = Depends(get_db)):
     """加入部門"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.department import Department, UserDepartment, DeptRole
     
@@ -633,9 +420,9 @@ async def join_department(request: Request, dept_id: int, db: Session = Depends(
 
 
 @router.post("/my-departments/{dept_id}/leave")
-async def leave_department(request: Request, dept_id: int, db: Session = Depends(get_db)):
+def leave_department(request: Request, dept_id: int, db: Session = Depends(get_db)):
     """離開部門"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.department import UserDepartment
     
@@ -652,12 +439,12 @@ async def leave_department(request: Request, dept_id: int, db: Session = Depends
 
 
 @router.get("/stores/{store_id}")
-async def store_view(store_id: int, request: Request, db: Session = Depends(get_db)):
+def store_view(store_id: int, request: Request, db: Session = Depends(get_db)):
     """前台店家詳情頁（只讀）"""
     from app.models.store import StoreTopping
     from app.models.menu import Menu
     
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     store = db.query(Store).options(
         joinedload(Store.branches),
@@ -680,7 +467,7 @@ async def store_view(store_id: int, request: Request, db: Session = Depends(get_
         Group.store_id == store_id,
         Group.is_closed == False,
         Group.deadline > now,
-        Group.is_public == True,
+        group_visible_clause(user),
     ).order_by(Group.deadline.asc()).all()
     
     # 檢查是否已收藏
@@ -707,43 +494,127 @@ async def store_view(store_id: int, request: Request, db: Session = Depends(get_
 
 
 @router.get("/stores/{store_id}/menu")
-async def store_menu_view(store_id: int, request: Request, db: Session = Depends(get_db)):
+def store_menu_view(store_id: int, request: Request, db: Session = Depends(get_db)):
     """前台店家菜單頁面（只讀）"""
-    from app.models.menu import Menu, MenuCategory, MenuItem
+    from app.services.menu_cache import get_active_menu_snapshot
     
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     store = db.query(Store).filter(Store.id == store_id, Store.is_active == True).first()
     if not store:
         raise HTTPException(status_code=404, detail="店家不存在")
     
-    # 取得啟用中的菜單
-    menu = db.query(Menu).filter(
-        Menu.store_id == store_id,
-        Menu.is_active == True
-    ).first()
-    
+    # 啟用中菜單的快照（分類 → 品項已在記憶體中）
+    menu = get_active_menu_snapshot(db, store_id)
     if not menu:
         raise HTTPException(status_code=404, detail="此店家尚無菜單")
     
-    # 取得菜單分類和品項
-    categories = db.query(MenuCategory).filter(
-        MenuCategory.menu_id == menu.id
-    ).order_by(MenuCategory.sort_order).all()
-    
     return templates.TemplateResponse("store_menu.html", {
         "request": request,
         "user": user,
         "store": store,
         "menu": menu,
-        "categories": categories,
+        "categories": menu.categories,
     })
 
 
+@router.get("/menus/{menu_id}/{fingerprint}.json")
+def menu_asset(menu_id: int, fingerprint: str, request: Request, db: Session = Depends(get_db)):
+    """團單頁用的菜單品項資料（網址含內容指紋，內容不變網址就不變，瀏覽器可長期快取）"""
+    from fastapi.responses import Response
+    from app.services.menu_cache import get_menu_snapshot
+    
+    get_current_user_sync(request, db)
+    
+    menu = get_menu_snapshot(db, menu_id)
+    if not menu:
+        raise HTTPException(status_code=404, detail="菜單不存在")
+    
+    # 指紋對不上（菜單剛改過、頁面還是舊的）：給目前內容但不快取
+    if fingerprint == menu.fingerprint:
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        cache_control = "private, no-cache"
+    return Response(
+        content=menu.asset_json,
+        media_type="application/json",
+        headers={"Cache-Control": cache_control},
+    )
+
+
+@router.get("/logos/{filename}")
+def logo_asset(filename: str):
+    """店家 logo 本機縮圖（檔名含內容雜湊，可以長期快取）"""
+    from fastapi.responses import FileResponse
+    from app.services.logo_assets import logo_asset_path
+    
+    path = logo_asset_path(filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="圖片不存在")
+    return FileResponse(
+        path,
+        media_type="image/webp" if filename.endswith(".webp") else "image/png",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+@router.get("/users/search")
+def search_users_endpoint(
+    request: Request,
+    q: str = "",
+    exclude: list[int] = Query([]),
+    not_in_department: int | None = None,
+    group_id: int | None = None,
+    guests: bool | None = None,
+    db: Session = Depends(get_db),
+):
+    """找使用者（轉移團主、部門加成員的輸入提示）；HTMX 回傳 <option>，否則回傳 JSON
+
+    部門加成員只有管理員能用；轉移團主要帶 group_id，只有該團團主或管理員能查。
+    訪客帳號只有管理員查得到（guests 未指定時管理員預設包含）。
+    """
+    from fastapi.responses import JSONResponse
+    from app.services.user_search import search_users
+
+    user = get_current_user_sync(request, db)
+
+    if not user.is_admin:
+        if not_in_department:
+            raise HTTPException(status_code=403, detail="權限不足")
+        if group_id is None:
+            raise HTTPException(status_code=403, detail="權限不足")
+        owner_id = db.query(Group.owner_id).filter(Group.id == group_id).scalar()
+        if owner_id is None:
+            raise HTTPException(status_code=404, detail="團單不存在")
+        if owner_id != user.id:
+            raise HTTPException(status_code=403, detail="只有團主可以轉移")
+    include_guests = user.is_admin and guests is not False
+
+    exclude_ids = set(exclude)
+    if not_in_department:
+        from app.models.department import UserDepartment
+        exclude_ids.update(uid for (uid,) in db.query(UserDepartment.user_id).filter(
+            UserDepartment.department_id == not_in_department
+        ).all())
+
+    users = search_users(db, q, exclude_ids=exclude_ids, include_guests=include_guests)
+
+    if request.headers.get("HX-Request") == "true":
+        return templates.TemplateResponse("partials/user_options.html", {
+            "request": request,
+            "q": q.strip(),
+            "users": users,
+        })
+    return JSONResponse([
+        {"id": u.id, "name": u.show_name, "display_name": u.display_name}
+        for u in users
+    ])
+
+
 @router.get("/recommend")
-async def recommend_store_page(request: Request, db: Session = Depends(get_db)):
+def recommend_store_page(request: Request, db: Session = Depends(get_db)):
     """推薦店家頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.user import StoreRecommendation
     
@@ -760,7 +631,7 @@ async def recommend_store_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("/recommend")
-async def submit_recommendation(
+def submit_recommendation(
     request: Request,
     store_name: str = Form(...),
     category: str = Form(...),
@@ -770,7 +641,7 @@ async def submit_recommendation(
     db: Session = Depends(get_db)
 ):
     """提交店家推薦"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     from app.models.user import StoreRecommendation
     from app.config import get_settings
@@ -791,7 +662,7 @@ async def submit_recommendation(
                     api_secret=settings.cloudinary_api_secret
                 )
                 
-                contents = await menu_image.read()
+                contents = menu_image.file.read()
                 result = cloudinary.uploader.upload(
                     contents,
                     folder="sela/recommendations",
@@ -816,7 +687,7 @@ async def submit_recommendation(
 
 
 @router.get("/stats")
-async def stats_page(
+def stats_page(
     request: Request, 
     period: str = "month",
     start_date: str = None,
@@ -830,7 +701,7 @@ async def stats_page(
     from app.models.store import Store, CategoryType
     from decimal import Decimal
     
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     # 台北時區
     taipei_tz = timezone(timedelta(hours=8))
@@ -882,11 +753,9 @@ async def stats_page(
     # ===== 基本統計 =====
     total_orders = db.query(Order).filter(*base_filters).count()
     
-    # 計算總金額：從 OrderItem 計算 (unit_price * quantity)
+    # 計算總金額：訂單應付金額（含選項、加料，扣除折扣）
     total_amount = db.query(
-        func.sum(OrderItem.unit_price * OrderItem.quantity)
-    ).select_from(OrderItem).join(
-        Order, OrderItem.order_id == Order.id
+        func.sum(Order.total_amount)
     ).filter(*base_filters).scalar() or Decimal("0")
     
     avg_amount = total_amount / total_orders if total_orders > 0 else Decimal("0")
@@ -901,10 +770,8 @@ async def stats_page(
             Group.category == cat
         ).count()
         cat_amount = db.query(
-            func.sum(OrderItem.unit_price * OrderItem.quantity)
-        ).select_from(OrderItem).join(
-            Order, OrderItem.order_id == Order.id
-        ).join(
+            func.sum(Order.total_amount)
+        ).select_from(Order).join(
             Group, Order.group_id == Group.id
         ).filter(
             *base_filters,
@@ -920,23 +787,21 @@ async def stats_page(
         Store.id,
         Store.name,
         Store.logo_url,
-        func.count(func.distinct(Order.id)).label("order_count"),
-        func.sum(OrderItem.unit_price * OrderItem.quantity).label("total_spent")
-    ).select_from(OrderItem).join(
-        Order, OrderItem.order_id == Order.id
-    ).join(
+        func.count(Order.id).label("order_count"),
+        func.sum(Order.total_amount).label("total_spent")
+    ).select_from(Order).join(
         Group, Order.group_id == Group.id
     ).join(
         Store, Group.store_id == Store.id
     ).filter(
         *base_filters
-    ).group_by(Store.id).order_by(func.count(func.distinct(Order.id)).desc()).limit(5).all()
+    ).group_by(Store.id).order_by(func.count(Order.id).desc()).limit(5).all()
     
     # ===== 最常點的品項 TOP 10 =====
     favorite_items = db.query(
         OrderItem.item_name,
         func.sum(OrderItem.quantity).label("total_qty"),
-        func.sum(OrderItem.unit_price * OrderItem.quantity).label("total_spent")
+        func.sum(OrderItem.line_total).label("total_spent")
     ).select_from(OrderItem).join(
         Order, OrderItem.order_id == Order.id
     ).filter(
@@ -1002,9 +867,7 @@ async def stats_page(
             month_end = datetime(month_date.year, month_date.month + 1, 1) - timedelta(seconds=1)
         
         month_amount = db.query(
-            func.sum(OrderItem.unit_price * OrderItem.quantity)
-        ).select_from(OrderItem).join(
-            Order, OrderItem.order_id == Order.id
+            func.sum(Order.total_amount)
         ).filter(
             Order.user_id == user.id,
             Order.status == OrderStatus.SUBMITTED,
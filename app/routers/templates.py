@@ -10,6 +10,8 @@ from app.models.store import Store, CategoryType
 from app.models.group import Group
 from app.models.menu import Menu
 from app.services.auth import get_current_user
+from app.services.home_board import invalidate_home_board
+from app.services.deadline_scheduler import schedule_group
 
 router = APIRouter(prefix="/templates", tags=["templates"])
 templates = Jinja2Templates(directory="app/templates")
@@ -154,7 +156,9 @@ async def use_template(template_id: int, request: Request, db: Session = Depends
     tpl.use_count += 1
     
     db.commit()
+    invalidate_home_board("group_opened", group.id)
     db.refresh(group)
+    schedule_group(group)
     
     return RedirectResponse(url=f"/groups/{group.id}", status_code=302)
 
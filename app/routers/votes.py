@@ -9,7 +9,10 @@ from app.models.vote import Vote, VoteOption, VoteRecord
 from app.models.store import Store, CategoryType
 from app.models.group import Group
 from app.models.menu import Menu
-from app.services.auth import get_current_user
+from app.services.auth import get_current_user_sync
+from app.services.visibility_service import vote_visible_clause
+from app.services.home_board import invalidate_home_board
+from app.services.deadline_scheduler import schedule_group
 
 router = APIRouter(prefix="/votes", tags=["votes"])
 templates = Jinja2Templates(directory="app/templates")
@@ -19,61 +22,35 @@ TAIPEI_TZ = timezone(timedelta(hours=8))
 
 
 @router.get("")
-async def vote_list(request: Request, db: Session = Depends(get_db)):
+def vote_list(request: Request, db: Session = Depends(get_db)):
     """投票列表"""
-    user = await get_current_user(request, db)
-    
-    # 取得用戶的部門 IDs
-    from app.models.department import UserDepartment
-    from app.models.vote import VoteDepartment
-    user_dept_ids = [ud.department_id for ud in db.query(UserDepartment).filter(
-        UserDepartment.user_id == user.id
-    ).all()]
-    
-    def filter_visible_votes(votes):
-        """過濾用戶可見的投票"""
-        visible = []
-        for v in votes:
-            # 公開投票：所有人可見
-            if v.is_public:
-                visible.append(v)
-                continue
-            # 發起人可見
-            if v.creator_id == user.id:
-                visible.append(v)
-                continue
-            # 管理員可見
-            if user.is_admin:
-                visible.append(v)
-                continue
-            # 部門交集
-            vote_dept_ids = {vd.department_id for vd in v.departments}
-            if vote_dept_ids & set(user_dept_ids):
-                visible.append(v)
-        return visible
+    user = get_current_user_sync(request, db)
+    
+    # 可見性條件（公開 / 發起人 / 管理員 / 部門交集），直接放進 SQL
+    vote_visible = vote_visible_clause(user)
     
     # 取得進行中的投票
     now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
-    active_votes_raw = db.query(Vote).filter(
+    active_votes = db.query(Vote).filter(
         Vote.is_closed == False,
-        Vote.deadline > now
+        Vote.deadline > now,
+        vote_visible,
     ).options(
         joinedload(Vote.creator),
         joinedload(Vote.options).joinedload(VoteOption.store),
         joinedload(Vote.options).joinedload(VoteOption.voters),
         joinedload(Vote.departments)
     ).order_by(Vote.deadline.asc()).all()
-    active_votes = filter_visible_votes(active_votes_raw)
     
     # 取得已結束的投票（最近10個）
-    closed_votes_raw = db.query(Vote).filter(
-        (Vote.is_closed == True) | (Vote.deadline <= now)
+    closed_votes = db.query(Vote).filter(
+        (Vote.is_closed == True) | (Vote.deadline <= now),
+        vote_visible,
     ).options(
         joinedload(Vote.creator),
         joinedload(Vote.options).joinedload(VoteOption.store),
         joinedload(Vote.departments)
-    ).order_by(Vote.created_at.desc()).limit(20).all()
-    closed_votes = filter_visible_votes(closed_votes_raw)[:10]
+    ).order_by(Vote.created_at.desc()).limit(10).all()
     
     return templates.TemplateResponse("votes/list.html", {
         "request": request,
@@ -84,9 +61,9 @@ async def vote_list(request: Request, db: Session = Depends(get_db)):
 
 
 @router.get("/new")
-async def new_vote_page(request: Request, db: Session = Depends(get_db)):
+def new_vote_page(request: Request, db: Session = Depends(get_db)):
     """新建投票頁面"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     # 取得所有啟用的店家
     stores = db.query(Store).filter(Store.is_active == True).order_by(Store.name).all()
@@ -104,22 +81,19 @@ async def new_vote_page(request: Request, db: Session = Depends(get_db)):
 
 
 @router.post("")
-async def create_vote(
+def create_vote(
     request: Request,
     title: str = Form(...),
     deadline: str = Form(...),
     description: str = Form(None),
     is_multiple: bool = Form(False),
     visibility: str = Form("public"),
+    store_ids: list[str] = Form(default=[]),
+    department_ids: list[str] = Form(default=[]),
     db: Session = Depends(get_db),
 ):
     """建立投票"""
-    user = await get_current_user(request, db)
-    
-    # 取得選擇的店家和部門
-    form_data = await request.form()
-    store_ids = form_data.getlist("store_ids")
-    department_ids = form_data.getlist("department_ids")
+    user = get_current_user_sync(request, db)
     
     if not store_ids:
         raise HTTPException(status_code=400, detail="請至少選擇一個店家")
@@ -161,14 +135,15 @@ async def create_vote(
             db.add(vd)
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url=f"/votes/{vote.id}", status_code=302)
 
 
 @router.get("/{vote_id}")
-async def vote_detail(vote_id: int, request: Request, db: Session = Depends(get_db)):
+def vote_detail(vote_id: int, request: Request, db: Session = Depends(get_db)):
     """投票詳情頁"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     vote = db.query(Vote).filter(Vote.id == vote_id).options(
         joinedload(Vote.creator),
@@ -206,13 +181,14 @@ async def vote_detail(vote_id: int, request: Request, db: Session = Depends(get_
 
 
 @router.post("/{vote_id}/vote")
-async def cast_vote(
+def cast_vote(
     vote_id: int,
     request: Request,
+    option_ids: list[str] = Form(default=[]),
     db: Session = Depends(get_db),
 ):
     """投票"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     vote = db.query(Vote).filter(Vote.id == vote_id).first()
     if not vote:
@@ -221,10 +197,6 @@ async def cast_vote(
     if not vote.is_open:
         raise HTTPException(status_code=400, detail="投票已結束")
     
-    # 取得選擇的選項
-    form_data = await request.form()
-    option_ids = form_data.getlist("option_ids")
-    
     if not option_ids:
         raise HTTPException(status_code=400, detail="請選擇至少一個選項")
     
@@ -257,19 +229,20 @@ async def cast_vote(
             db.add(record)
     
     db.commit()
+    invalidate_home_board()
     
     return RedirectResponse(url=f"/votes/{vote_id}", status_code=302)
 
 
 @router.post("/{vote_id}/add-option")
-async def add_option(
+def add_option(
     vote_id: int,
     store_id: int = Form(...),
     request: Request = None,
     db: Session = Depends(get_db),
 ):
     """提議新選項"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     vote = db.query(Vote).filter(Vote.id == vote_id).first()
     if not vote:
@@ -295,14 +268,15 @@ async def add_option(
     )
     db.add(option)
     db.commit()
+    invalidate_home_board()
     
     return RedirectResponse(url=f"/votes/{vote_id}", status_code=302)
 
 
 @router.post("/{vote_id}/close")
-async def close_vote(vote_id: int, request: Request, db: Session = Depends(get_db)):
+def close_vote(vote_id: int, request: Request, db: Session = Depends(get_db)):
     """結束投票"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     vote = db.query(Vote).filter(Vote.id == vote_id).options(
         joinedload(Vote.options).joinedload(VoteOption.voters)
@@ -323,14 +297,15 @@ async def close_vote(vote_id: int, request: Request, db: Session = Depends(get_d
             vote.winner_store_id = winner.store_id
     
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url=f"/votes/{vote_id}", status_code=302)
 
 
 @router.post("/{vote_id}/create-group")
-async def create_group_from_vote(vote_id: int, request: Request, db: Session = Depends(get_db)):
+def create_group_from_vote(vote_id: int, request: Request, db: Session = Depends(get_db)):
     """從投票結果開團"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     vote = db.query(Vote).filter(Vote.id == vote_id).first()
     if not vote:
@@ -370,15 +345,17 @@ async def create_group_from_vote(vote_id: int, request: Request, db: Session = D
     db.flush()
     
     vote.created_group_id = group.id
+    schedule_group(group)
     db.commit()
+    invalidate_home_board("group_opened", group.id)
     
     return RedirectResponse(url=f"/groups/{group.id}", status_code=302)
 
 
 @router.post("/{vote_id}/delete")
-async def delete_vote(vote_id: int, request: Request, db: Session = Depends(get_db)):
+def delete_vote(vote_id: int, request: Request, db: Session = Depends(get_db)):
     """刪除投票"""
-    user = await get_current_user(request, db)
+    user = get_current_user_sync(request, db)
     
     vote = db.query(Vote).filter(Vote.id == vote_id).first()
     if not vote:
@@ -393,5 +370,6 @@ async def delete_vote(vote_id: int, request: Request, db: Session = Depends(get_
     db.query(VoteOption).filter(VoteOption.vote_id == vote_id).delete()
     db.delete(vote)
     db.commit()
+    invalidate_home_board("board")
     
     return RedirectResponse(url="/votes", status_code=302)
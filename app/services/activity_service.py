@@ -0,0 +1,69 @@
+"""
+用戶活動時間寫入緩衝（write-behind）
+
+每個已登入請求只在記憶體記錄 last_active_at，
+由背景工作每隔幾秒批次寫回資料庫，關機時再寫一次。
+User.is_online / 後台在線人數的誤差不超過一個寫回間隔。
+"""
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import update, bindparam
+from starlette.concurrency import run_in_threadpool
+
+from app.database import SessionLocal
+from app.models.user import User
+
+logger = logging.getLogger("activity")
+
+# user_id -> 最後活動時間（UTC）
+_pending: dict[int, datetime] = {}
+_lock = threading.Lock()
+
+_users = User.__table__
+_update_stmt = (
+    update(_users)
+    .where(_users.c.id == bindparam("uid"))
+    .values(last_active_at=bindparam("ts"))
+)
+
+
+def record_activity(user_id: int, at: datetime | None = None):
+    """記錄用戶活動（只寫記憶體）"""
+    with _lock:
+        _pending[user_id] = at or datetime.utcnow()
+
+
+def flush_activity() -> int:
+    """把緩衝中的活動時間批次寫回資料庫，回傳寫入筆數"""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+
+    db = SessionLocal()
+    try:
+        db.execute(_update_stmt, [{"uid": uid, "ts": ts} for uid, ts in batch.items()])
+        db.commit()
+        return len(batch)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"活動時間寫回失敗：{e}")
+        # 放回緩衝，下次再寫（不要蓋掉更新的時間）
+        with _lock:
+            for uid, ts in batch.items():
+                if uid not in _pending or _pending[uid] < ts:
+                    _pending[uid] = ts
+        return 0
+    finally:
+        db.close()
+
+
+async def activity_flush_loop(interval: int):
+    """背景工作：每 interval 秒寫回一次"""
+    while True:
+        await asyncio.sleep(interval)
+        await run_in_threadpool(flush_activity)
@@ -0,0 +1,204 @@
+"""
+使用者 × 店家點餐習慣（user_store_affinity）
+
+每人每店一列：最近的已結單訂單、常點品項（杯數 / 次數排名）、每個品項最後一次的規格。
+團單頁的「上次訂單」「常點」、複製上次訂單都只讀這一列，不再掃這個人在這家店的歷史訂單。
+
+維護方式：sales_rollup_service.record_order_sales() 增減彙總時順便呼叫 update_affinity()
+- 結單（sign=+1）：這筆訂單排到最近訂單最前面，品項規格記為「最後一次的規格」
+- 離開已結單（sign=-1）：從最近訂單移除，不夠的從歷史訂單補回
+- 常點品項每次都從 item_sales_daily 重算這個人在這家店的部分（小範圍查詢）
+數字若對不起來，跟銷量彙總一起用 scripts/rebuild_sales_rollup.py 重建。
+"""
+from collections import defaultdict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.sales import ItemSalesDaily, UserStoreAffinity
+
+AFFINITY_TOP_N = 10  # 常點品項：杯數、次數各留前幾名
+AFFINITY_RECENT_ORDERS = 2  # 最近訂單留幾筆（團單頁要排除目前這團，所以至少 2 筆）
+AFFINITY_SPEC_LIMIT = 50  # 最多記幾個品項的規格（超過丟掉最舊的）
+
+
+def _spec(item: OrderItem) -> dict:
+    return {"size": item.size, "sugar": item.sugar, "ice": item.ice}
+
+
+def _top_items(totals) -> list[dict]:
+    """totals: [(menu_item_id, item_name, quantity, line_count)]，杯數、次數各取前 N 名合併"""
+    by_quantity = sorted(totals, key=lambda t: t[2], reverse=True)[:AFFINITY_TOP_N]
+    by_lines = sorted(totals, key=lambda t: t[3], reverse=True)[:AFFINITY_TOP_N]
+    merged = {(t[0], t[1]): t for t in by_quantity + by_lines}
+    return [
+        {"menu_item_id": menu_item_id, "item_name": item_name, "quantity": quantity, "line_count": line_count}
+        for menu_item_id, item_name, quantity, line_count
+        in sorted(merged.values(), key=lambda t: t[2], reverse=True)
+    ]
+
+
+def _item_totals(db: Session, user_id: int, store_id: int):
+    """這個人在這家店每個品項的杯數、次數（從銷量彙總）"""
+    quantity = func.sum(ItemSalesDaily.quantity)
+    return [
+        (row.menu_item_id, row.item_name, int(row.quantity), int(row.line_count))
+        for row in db.query(
+            ItemSalesDaily.menu_item_id,
+            ItemSalesDaily.item_name,
+            quantity.label('quantity'),
+            func.sum(ItemSalesDaily.line_count).label('line_count'),
+        ).filter(
+            ItemSalesDaily.user_id == user_id,
+            ItemSalesDaily.store_id == store_id,
+        ).group_by(
+            ItemSalesDaily.menu_item_id,
+            ItemSalesDaily.item_name,
+        ).having(quantity > 0).all()
+    ]
+
+
+def _recent_order_ids(db: Session, user_id: int, store_id: int, exclude_order_id: int) -> list[int]:
+    """從歷史訂單找最近的已結單訂單（補回最近訂單用）"""
+    return [
+        order_id for (order_id,) in db.query(Order.id).join(Group, Order.group_id == Group.id).filter(
+            Order.user_id == user_id,
+            Group.store_id == store_id,
+            Order.status == OrderStatus.SUBMITTED,
+            Order.id != exclude_order_id,
+        ).order_by(Order.created_at.desc()).limit(AFFINITY_RECENT_ORDERS).all()
+    ]
+
+
+def update_affinity(db: Session, order: Order, store_id: int, items: list[OrderItem], sign: int):
+    """訂單進入（sign=1）/ 離開（sign=-1）已結單後更新，commit 由呼叫端負責
+
+    在銷量彙總增減之後呼叫（常點品項從彙總重算）。
+    """
+    db.flush()
+    affinity = db.query(UserStoreAffinity).filter(
+        UserStoreAffinity.user_id == order.user_id,
+        UserStoreAffinity.store_id == store_id,
+    ).with_for_update().first()
+    if not affinity:
+        affinity = UserStoreAffinity(user_id=order.user_id, store_id=store_id, last_order_ids=[], last_specs={})
+        db.add(affinity)
+
+    recent = [order_id for order_id in (affinity.last_order_ids or []) if order_id != order.id]
+    if sign > 0:
+        recent.insert(0, order.id)
+        # JSON 欄位要整個換掉才會寫回
+        specs = dict(affinity.last_specs or {})
+        for item in sorted(items, key=lambda i: i.id):
+            if item.menu_item_id is None:
+                continue
+            specs.pop(str(item.menu_item_id), None)
+            specs[str(item.menu_item_id)] = _spec(item)
+        while len(specs) > AFFINITY_SPEC_LIMIT:
+            specs.pop(next(iter(specs)))
+        affinity.last_specs = specs
+    elif len(recent) < AFFINITY_RECENT_ORDERS:
+        recent = _recent_order_ids(db, order.user_id, store_id, exclude_order_id=order.id)
+
+    affinity.last_order_ids = recent[:AFFINITY_RECENT_ORDERS]
+    affinity.top_items = _top_items(_item_totals(db, order.user_id, store_id))
+
+
+def rebuild_user_store_affinity(db: Session) -> int:
+    """清空後從所有已結單訂單重建，回傳寫入列數"""
+    rows = db.query(
+        Order.id,
+        Order.user_id,
+        Group.store_id,
+        OrderItem.menu_item_id,
+        OrderItem.item_name,
+        OrderItem.size,
+        OrderItem.sugar,
+        OrderItem.ice,
+        OrderItem.quantity,
+    ).join(Order, OrderItem.order_id == Order.id).join(Group, Order.group_id == Group.id).filter(
+        Order.status == OrderStatus.SUBMITTED,
+        Group.store_id.isnot(None),
+    ).order_by(Order.created_at, Order.id, OrderItem.id).all()
+
+    orders = defaultdict(list)  # (user, store) → 訂單 id（舊到新）
+    specs = defaultdict(dict)
+    totals = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for order_id, user_id, store_id, menu_item_id, item_name, size, sugar, ice, quantity in rows:
+        key = (user_id, store_id)
+        if not orders[key] or orders[key][-1] != order_id:
+            orders[key].append(order_id)
+        if menu_item_id is not None:
+            specs[key].pop(str(menu_item_id), None)
+            specs[key][str(menu_item_id)] = {"size": size, "sugar": sugar, "ice": ice}
+        totals[key][(menu_item_id, item_name)][0] += quantity
+        totals[key][(menu_item_id, item_name)][1] += 1
+
+    db.query(UserStoreAffinity).delete()
+    db.bulk_insert_mappings(UserStoreAffinity, [
+        {
+            "user_id": user_id,
+            "store_id": store_id,
+            "last_order_ids": order_ids[::-1][:AFFINITY_RECENT_ORDERS],
+            "top_items": _top_items([
+                (menu_item_id, item_name, quantity, line_count)
+                for (menu_item_id, item_name), (quantity, line_count) in totals[(user_id, store_id)].items()
+                if quantity > 0
+            ]),
+            "last_specs": dict(list(specs[(user_id, store_id)].items())[-AFFINITY_SPEC_LIMIT:]),
+        }
+        for (user_id, store_id), order_ids in orders.items()
+    ])
+    db.commit()
+    return len(orders)
+
+
+def backfill_user_store_affinity(db: Session) -> int:
+    """表還是空的（剛建立）就從歷史訂單重建，回傳寫入列數"""
+    if db.query(UserStoreAffinity.id).first():
+        return 0
+    return rebuild_user_store_affinity(db)
+
+
+# ===== 讀取 =====
+
+def get_affinity(db: Session, user_id: int, store_id: int | None) -> UserStoreAffinity | None:
+    if not store_id:
+        return None
+    return db.query(UserStoreAffinity).filter(
+        UserStoreAffinity.user_id == user_id,
+        UserStoreAffinity.store_id == store_id,
+    ).first()
+
+
+def pick_last_order(affinity: UserStoreAffinity | None, orders: list[Order], exclude_group_id: int | None = None) -> Order | None:
+    """從已載入的訂單中挑出最近一筆已結單訂單（排除 exclude_group_id 這團）"""
+    if not affinity:
+        return None
+    by_id = {o.id: o for o in orders}
+    for order_id in affinity.last_order_ids or []:
+        order = by_id.get(order_id)
+        if order and order.status == OrderStatus.SUBMITTED and order.group_id != exclude_group_id:
+            return order
+    return None
+
+
+def get_last_store_order(db: Session, user_id: int, store_id: int | None, exclude_group_id: int | None = None) -> Order | None:
+    """使用者在這家店最近一筆已結單訂單（含品項、選項、加料），複製上次訂單用"""
+    affinity = get_affinity(db, user_id, store_id)
+    if not affinity or not affinity.last_order_ids:
+        return None
+    orders = db.query(Order).options(
+        joinedload(Order.items).joinedload(OrderItem.selected_options),
+        joinedload(Order.items).joinedload(OrderItem.selected_toppings),
+    ).filter(Order.id.in_(affinity.last_order_ids)).all()
+    return pick_last_order(affinity, orders, exclude_group_id)
+
+
+def ranked_items(affinity: UserStoreAffinity | None, key: str, limit: int) -> list[dict]:
+    """常點品項依 key（"quantity" 杯數 / "line_count" 次數）排名"""
+    if not affinity:
+        return []
+    return sorted(affinity.top_items or [], key=lambda t: t[key], reverse=True)[:limit]
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from fastapi import Request, HTTPException
@@ -5,9 +6,12 @@ from sqlalchemy.orm import Session
 import httpx
 import secrets
 import logging
+import threading
+import time
 
 from app.config import get_settings
 from app.models.user import User, SystemSetting
+from app.services.user_search import invalidate_user_search
 
 settings = get_settings()
 logger = logging.getLogger("auth")
@@ -16,12 +20,100 @@ logger = logging.getLogger("auth")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 7  # 縮短到 7 天
 SESSION_TIMEOUT_MINUTES = 30  # 閒置超時時間
+AUTH_CACHE_TTL_SECONDS = 30  # 驗證快取（token 版本、使用者資料）存活時間
+
+
+@dataclass(frozen=True)
+class AuthUser:
+    """目前登入者的精簡資料（驗證快取用）
+
+    不是 ORM 物件：不能修改後 commit，需要完整資料請用 load_user()。
+    """
+    id: int
+    line_user_id: str
+    display_name: str
+    nickname: str | None
+    picture_url: str | None
+    is_admin: bool
+    is_guest: bool
+
+    @property
+    def show_name(self) -> str:
+        """顯示名稱（優先使用暱稱）"""
+        return self.nickname or self.display_name
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthUser":
+        return cls(
+            id=user.id,
+            line_user_id=user.line_user_id,
+            display_name=user.display_name,
+            nickname=user.nickname,
+            picture_url=user.picture_url,
+            is_admin=bool(user.is_admin),
+            is_guest=bool(user.is_guest),
+        )
+
+
+# 驗證快取（單一 process 內共用）
+_auth_cache_lock = threading.Lock()
+_token_version_cache: tuple[int, float] | None = None  # (version, 到期時間)
+_user_cache: dict[int, tuple[AuthUser, float]] = {}  # user_id -> (AuthUser, 到期時間)
 
 
 def get_system_token_version(db: Session) -> int:
-    """取得系統 token 版本"""
+    """取得系統 token 版本（快取 AUTH_CACHE_TTL_SECONDS 秒）"""
+    global _token_version_cache
+    cached = _token_version_cache
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
     setting = db.query(SystemSetting).filter(SystemSetting.id == 1).first()
-    return setting.token_version if setting else 1
+    version = setting.token_version if setting else 1
+    with _auth_cache_lock:
+        _token_version_cache = (version, time.monotonic() + AUTH_CACHE_TTL_SECONDS)
+    return version
+
+
+def invalidate_token_version():
+    """清除 token 版本快取（一鍵登出後呼叫）"""
+    global _token_version_cache
+    with _auth_cache_lock:
+        _token_version_cache = None
+
+
+def get_auth_user(db: Session, user_id: int) -> AuthUser | None:
+    """取得精簡使用者資料（快取 AUTH_CACHE_TTL_SECONDS 秒）"""
+    cached = _user_cache.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        invalidate_auth_user(user_id)
+        return None
+    
+    auth_user = AuthUser.from_user(user)
+    with _auth_cache_lock:
+        _user_cache[user_id] = (auth_user, time.monotonic() + AUTH_CACHE_TTL_SECONDS)
+    return auth_user
+
+
+def invalidate_auth_user(user_id: int | None = None):
+    """清除使用者快取（權限、暱稱變更後呼叫）；不帶 user_id 則全部清除"""
+    with _auth_cache_lock:
+        if user_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(user_id, None)
+
+
+def load_user(db: Session, auth_user: AuthUser) -> User:
+    """取得完整的 User ORM 物件（要修改使用者資料時用）"""
+    user = db.query(User).filter(User.id == auth_user.id).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="請先登入")
+    return user
 
 
 def create_access_token(user_id: int, line_user_id: str, token_version: int = 1) -> str:
@@ -121,11 +213,15 @@ def get_or_create_user(db: Session, line_user_id: str, display_name: str, pictur
             logger.warning(f"用戶名稱變更：{user.display_name} → {display_name}")
         
         # 更新資料
+        name_changed = user.display_name != display_name
         user.display_name = display_name
         user.picture_url = picture_url
         user.last_login_at = now
         user.last_active_at = now
         db.commit()
+        invalidate_auth_user(user.id)
+        if name_changed:
+            invalidate_user_search()
     else:
         logger.info(f"建立新用戶：line_user_id={line_user_id[:8]}..., name={display_name}")
         
@@ -147,25 +243,38 @@ def get_or_create_user(db: Session, line_user_id: str, display_name: str, pictur
         db.add(user)
         db.commit()
         db.refresh(user)
+        invalidate_user_search()
         logger.info(f"新用戶建立成功：id={user.id}")
     
     return user
 
 
 def update_user_activity(db: Session, user_id: int):
-    """更新用戶活動時間"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if user:
-        user.last_active_at = datetime.utcnow()
-        db.commit()
+    """更新用戶活動時間（寫入記憶體緩衝，由背景工作批次寫回）"""
+    from app.services.activity_service import record_activity
+    record_activity(user_id)
 
 
-async def get_current_user_optional(request: Request, db: Session) -> tuple[User | None, str | None]:
-    """取得目前使用者（可選）
+def get_current_user_optional_sync(request: Request, db: Session) -> tuple[AuthUser | None, str | None]:
+    """取得目前使用者（可選，同步版）
+
+    給一般 def 路由使用：FastAPI 會在 threadpool 執行，DB 查詢不會卡住事件迴圈。
+    同一個請求只解析一次，結果存在 request.state.auth。
     
     Returns:
         tuple: (user, new_token) - new_token 如果需要刷新則有值
     """
+    resolved = getattr(request.state, "auth", None)
+    if resolved is not None:
+        return resolved
+    
+    resolved = _resolve_current_user(request, db)
+    request.state.auth = resolved
+    return resolved
+
+
+def _resolve_current_user(request: Request, db: Session) -> tuple[AuthUser | None, str | None]:
+    """解析 cookie 中的 token 並取得使用者"""
     token = request.cookies.get("access_token")
     if not token:
         return None, None
@@ -191,7 +300,7 @@ async def get_current_user_optional(request: Request, db: Session) -> tuple[User
     if not user_id:
         return None, None
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = get_auth_user(db, user_id)
     
     # 雙重驗證：確認 line_user_id 也匹配
     if user and line_user_id and user.line_user_id != line_user_id:
@@ -199,7 +308,7 @@ async def get_current_user_optional(request: Request, db: Session) -> tuple[User
         logger.warning(f"⚠️ 安全警告：user_id={user_id} 的 line_user_id 不匹配")
         return None, None
     
-    # 更新用戶活動時間（每次請求都更新）
+    # 更新用戶活動時間（只記在記憶體，不再每個請求 commit）
     if user:
         update_user_activity(db, user.id)
     
@@ -209,17 +318,36 @@ async def get_current_user_optional(request: Request, db: Session) -> tuple[User
     return user, new_token
 
 
-async def get_current_user(request: Request, db: Session) -> User:
-    """取得目前使用者（必須登入）"""
-    user, _ = await get_current_user_optional(request, db)
+def get_current_user_sync(request: Request, db: Session) -> AuthUser:
+    """取得目前使用者（必須登入，同步版）"""
+    user, _ = get_current_user_optional_sync(request, db)
     if not user:
         raise HTTPException(status_code=401, detail="請先登入")
     return user
 
 
-async def get_admin_user(request: Request, db: Session) -> User:
-    """取得管理者使用者"""
-    user = await get_current_user(request, db)
+def get_admin_user_sync(request: Request, db: Session) -> AuthUser:
+    """取得管理者使用者（同步版）"""
+    user = get_current_user_sync(request, db)
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="權限不足")
     return user
+
+
+async def get_current_user_optional(request: Request, db: Session) -> tuple[AuthUser | None, str | None]:
+    """取得目前使用者（可選）
+    
+    Returns:
+        tuple: (user, new_token) - new_token 如果需要刷新則有值
+    """
+    return get_current_user_optional_sync(request, db)
+
+
+async def get_current_user(request: Request, db: Session) -> AuthUser:
+    """取得目前使用者（必須登入）"""
+    return get_current_user_sync(request, db)
+
+
+async def get_admin_user(request: Request, db: Session) -> AuthUser:
+    """取得管理者使用者"""
+    return get_admin_user_sync(request, db)
@@ -0,0 +1,354 @@
+"""
+團單截止排程（程序內）
+
+截止、抽獎、湊團延長、自動催單都在截止時間（或截止前 N 分鐘）由背景工作處理，
+看團單頁不再做任何寫入：
+- 以 heap 依「下一個要處理的時間」排序（催單時間或截止時間，台北時間），
+  啟動時從資料庫重建，開團 / 編輯時由 schedule_group() 登記
+- 到期的團一次處理：一個 UPDATE 關掉所有已截止的團（RETURNING 實際關掉的 id），
+  抽獎、延長、催單各一個批次寫入，commit 後才通知首頁與訂單牆
+- 處理前一律以資料庫為準（heap 裡可能是舊的時間，或團已手動截止 / 刪除），
+  寫入都帶條件，多個 worker 同時處理同一團也只會生效一次
+- 湊團制未達人數：截止時延長 AUTO_EXTEND_MINUTES 分鐘（只延長一次，延長後 auto_extend 改回 False）
+- 自動催單：透過訂單牆頻道送出 remind 事件（購物車有東西但未結單的人），記錄 last_remind_at
+- 截止後寫入結算快照（見 group_settlement），並在背景預先產生核對單（見 receipt_cache）
+- 截止超過 CATCH_UP_MINUTES 才處理的團（停機很久、或部署前就過期的舊團）只關閉、寫快照，
+  不抽獎、不通知、不產生核對單；啟動時 close_expired_groups() 先把這些舊團一次關掉，不進排程
+
+多個 worker 時各自只有自己登記的團，每 deadline_resync_seconds 秒從資料庫重建一次作為保底。
+"""
+import asyncio
+import heapq
+import json
+import logging
+import random
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.database import SessionLocal
+from app.models.group import Group
+from app.models.order import Order, OrderStatus
+from app.services.event_hub import publish
+from app.services.group_settlement import freeze_settlements
+from app.services.home_board import invalidate_home_board
+from app.services.order_wall_events import group_channel, publish_wall_refresh
+from app.services.receipt_cache import prewarm_receipts
+
+logger = logging.getLogger("deadline")
+
+TAIPEI_TZ = timezone(timedelta(hours=8))
+AUTO_EXTEND_MINUTES = 30  # 湊團制未達人數延長多久（開團頁寫「自動延長 30 分鐘」）
+CATCH_UP_MINUTES = 30  # 截止超過這麼久才處理就只關閉（不抽獎、不通知、不產生核對單）
+PENDING_STATUSES = (OrderStatus.DRAFT, OrderStatus.EDITING)
+
+_groups = Group.__table__
+
+_heap: list[tuple[datetime, int]] = []
+_scheduled: dict[int, datetime] = {}  # group_id -> 目前有效的時間（heap 裡其他時間的項目視為過期）
+_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+_wakeup: asyncio.Event | None = None
+
+
+@dataclass
+class DueResult:
+    closed: list[int] = field(default_factory=list)
+    expired: list[int] = field(default_factory=list)  # 截止很久才關閉的團（不抽獎、不通知）
+    extended: list[int] = field(default_factory=list)
+    reminded: dict[int, list[int]] = field(default_factory=dict)  # group_id -> 未結單的 user_id
+    next_due: dict[int, datetime] = field(default_factory=dict)
+
+
+def _now() -> datetime:
+    return datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+
+
+def _remind_at(deadline: datetime, remind_minutes: int | None, last_remind_at: datetime | None) -> datetime | None:
+    """還沒催過的催單時間；沒設定或已經催過回傳 None"""
+    if not remind_minutes:
+        return None
+    remind_at = deadline - timedelta(minutes=remind_minutes)
+    if last_remind_at is not None and last_remind_at >= remind_at:
+        return None
+    return remind_at
+
+
+def _next_due(deadline: datetime, remind_minutes: int | None, last_remind_at: datetime | None) -> datetime:
+    """下一個要處理的時間：還沒催單就是催單時間，否則是截止時間"""
+    remind_at = _remind_at(deadline, remind_minutes, last_remind_at)
+    return remind_at if remind_at and remind_at < deadline else deadline
+
+
+def pick_lucky_winners(user_ids: list[int], count: int) -> str | None:
+    """從已結單的人抽出免單者，回傳逗號分隔的 user_id（沒人結單回傳 None）"""
+    if not user_ids:
+        return None
+    winners = random.sample(user_ids, min(count or 1, len(user_ids)))
+    return ",".join(str(uid) for uid in winners)
+
+
+# ===== heap =====
+
+def _push(group_id: int, when: datetime):
+    with _lock:
+        _scheduled[group_id] = when
+        heapq.heappush(_heap, (when, group_id))
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def _pop_due(now: datetime) -> list[int]:
+    due = []
+    with _lock:
+        while _heap and _heap[0][0] <= now:
+            when, group_id = heapq.heappop(_heap)
+            if _scheduled.get(group_id) == when:
+                del _scheduled[group_id]
+                due.append(group_id)
+    return due
+
+
+def _seconds_until_next() -> float | None:
+    with _lock:
+        while _heap and _scheduled.get(_heap[0][1]) != _heap[0][0]:
+            heapq.heappop(_heap)
+        if not _heap:
+            return None
+        return max((_heap[0][0] - _now()).total_seconds(), 0)
+
+
+def schedule_group(group: Group):
+    """開團 / 改截止時間後登記（commit 前後呼叫都可以，處理時以資料庫為準）"""
+    if group.is_closed:
+        return
+    _push(group.id, _next_due(group.deadline, group.auto_remind_minutes, group.last_remind_at))
+
+
+def rebuild_schedule() -> int:
+    """從資料庫重建排程（所有未關閉的團），回傳登記數"""
+    db = SessionLocal()
+    try:
+        rows = db.query(
+            Group.id, Group.deadline, Group.auto_remind_minutes, Group.last_remind_at,
+        ).filter(Group.is_closed == False).all()
+    finally:
+        db.close()
+
+    entries = [(_next_due(deadline, minutes, last), group_id) for group_id, deadline, minutes, last in rows]
+    heapq.heapify(entries)
+    with _lock:
+        _heap[:] = entries
+        _scheduled.clear()
+        _scheduled.update((group_id, when) for when, group_id in entries)
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+    return len(entries)
+
+
+# ===== 到期處理 =====
+
+def close_expired_groups(db: Session, now: datetime | None = None) -> int:
+    """截止超過 CATCH_UP_MINUTES 仍未關閉的團一次標記為截止（啟動時用），不抽獎、不通知；回傳關閉數
+
+    以前「是否開放」只看截止時間，過期的團在資料庫裡都還是未截止，
+    不先關掉的話第一次重建排程會把整個歷史當成剛截止的團處理。
+    """
+    cutoff = (now or _now()) - timedelta(minutes=CATCH_UP_MINUTES)
+    closed = db.execute(
+        update(_groups).where(
+            _groups.c.is_closed == False,
+            _groups.c.deadline < cutoff,
+        ).values(
+            is_closed=True,
+            closed_by_deadline=True,
+            version=func.coalesce(_groups.c.version, 0) + 1,
+        )
+    ).rowcount
+    db.commit()
+    return closed
+
+
+def process_due_groups(db: Session, group_ids: list[int], now: datetime) -> DueResult:
+    """處理到期的團：截止 + 抽獎、湊團延長、催單（commit 由呼叫端負責）"""
+    result = DueResult()
+    rows = db.query(
+        Group.id, Group.deadline, Group.min_members, Group.auto_extend, Group.submitted_orders,
+        Group.auto_remind_minutes, Group.last_remind_at,
+        Group.enable_lucky_draw, Group.lucky_draw_count, Group.lucky_winner_ids,
+    ).filter(Group.id.in_(group_ids), Group.is_closed == False).all()
+
+    to_close, to_extend, to_remind = [], [], []
+    for row in rows:
+        if row.deadline <= now:
+            # 湊團制未達人數：截止後不久才延長（停機很久後重建排程時不延長早就過期的團）
+            if (
+                row.auto_extend
+                and row.min_members
+                and (row.submitted_orders or 0) < row.min_members
+                and now - row.deadline <= timedelta(minutes=AUTO_EXTEND_MINUTES)
+            ):
+                to_extend.append(row)
+            else:
+                to_close.append(row)
+        else:
+            remind_at = _remind_at(row.deadline, row.auto_remind_minutes, row.last_remind_at)
+            if remind_at and remind_at <= now:
+                to_remind.append(row)
+            else:
+                result.next_due[row.id] = _next_due(row.deadline, row.auto_remind_minutes, row.last_remind_at)
+
+    if to_close:
+        result.closed = list(db.execute(
+            update(_groups).where(
+                _groups.c.id.in_([row.id for row in to_close]),
+                _groups.c.is_closed == False,
+                _groups.c.deadline <= now,
+            ).values(
+                is_closed=True,
+                closed_by_deadline=True,
+                version=func.coalesce(_groups.c.version, 0) + 1,
+            ).returning(_groups.c.id)
+        ).scalars())
+        closed_ids = set(result.closed)
+        stale = {row.id for row in to_close if now - row.deadline > timedelta(minutes=CATCH_UP_MINUTES)}
+        result.expired = [group_id for group_id in result.closed if group_id in stale]
+        result.closed = [group_id for group_id in result.closed if group_id not in stale]
+        _draw_lucky_winners(db, [row for row in to_close if row.id in closed_ids and row.id not in stale])
+
+    if to_extend:
+        db.execute(
+            update(_groups).where(
+                _groups.c.id == bindparam("gid"),
+                _groups.c.deadline == bindparam("old_deadline"),
+                _groups.c.is_closed == False,
+            ).values(
+                deadline=bindparam("new_deadline"),
+                auto_extend=False,
+                version=func.coalesce(_groups.c.version, 0) + 1,
+            ),
+            [
+                {
+                    "gid": row.id,
+                    "old_deadline": row.deadline,
+                    "new_deadline": row.deadline + timedelta(minutes=AUTO_EXTEND_MINUTES),
+                }
+                for row in to_extend
+            ],
+        )
+        for row in to_extend:
+            result.extended.append(row.id)
+            new_deadline = row.deadline + timedelta(minutes=AUTO_EXTEND_MINUTES)
+            result.next_due[row.id] = _next_due(new_deadline, row.auto_remind_minutes, row.last_remind_at)
+
+    if to_remind:
+        remind_ids = [row.id for row in to_remind]
+        db.execute(
+            update(_groups).where(_groups.c.id.in_(remind_ids)).values(last_remind_at=now)
+        )
+        pending = db.query(Order.group_id, Order.user_id).filter(
+            Order.group_id.in_(remind_ids),
+            Order.status.in_(PENDING_STATUSES),
+            Order.items.any(),
+        ).all()
+        for group_id, user_id in pending:
+            result.reminded.setdefault(group_id, []).append(user_id)
+        for row in to_remind:
+            result.next_due[row.id] = row.deadline
+
+    return result
+
+
+def _draw_lucky_winners(db: Session, rows):
+    """剛截止、啟用隨機免單且還沒抽過的團，一次查出已結單的人再批次寫入中獎者"""
+    rows = [row for row in rows if row.enable_lucky_draw and not row.lucky_winner_ids]
+    if not rows:
+        return
+    submitted: dict[int, list[int]] = {}
+    for group_id, user_id in db.query(Order.group_id, Order.user_id).filter(
+        Order.group_id.in_([row.id for row in rows]),
+        Order.status == OrderStatus.SUBMITTED,
+    ).all():
+        submitted.setdefault(group_id, []).append(user_id)
+
+    params = []
+    for row in rows:
+        winners = pick_lucky_winners(submitted.get(row.id, []), row.lucky_draw_count)
+        if winners:
+            params.append({"gid": row.id, "winners": winners})
+    if params:
+        db.execute(
+            update(_groups).where(
+                _groups.c.id == bindparam("gid"),
+                _groups.c.lucky_winner_ids.is_(None),
+            ).values(lucky_winner_ids=bindparam("winners")),
+            params,
+        )
+
+
+def run_due_groups(group_ids: list[int]) -> DueResult:
+    """處理到期的團並送出通知，未處理完的團重新登記"""
+    db = SessionLocal()
+    try:
+        result = process_due_groups(db, group_ids, _now())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    freeze_settlements(result.closed + result.expired)
+    if result.expired:
+        invalidate_home_board()
+    for group_id in result.closed:
+        invalidate_home_board("group_closed", group_id)
+        publish_wall_refresh(group_id)
+        prewarm_receipts(group_id)
+    for group_id in result.extended:
+        invalidate_home_board("group_updated", group_id)
+        publish_wall_refresh(group_id)
+    for group_id, user_ids in result.reminded.items():
+        publish(group_channel(group_id), json.dumps({"type": "remind", "user_ids": user_ids}))
+    for group_id, when in result.next_due.items():
+        _push(group_id, when)
+    return result
+
+
+async def deadline_scheduler_loop(resync_seconds: int):
+    """背景工作：睡到下一個到期時間（或被新登記的團叫醒），到期的團一起處理"""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    resync_at = 0.0
+
+    while True:
+        if _loop.time() >= resync_at:
+            try:
+                await run_in_threadpool(rebuild_schedule)
+            except Exception as e:
+                logger.error(f"截止排程重建失敗：{e}")
+            resync_at = _loop.time() + resync_seconds
+
+        _wakeup.clear()
+        due = _pop_due(_now())
+        if due:
+            try:
+                await run_in_threadpool(run_due_groups, due)
+            except Exception as e:
+                # 這批會在下次重建排程時再處理
+                logger.error(f"截止排程處理失敗：{e}")
+            continue
+
+        timeout = resync_at - _loop.time()
+        until_next = _seconds_until_next()
+        if until_next is not None:
+            timeout = min(timeout, until_next)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
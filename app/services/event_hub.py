@@ -0,0 +1,131 @@
+"""
+即時事件中心（SSE 共用）
+
+單一 process 內的 pub/sub，以頻道區分：
+- "home"：首頁看板（見 home_events）
+- "group:{id}"：團單頁訂單牆（見 order_wall_events）
+
+每個連線一個 asyncio.Queue，寫入端（threadpool）用 call_soon_threadsafe 丟進各連線的
+event loop；payload 是已經序列化好的 JSON 字串，發送端只組一次，所有連線共用。
+多個 worker 時各自只通知自己的連線，前端要有定時刷新作為保底。
+"""
+import asyncio
+import json
+import threading
+
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from app.database import SessionLocal
+
+SUBSCRIBER_QUEUE_SIZE = 100  # 連線讀太慢時最多累積幾筆，滿了改送一筆 resync 讓前端整塊刷新
+KEEPALIVE_SECONDS = 25  # 沒有事件時多久送一次註解，避免 proxy 斷線
+RESYNC_PAYLOAD = json.dumps({"type": "resync"})
+
+_channels: dict[str, dict[asyncio.Queue, asyncio.AbstractEventLoop]] = {}
+_lock = threading.Lock()
+
+
+def subscribe(channel: str) -> asyncio.Queue:
+    """註冊一個連線（在 event loop 內呼叫）"""
+    queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+    with _lock:
+        _channels.setdefault(channel, {})[queue] = asyncio.get_running_loop()
+    return queue
+
+
+def unsubscribe(channel: str, queue: asyncio.Queue):
+    """連線結束時移除"""
+    with _lock:
+        subscribers = _channels.get(channel)
+        if subscribers is not None:
+            subscribers.pop(queue, None)
+            if not subscribers:
+                del _channels[channel]
+
+
+def subscriber_count(channel: str) -> int:
+    return len(_channels.get(channel, ()))
+
+
+def _deliver(queue: asyncio.Queue, payload: str):
+    """在連線自己的 event loop 上放入事件"""
+    try:
+        queue.put_nowait(payload)
+    except asyncio.QueueFull:
+        # 跟不上就丟掉累積的事件，改成整塊刷新
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC_PAYLOAD)
+
+
+def publish(channel: str, payload: str):
+    """送給頻道上所有連線（任何 thread 都可呼叫，資料應已 commit）"""
+    with _lock:
+        targets = list(_channels.get(channel, {}).items())
+    for queue, loop in targets:
+        try:
+            loop.call_soon_threadsafe(_deliver, queue, payload)
+        except RuntimeError:
+            # event loop 已關閉
+            unsubscribe(channel, queue)
+
+
+def publish_after_commit(db, channel: str, key, payload: str):
+    """交易內登記事件，commit 成功後才送出（rollback 就丟棄）
+
+    同一交易內相同 (channel, key) 只留最後一筆。
+    """
+    db.info.setdefault("event_hub", {})[(channel, key)] = payload
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_queued(session):
+    events = session.info.pop("event_hub", None)
+    if not events:
+        return
+    for (channel, _key), payload in events.items():
+        publish(channel, payload)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_queued(session):
+    session.info.pop("event_hub", None)
+
+
+async def sse_response(request, channel: str, authorize) -> StreamingResponse:
+    """開一條 SSE 連線
+
+    長連線不能佔 threadpool 也不能佔 DB 連線：authorize(db) 用一個短 session 在
+    threadpool 檢查權限（不通過就 raise HTTPException），查完就關，之後只在 event loop 上等事件。
+    """
+    def check():
+        db = SessionLocal()
+        try:
+            authorize(db)
+        finally:
+            db.close()
+
+    await run_in_threadpool(check)
+
+    queue = subscribe(channel)
+
+    async def event_stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {payload}\n\n"
+        finally:
+            unsubscribe(channel, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,66 @@
-"""訂單匯出 Excel 服務"""
+"""
+訂單匯出 Excel 服務
+
+- 單一團單：export_orders_to_excel / render_orders_excel，openpyxl 排好版（標題、合併儲存格），資料來自團單結算
+- 後台日期區間：stream_orders_excel，多個團一起匯出，用 xlsx_stream 邊查邊寫邊送，
+  訂單以 yield_per 分批讀取，匯出幾個月的資料記憶體也不會跟著長
+"""
+from datetime import datetime
 from io import BytesIO
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
+from sqlalchemy import func, literal, select
+
+from app.database import SessionLocal
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.store import Store
+from app.models.user import User
+from app.services.group_settlement import GroupSettlement, get_settlement
+from app.services.xlsx_stream import (
+    STYLE_BOLD, STYLE_BOLD_MONEY, STYLE_DISCOUNT, STYLE_HEADER, STYLE_MONEY, XlsxStreamWriter,
+)
 
+EXCEL_STREAM_BATCH = 1000  # 每次從資料庫取幾列（yield_per）
+EXCEL_LAYOUTS = ("store", "flat")  # store：每個店家一個工作表；flat：全部在同一個工作表
 
-def export_orders_to_excel(group, orders) -> BytesIO:
+
+def export_orders_to_excel(db, group) -> BytesIO:
     """匯出團單訂單為 Excel"""
+    return BytesIO(render_orders_excel(excel_snapshot(get_settlement(db, group))))
+
+
+def excel_snapshot(settlement: GroupSettlement) -> dict:
+    """Excel 需要的資料（只含基本型別，可以送到匯出 process，見 export_executor）"""
+    return {
+        "group_name": settlement.group_name,
+        "store_name": settlement.store_name,
+        "deadline": settlement.deadline,
+        "delivery_fee": float(settlement.delivery_fee) if settlement.delivery_fee else None,
+        "orders": [
+            {
+                "name": person.name,
+                "items": [
+                    {
+                        "item_name": item.item_name,
+                        "quantity": item.quantity,
+                        "spec_label": item.spec_label,
+                        "note": item.note,
+                        "subtotal": float(item.subtotal),
+                    }
+                    for item in person.items
+                ],
+                "discount": float(person.discount),
+                "discount_note": person.discount_note,
+            }
+            for person in settlement.people
+        ],
+    }
+
+
+def render_orders_excel(data: dict) -> bytes:
+    """依 excel_snapshot() 的資料產生 Excel 檔（不碰資料庫）"""
     wb = Workbook()
     ws = wb.active
     ws.title = "訂單明細"
@@ -24,12 +78,11 @@ def export_orders_to_excel(group, orders) -> BytesIO:
     
     # 標題資訊
     ws.merge_cells('A1:F1')
-    ws['A1'] = f"團單：{group.name}"
+    ws['A1'] = f"團單：{data['group_name']}"
     ws['A1'].font = Font(bold=True, size=14)
     
     ws.merge_cells('A2:F2')
-    store_name = group.store.name if group.store else (group.store_name or "（店家已移除）")
-    ws['A2'] = f"店家：{store_name} | 截止：{group.deadline.strftime('%Y/%m/%d %H:%M')}"
+    ws['A2'] = f"店家：{data['store_name']} | 截止：{data['deadline'].strftime('%Y/%m/%d %H:%M')}"
     ws['A2'].font = Font(size=10, color="666666")
     
     # 表頭
@@ -45,33 +98,19 @@ def export_orders_to_excel(group, orders) -> BytesIO:
     row = 5
     total_amount = 0
     
-    for order in orders:
-        if order.status.value != 'submitted':
-            continue
+    for order in data["orders"]:
+        for item in order["items"]:
+            ws.cell(row=row, column=1, value=order["name"]).border = thin_border
+            ws.cell(row=row, column=2, value=item["item_name"]).border = thin_border
+            ws.cell(row=row, column=3, value=item["quantity"]).border = thin_border
             
-        for item in order.items:
-            ws.cell(row=row, column=1, value=order.user.show_name).border = thin_border
-            ws.cell(row=row, column=2, value=item.item_name).border = thin_border
-            ws.cell(row=row, column=3, value=item.quantity).border = thin_border
+            # 規格文字寫入時已算好（order_items.spec_label）
+            ws.cell(row=row, column=4, value=item["spec_label"] or "-").border = thin_border
             
-            # 規格（size/sugar/ice 是欄位，選項與加料是關聯物件）
-            specs = []
-            if item.size:
-                specs.append(item.size)
-            if item.sugar:
-                specs.append(item.sugar)
-            if item.ice:
-                specs.append(item.ice)
-            for opt in item.selected_options:
-                specs.append(opt.option_name)
-            for top in item.selected_toppings:
-                specs.append(f"+{top.topping_name}")
-            ws.cell(row=row, column=4, value=" / ".join(specs) if specs else "-").border = thin_border
-            
-            ws.cell(row=row, column=5, value=item.note or "-").border = thin_border
+            ws.cell(row=row, column=5, value=item["note"] or "-").border = thin_border
             
             # 小計用 OrderItem.subtotal（已含單價+選項+加料+數量），與個人/店家明細一致
-            subtotal = float(item.subtotal)
+            subtotal = item["subtotal"]
             ws.cell(row=row, column=6, value=subtotal).border = thin_border
             ws.cell(row=row, column=6).number_format = '$#,##0'
             
@@ -79,13 +118,13 @@ def export_orders_to_excel(group, orders) -> BytesIO:
             row += 1
 
         # 折扣列（有折扣才加）
-        if order.discount_amount and order.discount_amount > 0:
-            ws.cell(row=row, column=1, value=order.user.show_name).border = thin_border
-            note = f"折扣（{order.discount_note}）" if order.discount_note else "折扣"
+        if order["discount"] > 0:
+            ws.cell(row=row, column=1, value=order["name"]).border = thin_border
+            note = f"折扣（{order['discount_note']}）" if order["discount_note"] else "折扣"
             ws.cell(row=row, column=2, value=note).border = thin_border
             ws.cell(row=row, column=4, value="-").border = thin_border
             ws.cell(row=row, column=5, value="-").border = thin_border
-            disc = -float(order.discount_amount)
+            disc = -order["discount"]
             ws.cell(row=row, column=6, value=disc).border = thin_border
             ws.cell(row=row, column=6).number_format = '$#,##0'
             ws.cell(row=row, column=6).font = Font(color="C0392B")
@@ -101,17 +140,17 @@ def export_orders_to_excel(group, orders) -> BytesIO:
     ws.cell(row=row, column=6).number_format = '$#,##0'
     
     # 外送費
-    if group.delivery_fee:
+    if data["delivery_fee"]:
         row += 1
         ws.merge_cells(f'A{row}:E{row}')
         ws.cell(row=row, column=1, value="外送費").alignment = Alignment(horizontal="right")
-        ws.cell(row=row, column=6, value=float(group.delivery_fee)).number_format = '$#,##0'
+        ws.cell(row=row, column=6, value=data["delivery_fee"]).number_format = '$#,##0'
         
         row += 1
         ws.merge_cells(f'A{row}:E{row}')
         ws.cell(row=row, column=1, value="總計").font = Font(bold=True)
         ws.cell(row=row, column=1).alignment = Alignment(horizontal="right")
-        ws.cell(row=row, column=6, value=total_amount + float(group.delivery_fee)).font = Font(bold=True)
+        ws.cell(row=row, column=6, value=total_amount + data["delivery_fee"]).font = Font(bold=True)
         ws.cell(row=row, column=6).number_format = '$#,##0'
     
     # 調整欄寬
@@ -122,6 +161,122 @@ def export_orders_to_excel(group, orders) -> BytesIO:
     # 儲存到 BytesIO
     output = BytesIO()
     wb.save(output)
-    output.seek(0)
-    
-    return output
+    return output.getvalue()
+
+
+# ===== 後台日期區間匯出（串流） =====
+
+def _range_rows(db, start: datetime, end: datetime, by_store: bool):
+    """區間內（依截止時間）已結單的品項，一列一個品項；依店家（by_store）、團、訂單排序"""
+    store_name = func.coalesce(Store.name, Group.store_name, literal("（店家已移除）")).label("store_name")
+    stmt = (
+        select(
+            store_name,
+            Group.id.label("group_id"),
+            Group.name.label("group_name"),
+            Group.deadline,
+            Group.delivery_fee,
+            Order.id.label("order_id"),
+            Order.discount_amount,
+            Order.discount_note,
+            func.coalesce(func.nullif(User.nickname, ""), User.display_name).label("user_name"),
+            OrderItem.item_name,
+            OrderItem.quantity,
+            OrderItem.spec_label,
+            OrderItem.note,
+            OrderItem.line_total,
+        )
+        .select_from(OrderItem)
+        .join(Order, OrderItem.order_id == Order.id)
+        .join(Group, Order.group_id == Group.id)
+        .join(User, Order.user_id == User.id)
+        .outerjoin(Store, Group.store_id == Store.id)
+        .where(
+            Order.status == OrderStatus.SUBMITTED,
+            Group.deadline >= start,
+            Group.deadline < end,
+        )
+    )
+    order_by = [Group.deadline, Group.id, Order.id, OrderItem.id]
+    if by_store:
+        order_by.insert(0, store_name)
+    # yield_per：server-side cursor（PostgreSQL）分批取，不會一次把整個區間載進來
+    return db.execute(stmt.order_by(*order_by).execution_options(yield_per=EXCEL_STREAM_BATCH))
+
+
+def stream_orders_excel(start: datetime, end: datetime, layout: str = "store"):
+    """後台匯出區間內所有團單的訂單明細（generator，產生 XLSX 的片段給 StreamingResponse）
+
+    layout="store" 每個店家一個工作表，"flat" 全部一個工作表（多一欄店家）。
+    自己開 session：串流期間請求的 session 可能已經關了。
+    """
+    by_store = layout == "store"
+    headers = ["截止時間", "團單"] + ([] if by_store else ["店家"]) + ["訂購人", "品項", "數量", "規格", "備註", "小計"]
+    widths = [17, 20] + ([] if by_store else [16]) + [12, 25, 8, 20, 15, 10]
+    money_col = len(headers) - 1
+    money = {money_col: STYLE_MONEY}
+
+    writer = XlsxStreamWriter()
+    state = {"sheet_total": 0.0, "store": None, "group": None, "order": None}
+
+    def start_sheet(name: str):
+        writer.add_sheet(name, widths=widths, freeze_rows=1)
+        writer.append(headers, style=STYLE_HEADER)
+        state["sheet_total"] = 0.0
+
+    def line(row, user_name, item_name, quantity, spec, note, amount, amount_style=STYLE_MONEY):
+        values = [row.deadline.strftime("%Y/%m/%d %H:%M"), row.group_name]
+        if not by_store:
+            values.append(row.store_name)
+        values += [user_name, item_name, quantity, spec, note, amount]
+        writer.append(values, styles={money_col: amount_style})
+        state["sheet_total"] += amount
+
+    def end_order(row):
+        # 折扣列（有折扣才加）
+        discount = float(row.discount_amount or 0)
+        if discount > 0:
+            note = f"折扣（{row.discount_note}）" if row.discount_note else "折扣"
+            line(row, row.user_name, note, None, "-", "-", -discount, STYLE_DISCOUNT)
+
+    def end_group(row):
+        if row.delivery_fee:
+            line(row, "-", "外送費", None, "-", "-", float(row.delivery_fee))
+
+    def end_sheet():
+        writer.append([None] * (money_col - 1) + ["合計", state["sheet_total"]], styles={
+            money_col - 1: STYLE_BOLD, money_col: STYLE_BOLD_MONEY,
+        })
+
+    db = SessionLocal()
+    try:
+        last = None
+        for row in _range_rows(db, start, end, by_store):
+            if last is not None and row.order_id != last.order_id:
+                end_order(last)
+            if last is not None and row.group_id != last.group_id:
+                end_group(last)
+            if last is None or (by_store and row.store_name != last.store_name):
+                if last is not None:
+                    end_sheet()
+                start_sheet(row.store_name if by_store else "訂單明細")
+
+            line(row, row.user_name, row.item_name, row.quantity, row.spec_label or "-", row.note or "-",
+                 float(row.line_total or 0))
+            last = row
+
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+
+        if last is None:
+            start_sheet("訂單明細")
+        else:
+            end_order(last)
+            end_group(last)
+        end_sheet()
+    finally:
+        db.close()
+
+    writer.close()
+    yield writer.drain()
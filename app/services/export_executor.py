@@ -0,0 +1,199 @@
+"""
+匯出執行器（CPU 密集的檔案產生移出 web process）
+
+核對單 PDF（reportlab）、PNG（pypdfium2 點陣化 + 拼接）、Excel（openpyxl）、QR Code 都是純 CPU 工作；
+在 threadpool 裡跑會一直握著 GIL，12:05 一張大核對單就能讓同一個 worker 的購物車操作全部卡住。
+- 路由先在自己的 thread 查好資料，轉成只含基本型別的快照（collect_receipt / excel_snapshot），
+  再把「快照 → bytes」的函式丟到 ProcessPoolExecutor 執行，等結果時不佔 GIL
+- process pool 建不起來（或 worker 掛掉）時改用 thread pool 執行，功能不受影響
+- 每種匯出有各自的同時執行上限（EXPORT_KIND_LIMITS），排隊超過 EXPORT_WAIT_SECONDS 回 503
+- 後台日期區間的 Excel 是串流產生（見 excel_service.stream_orders_excel），只用 acquire_export_slot() 限制同時數量
+- export_stats()：各種匯出的排隊數、執行中、完成 / 失敗次數與平均耗時（後台 /admin/export-stats）
+- export_idle()：核對單背景預先產生前確認沒人在排隊或執行（見 receipt_cache）
+
+export_workers = 0 時直接用 thread pool（開發環境、不能開 process 的平台）。
+"""
+import io
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+
+from fastapi import HTTPException
+
+from app.config import get_settings
+
+logger = logging.getLogger("export")
+settings = get_settings()
+
+EXPORT_KIND_LIMITS = {
+    "receipt_pdf": 2,
+    "receipt_png": 2,
+    "excel": 2,
+    "qrcode": 4,
+    "excel_range": 1,  # 後台日期區間匯出（串流，不經過 process pool，佔的是資料庫連線）
+}
+EXPORT_WAIT_SECONDS = 30  # 排隊等多久還輪不到就放棄
+
+
+@dataclass
+class ExportStats:
+    waiting: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0  # 排隊逾時
+    max_waiting: int = 0
+    total_seconds: float = 0.0
+
+
+_limiters = {kind: threading.BoundedSemaphore(limit) for kind, limit in EXPORT_KIND_LIMITS.items()}
+_stats = {kind: ExportStats() for kind in EXPORT_KIND_LIMITS}
+_stats_lock = threading.Lock()
+
+_executor: Executor | None = None
+_executor_lock = threading.Lock()
+
+
+def _create_executor() -> Executor:
+    workers = settings.export_workers
+    if workers > 0:
+        try:
+            # spawn：不從已經開了 DB 連線、thread 的 web process fork
+            return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        except (OSError, NotImplementedError) as e:
+            logger.warning(f"匯出 process pool 無法建立，改用 thread：{e}")
+    return ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="export")
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = _create_executor()
+    return _executor
+
+
+def _fallback_to_threads(broken: Executor):
+    """process pool 壞掉（worker 被殺、無法 spawn）時換成 thread pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            logger.warning("匯出 process pool 已失效，改用 thread")
+            _executor = ThreadPoolExecutor(max_workers=max(settings.export_workers, 1), thread_name_prefix="export")
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _execute(fn, args) -> bytes:
+    executor = _get_executor()
+    try:
+        return executor.submit(fn, *args).result()
+    except BrokenProcessPool:
+        _fallback_to_threads(executor)
+        return _get_executor().submit(fn, *args).result()
+
+
+class ExportSlot:
+    """取得的匯出名額；release() 可以重複呼叫（串流匯出的 generator 與 background task 都會呼叫）"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self, ok: bool = True):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        _limiters[self.kind].release()
+        stats = _stats[self.kind]
+        with _stats_lock:
+            stats.running -= 1
+            stats.total_seconds += time.perf_counter() - self.started
+            if ok:
+                stats.completed += 1
+            else:
+                stats.failed += 1
+
+
+def acquire_export_slot(kind: str) -> ExportSlot:
+    """排隊取得匯出名額（EXPORT_WAIT_SECONDS 內輪不到回 503），用完要呼叫 release()"""
+    limiter = _limiters[kind]
+    stats = _stats[kind]
+    with _stats_lock:
+        stats.waiting += 1
+        stats.max_waiting = max(stats.max_waiting, stats.waiting)
+    acquired = limiter.acquire(timeout=EXPORT_WAIT_SECONDS)
+    with _stats_lock:
+        stats.waiting -= 1
+        if acquired:
+            stats.running += 1
+        else:
+            stats.rejected += 1
+    if not acquired:
+        raise HTTPException(status_code=503, detail="匯出的人太多，請稍後再試")
+    return ExportSlot(kind)
+
+
+def run_export(kind: str, fn, *args) -> bytes:
+    """在匯出執行器產生檔案並等結果（fn 與 args 要能 pickle：模組層級函式 + 基本型別資料）"""
+    slot = acquire_export_slot(kind)
+    ok = False
+    try:
+        result = _execute(fn, args)
+        ok = True
+        return result
+    finally:
+        slot.release(ok)
+
+
+def export_idle(*kinds: str) -> bool:
+    """這幾種匯出目前都沒有人排隊或執行（背景預先產生只在閒置時做，不跟使用者搶名額）"""
+    with _stats_lock:
+        return all(_stats[kind].waiting == 0 and _stats[kind].running == 0 for kind in kinds)
+
+
+def export_stats() -> dict:
+    """各種匯出的排隊 / 執行狀況"""
+    executor = _executor
+    with _stats_lock:
+        kinds = {}
+        for kind, stats in _stats.items():
+            data = asdict(stats)
+            done = stats.completed + stats.failed
+            data["avg_seconds"] = round(stats.total_seconds / done, 3) if done else None
+            data["limit"] = EXPORT_KIND_LIMITS[kind]
+            kinds[kind] = data
+    return {
+        "backend": None if executor is None else ("process" if isinstance(executor, ProcessPoolExecutor) else "thread"),
+        "workers": settings.export_workers,
+        "kinds": kinds,
+    }
+
+
+def shutdown_export_executor():
+    """關機時收掉 worker"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def render_qrcode_png(data: str) -> bytes:
+    """QR Code PNG"""
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -0,0 +1,111 @@
+"""
+團單訂單計數（寫入時維護）
+
+groups 表上存三個冗餘欄位，卡片 / 列表不用再載入 orders：
+- submitted_orders：已結單人數
+- pending_orders：購物車有東西但未結單的人數（草稿 / 修改中）
+- submitted_subtotal：已結單訂單應付金額合計（折扣後，不含外送費）
+
+每個會改到訂單的端點在 commit 前呼叫 refresh_group_counters()，同一筆交易內重算並寫回
+（金額加總 orders.total_amount，改到品項的端點要先 refresh_order_totals）；
+購物車指令（order_commands）已經先鎖住團單，改用 shift_group_counters() 只加減這筆訂單的差額；
+欄位若對不起來，可用 scripts/recompute_group_counters.py 全部重算。
+計數有變時登記一筆首頁 counters 事件，commit 後推給開著首頁的人；
+每次重算也會把 groups.version +1（見 group_version）。
+"""
+from decimal import Decimal
+
+from sqlalchemy import exists, func
+from sqlalchemy.orm import Session
+
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderStatus
+from app.services.group_version import bump_group_version
+from app.services.home_events import queue_home_event
+
+
+def _compute_counters(db: Session, group_id: int) -> dict:
+    """從 orders / order_items 算出團單的計數"""
+    submitted_count, submitted_subtotal = db.query(
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.total_amount), 0),
+    ).filter(
+        Order.group_id == group_id,
+        Order.status == OrderStatus.SUBMITTED,
+    ).one()
+
+    pending = db.query(Order.id).filter(
+        Order.group_id == group_id,
+        Order.status.in_([OrderStatus.DRAFT, OrderStatus.EDITING]),
+        exists().where(OrderItem.order_id == Order.id),
+    ).count()
+
+    return {
+        "submitted_orders": submitted_count,
+        "pending_orders": pending,
+        "submitted_subtotal": Decimal(str(submitted_subtotal)),
+    }
+
+
+def refresh_group_counters(db: Session, group_id: int):
+    """重算團單計數（在呼叫端的交易內，commit 由呼叫端負責）
+
+    先鎖住團單那一列，同一團同時有多筆訂單異動時依序重算，
+    最後 commit 的那筆一定看得到其他人已 commit 的訂單。
+    """
+    db.flush()
+    group = db.query(Group).filter(Group.id == group_id).with_for_update().first()
+    if not group:
+        return
+    counters = _compute_counters(db, group_id)
+    changed = (
+        group.submitted_orders != counters["submitted_orders"]
+        or group.pending_orders != counters["pending_orders"]
+    )
+    for column, value in counters.items():
+        setattr(group, column, value)
+    bump_group_version(group)
+    if changed:
+        queue_home_event(
+            db, "counters", group_id,
+            submitted=counters["submitted_orders"],
+            pending=counters["pending_orders"],
+        )
+
+
+def shift_group_counters(db: Session, group: Group, submitted: int = 0, pending: int = 0, subtotal: Decimal = Decimal("0")):
+    """把一筆訂單異動前後的差額加到團單計數，不重新 COUNT（commit 由呼叫端負責）
+
+    呼叫端必須在讀訂單之前就鎖住團單那一列（SELECT ... FOR UPDATE），差額才不會跟別人的異動交錯。
+    計數還沒回填（NULL）時改用 refresh_group_counters() 整個重算。
+    """
+    if group.submitted_orders is None or group.pending_orders is None or group.submitted_subtotal is None:
+        refresh_group_counters(db, group.id)
+        return
+    if submitted or pending:
+        group.submitted_orders += submitted
+        group.pending_orders += pending
+        queue_home_event(
+            db, "counters", group.id,
+            submitted=group.submitted_orders,
+            pending=group.pending_orders,
+        )
+    if subtotal:
+        group.submitted_subtotal += subtotal
+    bump_group_version(group)
+
+
+def recompute_group_counters(db: Session, only_missing: bool = False) -> int:
+    """全部重算（修復 / 新欄位回填），回傳處理的團單數
+
+    only_missing=True 只補還沒有計數的團（新增欄位後的舊資料）。
+    """
+    query = db.query(Group.id)
+    if only_missing:
+        query = query.filter(Group.submitted_orders.is_(None))
+    group_ids = [gid for (gid,) in query.order_by(Group.id).all()]
+
+    for group_id in group_ids:
+        refresh_group_counters(db, group_id)
+        db.commit()
+    return len(group_ids)
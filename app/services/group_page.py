@@ -0,0 +1,147 @@
+"""
+團單頁資料載入
+
+團單頁要的東西（團單、店家、訂單牆、我的訂單、未結單、上次訂單、常點 / 熱門品項、
+收藏、請客者）用固定幾個查詢一次載入，不隨訂單數或品項數增加：
+1. 團單 + 店家 + 團主 + 請客者 + 我在這家店的點餐習慣 + 是否已收藏
+   （一個 SELECT，收藏用 EXISTS 子查詢；常點品項、最近訂單 id 都在點餐習慣那一列）
+2. 這團所有訂單 + 我在同店家的最近訂單（一個 SELECT，joinedload 品項 / 選項 / 加料 / 下單者）
+3. 店家熱門品項
+轉移團主的名單不在這裡載入，改由 /users/search 依輸入搜尋（見 user_search）。
+菜單、加料、甜度冰塊、分店另外讀菜單快照（menu_cache），通常不用查資料庫。
+
+模板只能讀已載入的欄位；載入後若 commit（例如抽獎），物件會 expire，需重新載入。
+"""
+from dataclasses import dataclass, field, fields
+from typing import NamedTuple
+
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import Session, aliased, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.sales import UserStoreAffinity
+from app.models.store import Store
+from app.models.user import User, UserFavorite
+from app.services.affinity_service import pick_last_order, ranked_items
+from app.services.menu_cache import MenuSnapshot, get_menu_snapshot
+from app.services.sales_rollup_service import store_hot_items
+
+PENDING_STATUSES = (OrderStatus.DRAFT, OrderStatus.EDITING)
+
+
+class StoreItemCount(NamedTuple):
+    """常點品項（count 是杯數或點過幾次，看用在哪）"""
+    item_name: str
+    menu_item_id: int | None
+    count: int
+
+
+@dataclass
+class GroupPage:
+    """團單頁的 view model，欄位名稱就是模板變數名稱"""
+    group: Group
+    store: Store | None
+    menu: MenuSnapshot | None
+    treat_user: User | None = None
+    is_favorited: bool = False
+    submitted_orders: list[Order] = field(default_factory=list)
+    my_order: Order | None = None
+    pending_count: int = 0
+    pending_orders: list[Order] = field(default_factory=list)  # 只有團主 / 管理員
+    last_order: Order | None = None
+    last_order_items: list[OrderItem] = field(default_factory=list)
+    favorite_items: list[StoreItemCount] = field(default_factory=list)
+    hot_items: list = field(default_factory=list)
+    my_frequent: list = field(default_factory=list)  # 菜單快照裡的 ItemView
+    last_specs: dict = field(default_factory=dict)  # 每個品項上次點的規格，加品項時預選
+
+    def as_context(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+def _load_group(db: Session, group_id: int, user_id: int):
+    """團單 + 店家 + 團主 + 請客者 + 點餐習慣 + 是否已收藏此店家"""
+    treat_user = aliased(User)
+    is_favorited = exists().where(
+        UserFavorite.user_id == user_id,
+        UserFavorite.store_id == Group.store_id,
+    ).correlate(Group)
+    return db.query(Group, treat_user, UserStoreAffinity, is_favorited.label("is_favorited")).outerjoin(
+        treat_user, treat_user.id == Group.treat_user_id,
+    ).outerjoin(UserStoreAffinity, and_(
+        UserStoreAffinity.user_id == user_id,
+        UserStoreAffinity.store_id == Group.store_id,
+    )).options(
+        joinedload(Group.store),
+        joinedload(Group.owner),
+    ).filter(Group.id == group_id).first()
+
+
+def _load_orders(db: Session, group: Group, affinity: UserStoreAffinity | None) -> list[Order]:
+    """這團所有訂單，加上我在同店家的最近訂單（從點餐習慣取 id）"""
+    scope = Order.group_id == group.id
+    if affinity and affinity.last_order_ids:
+        scope = or_(scope, Order.id.in_(affinity.last_order_ids))
+
+    return db.query(Order).options(
+        joinedload(Order.user),
+        joinedload(Order.items).joinedload(OrderItem.selected_options),
+        joinedload(Order.items).joinedload(OrderItem.selected_toppings),
+    ).filter(scope).order_by(Order.id).all()
+
+
+def _top(affinity: UserStoreAffinity | None, key: str, limit: int) -> list[StoreItemCount]:
+    return [StoreItemCount(t["item_name"], t["menu_item_id"], t[key]) for t in ranked_items(affinity, key, limit)]
+
+
+def load_group_page(db: Session, group_id: int, user) -> GroupPage | None:
+    """載入團單頁資料；團單不存在回傳 None。user 可以是 AuthUser"""
+    row = _load_group(db, group_id, user.id)
+    if not row:
+        return None
+    group, treat_user, affinity, is_favorited = row
+    can_manage = group.owner_id == user.id or user.is_admin
+
+    page = GroupPage(
+        group=group,
+        store=group.store,
+        menu=get_menu_snapshot(db, group.menu_id),
+        treat_user=treat_user,
+        is_favorited=bool(is_favorited),
+        last_specs=(affinity.last_specs or {}) if affinity else {},
+    )
+
+    orders = _load_orders(db, group, affinity)
+    page.last_order = pick_last_order(affinity, orders, exclude_group_id=group.id)
+    if page.last_order:
+        page.last_order_items = page.last_order.items
+
+    group_orders = [order for order in orders if order.group_id == group.id]
+    for order in group_orders:
+        if order.status == OrderStatus.SUBMITTED:
+            page.submitted_orders.append(order)
+        elif order.status in PENDING_STATUSES:
+            page.pending_count += 1
+            # 催單名單只列有品項的訂單
+            if can_manage and order.items:
+                page.pending_orders.append(order)
+        if order.user_id == user.id and page.my_order is None:
+            page.my_order = order
+    # 模板的刪團提示會讀 group.orders，直接填入已載入的訂單
+    set_committed_value(group, "orders", group_orders)
+
+    # 常點（點過幾次前 5 名）與個人常點（杯數前 8 名、對應到目前菜單可點的取 4 個）
+    page.favorite_items = _top(affinity, "line_count", 5)
+    if page.menu:
+        page.my_frequent = [
+            item for item in (page.menu.get_item(r.menu_item_id) for r in _top(affinity, "quantity", 8))
+            if item
+        ][:4]
+
+    if group.store_id:
+        # 店家熱門品項（全站統計，最近 30 天）
+        page.hot_items = store_hot_items(db, group.store_id, days=30, limit=5)
+
+    return page
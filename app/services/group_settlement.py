@@ -0,0 +1,403 @@
+"""
+團單結算（點餐文字、收款文字、核對單、Excel 共用）
+
+四種匯出原本各自重查訂單、各自逐筆 lazy load 使用者 / 品項，店家總項與折扣、外送費也各算各的。
+改成一次算好 GroupSettlement，匯出都從它產生：
+- 查詢數固定：店家 / 團主 / 分店各一次，訂單 + 使用者一次，品項一次（selectinload），與人數無關
+- 店家總項：已結單品項依 spec_key 彙總（與購物車合併同一個 key）
+- 每人應付：訂單的 total_amount（折扣後，寫入時維護）+ 外送費分攤
+- 外送費分攤：外送費 / 已結單人數，四捨五入到元
+- 店家實收：品項原價合計 - 所有人折扣（不低於 0）
+
+依 (group_id, groups.version) 記在程序內（訂單、折扣、外送費異動都會讓 version +1）。
+使用者改名、店家改電話不會改 version，會沿用舊內容直到下一次團單異動（與核對單快取相同）。
+
+截止的團另外凍結成 group_settlements 快照（GroupSettlementSnapshot）：
+- 截止時（手動截止、截止排程）由 freeze_settlements() 寫入，也包含抽獎結果與請客者
+- 截止的團一律先讀快照，版本相同就不查訂單；版本不同（截止後請客、重新開放後再截止）重算並覆寫
+- 舊資料由啟動時的 backfill_settlement_snapshots() 補上
+- 歷史團單 / 後台列表用 snapshot_summaries() 一次取多團的人數與金額，我的訂單用 load_settlement_snapshots()
+"""
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from app.database import SessionLocal
+from app.models.group import Group
+from app.models.order import Order, OrderStatus
+from app.models.settlement import GroupSettlementSnapshot
+from app.models.store import StoreBranch
+
+logger = logging.getLogger("settlement")
+
+SETTLEMENT_CACHE_MAX = 256  # 記住幾個團
+
+_cache: "OrderedDict[int, tuple[int, GroupSettlement]]" = OrderedDict()  # group_id -> (version, 結算)
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class SettlementItem:
+    item_name: str
+    size: str | None
+    sugar: str | None
+    ice: str | None
+    spec_label: str | None
+    note: str | None
+    quantity: int
+    subtotal: Decimal  # 小計（line_total）
+
+
+@dataclass(frozen=True)
+class SettlementPerson:
+    user_id: int
+    name: str
+    items: list[SettlementItem]
+    subtotal: Decimal         # 折扣前
+    discount: Decimal
+    discount_note: str | None
+    total: Decimal            # 折扣後應付（不含外送費）
+    due: Decimal              # 含外送費分攤
+
+
+@dataclass(frozen=True)
+class SummaryLine:
+    item_name: str
+    spec_label: str | None
+    note: str | None
+    quantity: int
+    amount: Decimal
+
+
+@dataclass(frozen=True)
+class GroupSettlement:
+    group_id: int
+    version: int
+    group_name: str
+    store_name: str                  # 店名（店家已刪用快照）
+    store_label: str                 # 店名 + 分店
+    store_phone: str | None
+    owner_name: str
+    deadline: datetime
+    summary: list[SummaryLine]       # 店家總項（依品名、規格、備註排序）
+    people: list[SettlementPerson]   # 已結單的人（依名字排序）
+    pending_names: list[str]         # 購物車有訂單但還沒結單的人（依名字排序）
+    total_qty: int
+    items_total: Decimal             # 品項原價合計
+    total_discount: Decimal          # 所有人折扣合計
+    store_total: Decimal             # 店家實收（原價 - 折扣，不低於 0）
+    people_total: Decimal            # 每人應付合計（不含外送費）
+    delivery_fee: Decimal
+    delivery_per_person: Decimal
+    grand_total: Decimal             # 每人應付合計 + 外送費
+    lucky_winner_ids: list[int]      # 隨機免單中獎者
+    lucky_winner_names: list[str]
+    treat_user_id: int | None        # 請客者
+    treat_user_name: str | None
+
+
+def _store_info(db: Session, group: Group) -> tuple[str, str, str | None]:
+    """(店名, 店名 + 分店, 電話)"""
+    store = group.store
+    if store is None:
+        name = group.store_name or "（店家已移除）"
+        return name, name, None
+    if group.branch_id:
+        branch = db.query(StoreBranch).filter(StoreBranch.id == group.branch_id).first()
+        if branch:
+            return store.name, f"{store.name} {branch.name}", branch.phone
+    if store.branch:
+        return store.name, f"{store.name} {store.branch}", store.phone
+    return store.name, store.name, store.phone
+
+
+def compute_settlement(db: Session, group: Group) -> GroupSettlement:
+    """查詢並計算團單結算（不經過快取）"""
+    store_name, store_label, store_phone = _store_info(db, group)
+    orders = db.query(Order).options(
+        joinedload(Order.user),
+        selectinload(Order.items),
+    ).filter(Order.group_id == group.id).all()
+
+    people = []
+    pending_names = []
+    summary: dict[str, list] = {}
+    submitted = []
+    for order in orders:
+        if order.status != OrderStatus.SUBMITTED:
+            if order.items:
+                pending_names.append(order.user.show_name)
+            continue
+        submitted.append(order)
+        for item in order.items:
+            key = item.spec_key or f"item-{item.id}"
+            line = summary.get(key)
+            if line is None:
+                summary[key] = [item.item_name, item.spec_label, item.note, item.quantity, item.subtotal]
+            else:
+                line[3] += item.quantity
+                line[4] += item.subtotal
+
+    delivery_fee = group.delivery_fee or Decimal("0")
+    delivery_per_person = Decimal("0")
+    if delivery_fee > 0 and submitted:
+        delivery_per_person = (delivery_fee / len(submitted)).quantize(Decimal("1"))
+
+    for order in submitted:
+        total = order.total_amount or Decimal("0")
+        people.append(SettlementPerson(
+            user_id=order.user_id,
+            name=order.user.show_name,
+            items=[
+                SettlementItem(
+                    item_name=item.item_name,
+                    size=item.size,
+                    sugar=item.sugar,
+                    ice=item.ice,
+                    spec_label=item.spec_label,
+                    note=item.note,
+                    quantity=item.quantity,
+                    subtotal=item.subtotal,
+                )
+                for item in sorted(order.items, key=lambda i: i.id)
+            ],
+            subtotal=order.items_subtotal or Decimal("0"),
+            discount=order.discount_amount or Decimal("0"),
+            discount_note=order.discount_note,
+            total=total,
+            due=total + delivery_per_person,
+        ))
+    people.sort(key=lambda p: p.name)
+    names = {p.user_id: p.name for p in people}
+    lucky_winner_ids = [int(uid) for uid in (group.lucky_winner_ids or "").split(",") if uid.strip().isdigit()]
+
+    summary_lines = sorted(
+        (SummaryLine(*line) for line in summary.values()),
+        key=lambda s: (s.item_name, s.spec_label or "", s.note or ""),
+    )
+    items_total = sum((s.amount for s in summary_lines), Decimal("0"))
+    total_discount = sum((p.discount for p in people), Decimal("0"))
+    people_total = sum((p.total for p in people), Decimal("0"))
+
+    return GroupSettlement(
+        group_id=group.id,
+        version=group.version or 0,
+        group_name=group.name,
+        store_name=store_name,
+        store_label=store_label,
+        store_phone=store_phone,
+        owner_name=group.owner.display_name,
+        deadline=group.deadline,
+        summary=summary_lines,
+        people=people,
+        pending_names=sorted(pending_names),
+        total_qty=sum(s.quantity for s in summary_lines),
+        items_total=items_total,
+        total_discount=total_discount,
+        store_total=max(items_total - total_discount, Decimal("0")),
+        people_total=people_total,
+        delivery_fee=delivery_fee,
+        delivery_per_person=delivery_per_person,
+        grand_total=people_total + delivery_fee,
+        lucky_winner_ids=lucky_winner_ids,
+        lucky_winner_names=[names[uid] for uid in lucky_winner_ids if uid in names],
+        treat_user_id=group.treat_user_id,
+        treat_user_name=names.get(group.treat_user_id),
+    )
+
+
+# ===== 快照 =====
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _json_value(v) for k, v in value.items()}
+    return value
+
+
+def settlement_to_json(settlement: GroupSettlement) -> dict:
+    """轉成可以存進 JSON 欄位的 dict（Decimal 存字串、datetime 存 ISO 格式）"""
+    return _json_value(asdict(settlement))
+
+
+def settlement_from_json(data: dict) -> GroupSettlement:
+    """settlement_to_json() 的反向"""
+    money = ("items_total", "total_discount", "store_total", "people_total", "delivery_fee", "delivery_per_person", "grand_total")
+    fields = dict(data)
+    for key in money:
+        fields[key] = Decimal(fields[key])
+    fields["deadline"] = datetime.fromisoformat(fields["deadline"])
+    fields["summary"] = [
+        SummaryLine(**{**line, "amount": Decimal(line["amount"])}) for line in data["summary"]
+    ]
+    fields["people"] = [
+        SettlementPerson(**{
+            **person,
+            "items": [SettlementItem(**{**item, "subtotal": Decimal(item["subtotal"])}) for item in person["items"]],
+            "subtotal": Decimal(person["subtotal"]),
+            "discount": Decimal(person["discount"]),
+            "total": Decimal(person["total"]),
+            "due": Decimal(person["due"]),
+        })
+        for person in data["people"]
+    ]
+    return GroupSettlement(**fields)
+
+
+def _load_snapshot(db: Session, group_id: int, version: int) -> GroupSettlement | None:
+    data = db.query(GroupSettlementSnapshot.data).filter(
+        GroupSettlementSnapshot.group_id == group_id,
+        GroupSettlementSnapshot.version == version,
+    ).scalar()
+    if data is None:
+        return None
+    try:
+        return settlement_from_json(data)
+    except (KeyError, TypeError, ValueError) as e:
+        # 舊格式：當作沒有，重算覆寫
+        logger.warning(f"結算快照格式不符（group {group_id}）：{e}")
+        return None
+
+
+def _write_snapshot(db: Session, settlement: GroupSettlement):
+    """寫入 / 覆寫快照（commit 由呼叫端負責）"""
+    values = dict(
+        version=settlement.version,
+        people_count=len(settlement.people),
+        total_qty=settlement.total_qty,
+        grand_total=settlement.grand_total,
+        member_user_ids=",".join(str(p.user_id) for p in settlement.people) or None,
+        data=settlement_to_json(settlement),
+    )
+    row = db.query(GroupSettlementSnapshot).filter(GroupSettlementSnapshot.group_id == settlement.group_id).first()
+    if row is None:
+        db.add(GroupSettlementSnapshot(group_id=settlement.group_id, **values))
+    else:
+        for key, value in values.items():
+            setattr(row, key, value)
+
+
+def _save_snapshot(settlement: GroupSettlement):
+    """在自己的 session 寫入快照（讀取路徑順便補寫，失敗不影響回應）"""
+    db = SessionLocal()
+    try:
+        _write_snapshot(db, settlement)
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # 同時有別人寫入，用他的
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"結算快照寫入失敗（group {settlement.group_id}）：{e}")
+    finally:
+        db.close()
+
+
+def _remember(settlement: GroupSettlement):
+    with _lock:
+        _cache[settlement.group_id] = (settlement.version, settlement)
+        _cache.move_to_end(settlement.group_id)
+        while len(_cache) > SETTLEMENT_CACHE_MAX:
+            _cache.popitem(last=False)
+
+
+def get_settlement(db: Session, group: Group) -> GroupSettlement:
+    """團單結算（同一版本只算一次；截止的團先讀快照，沒有或過期才重算並寫回）"""
+    version = group.version or 0
+    with _lock:
+        cached = _cache.get(group.id)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(group.id)
+            return cached[1]
+
+    settlement = _load_snapshot(db, group.id, version) if group.is_closed else None
+    if settlement is None:
+        settlement = compute_settlement(db, group)
+        if group.is_closed:
+            _save_snapshot(settlement)
+    _remember(settlement)
+    return settlement
+
+
+def freeze_settlements(group_ids: list[int]):
+    """剛截止的團寫入結算快照（截止的交易 commit 之後呼叫）"""
+    if not group_ids:
+        return
+    db = SessionLocal()
+    try:
+        for group in db.query(Group).filter(Group.id.in_(group_ids), Group.is_closed == True).all():
+            settlement = compute_settlement(db, group)
+            _write_snapshot(db, settlement)
+            _remember(settlement)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"結算快照寫入失敗（groups {group_ids}）：{e}")
+    finally:
+        db.close()
+
+
+def backfill_settlement_snapshots(db: Session, batch: int = 200) -> int:
+    """已截止但還沒有快照的團補寫快照，回傳處理的團數"""
+    filled = 0
+    while True:
+        groups = db.query(Group).outerjoin(
+            GroupSettlementSnapshot, GroupSettlementSnapshot.group_id == Group.id,
+        ).filter(
+            Group.is_closed == True,
+            GroupSettlementSnapshot.group_id.is_(None),
+        ).order_by(Group.id).limit(batch).all()
+        if not groups:
+            return filled
+        for group in groups:
+            _write_snapshot(db, compute_settlement(db, group))
+        db.commit()
+        filled += len(groups)
+
+
+def snapshot_summaries(db: Session, group_ids: list[int]) -> dict:
+    """多個團的快照摘要（人數、杯數、金額、已結單的人），不載入 data；版本不符的不算"""
+    if not group_ids:
+        return {}
+    rows = db.query(
+        GroupSettlementSnapshot.group_id,
+        GroupSettlementSnapshot.people_count,
+        GroupSettlementSnapshot.total_qty,
+        GroupSettlementSnapshot.grand_total,
+        GroupSettlementSnapshot.member_user_ids,
+    ).join(Group, Group.id == GroupSettlementSnapshot.group_id).filter(
+        GroupSettlementSnapshot.group_id.in_(group_ids),
+        Group.is_closed == True,
+        GroupSettlementSnapshot.version == Group.version,
+    ).all()
+    return {row.group_id: row for row in rows}
+
+
+def load_settlement_snapshots(db: Session, group_ids: list[int]) -> dict[int, GroupSettlement]:
+    """多個已截止團的完整快照（一次查詢；沒有或版本不符的不在結果裡）"""
+    if not group_ids:
+        return {}
+    rows = db.query(GroupSettlementSnapshot.group_id, GroupSettlementSnapshot.data).join(
+        Group, Group.id == GroupSettlementSnapshot.group_id,
+    ).filter(
+        GroupSettlementSnapshot.group_id.in_(group_ids),
+        Group.is_closed == True,
+        GroupSettlementSnapshot.version == Group.version,
+    ).all()
+    result = {}
+    for group_id, data in rows:
+        try:
+            result[group_id] = settlement_from_json(data)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return result
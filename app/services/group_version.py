@@ -0,0 +1,59 @@
+"""
+團單內容版本與 ETag
+
+groups.version 在每次會改到團單頁內容的寫入時 +1（訂單 / 品項 / 折扣走 refresh_group_counters，
+請客、截止、抽獎、編輯另外呼叫 bump_group_version）。
+
+訂單牆、我的訂單片段以「版本 + 是否開放 + 瀏覽者」當 strong ETag：
+瀏覽器帶 If-None-Match 回來且沒變時，只查一次 groups 主鍵就回 304，不載入訂單也不渲染。
+"""
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.group import Group
+
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+
+def bump_group_version(group: Group):
+    """團單內容有變，版本 +1（在資料庫端遞增，同時寫入不會互相蓋掉；commit 由呼叫端負責）"""
+    group.version = func.coalesce(Group.version, 0) + 1
+
+
+def group_etag(db: Session, group_id: int, kind: str, viewer_id: int) -> str | None:
+    """片段的 ETag；團單不存在回傳 None
+
+    截止時間一過內容就會不同（不能再點餐），所以開放狀態也算進去。
+    """
+    row = db.query(Group.version, Group.is_closed, Group.deadline).filter(Group.id == group_id).first()
+    if not row:
+        return None
+    version, is_closed, deadline = row
+    now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+    is_open = not is_closed and deadline >= now
+    return f'"{kind}-{group_id}-{version or 0}-{int(is_open)}-{viewer_id}"'
+
+
+def _cache_headers(etag: str) -> dict:
+    # 每次都要回來驗證（no-cache），但可以用 304 省掉內容
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(request: Request, etag: str | None) -> Response | None:
+    """If-None-Match 符合就回 304，否則回 None 讓呼叫端照常渲染"""
+    if not etag:
+        return None
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=_cache_headers(etag))
+    return None
+
+
+def with_etag(response: Response, etag: str | None) -> Response:
+    """在渲染好的回應加上 ETag"""
+    if etag:
+        response.headers.update(_cache_headers(etag))
+    return response
@@ -0,0 +1,238 @@
+"""
+首頁看板快照
+
+/home 與 /home/groups（每分鐘自動刷新）共用同一份資料：
+開放中 / 已截止的團、熱門品項、投票、公告、店家列表。
+快照在有變動時（開團、結單、刪團、編輯、投票⋯）清除，平常最多保留 HOME_BOARD_TTL_SECONDS 秒；
+每個使用者的可見性從快照在記憶體中套用，「我的進行中」另查自己的訂單。
+
+快照用觸發重建的那個請求的 session 查詢（不另外佔連線），查完後把物件從 session 移出；
+快照裡的 ORM 物件都已 eager load，模板只能讀已載入的欄位。
+
+清除快照時可一併送出首頁即時事件（見 home_events），開著首頁的人只更新受影響的卡片。
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from app.models.group import Group
+from app.models.order import Order
+from app.models.store import CategoryType, Store
+from app.models.user import SystemSetting
+from app.models.vote import Vote, VoteOption, VoteDepartment
+from app.models.department import GroupDepartment, StoreDepartment
+from app.services.visibility_service import (
+    get_user_department_ids,
+    filter_visible_groups,
+    filter_visible_stores,
+    filter_visible_votes,
+)
+from app.services.sales_rollup_service import global_hot_items
+from app.services.home_events import publish_home_event
+
+HOME_BOARD_TTL_SECONDS = 30  # 沒有變動時，快照最多保留多久（截止時間、購物車人數靠這個更新）
+CLOSED_POOL_SIZE = 50  # 已截止的團多抓一些，套用可見性後再取前 10 個
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+
+@dataclass
+class HomeBoardSnapshot:
+    """首頁共用資料（與使用者無關的部分）"""
+    built_at: datetime  # 台北時間
+    expires_at: float  # time.monotonic()
+    open_groups: list = field(default_factory=list)  # 依截止時間遞增
+    closed_groups: list = field(default_factory=list)  # 依截止時間遞減
+    hot_items: list = field(default_factory=list)
+    announcement: str | None = None
+    active_votes: list = field(default_factory=list)  # 依截止時間遞增
+    stores: list = field(default_factory=list)  # 依店名
+    group_dept_ids: dict = field(default_factory=dict)  # group_id -> {department_id}（只有限定團）
+    store_dept_ids: dict = field(default_factory=dict)  # store_id -> {department_id}（只有限定店家）
+    vote_dept_ids: dict = field(default_factory=dict)  # vote_id -> {department_id}（只有限定投票）
+
+
+_snapshot: HomeBoardSnapshot | None = None
+_generation = 0  # 每次清除 +1，避免重建途中被清除的快照又被存回去
+_lock = threading.Lock()
+_build_lock = threading.Lock()  # 同時只重建一次，其他請求等結果
+
+
+def invalidate_home_board(event: str | None = None, group_id: int | None = None):
+    """清除首頁快照（團單、訂單狀態、投票、公告、店家有變動時呼叫）
+
+    event 有值時通知首頁連線（group_opened / group_closed / group_updated / group_removed / board），
+    一定在清除快照之後送出，前端收到再來取卡片時拿到的是新資料。
+    """
+    global _snapshot, _generation
+    with _lock:
+        _snapshot = None
+        _generation += 1
+    if event:
+        publish_home_event(event, group_id)
+
+
+def get_hot_items(db: Session, limit: int = 10):
+    """取得全站熱門品項（最近 30 天，查銷量彙總表）"""
+    return global_hot_items(db, days=30, limit=limit)
+
+
+def _dept_map(db: Session, fk_col, dept_col, ids: list[int]) -> dict[int, set[int]]:
+    """查出 ids 各自限定的部門"""
+    result: dict[int, set[int]] = {}
+    if not ids:
+        return result
+    for owner_id, dept_id in db.query(fk_col, dept_col).filter(fk_col.in_(ids)).all():
+        result.setdefault(owner_id, set()).add(dept_id)
+    return result
+
+
+def _build_snapshot(db: Session) -> HomeBoardSnapshot:
+    now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+    existing_keys = set(db.identity_map.keys())
+    try:
+        # 開放中的團（所有分類一次查；卡片人數用 groups 上的計數欄位）
+        open_groups = db.query(Group).options(
+            joinedload(Group.store),
+            joinedload(Group.owner),
+        ).filter(
+            Group.is_closed == False,
+            Group.deadline > now,
+        ).order_by(Group.deadline.asc()).all()
+
+        # 已截止的團
+        closed_groups = db.query(Group).options(
+            joinedload(Group.store),
+            joinedload(Group.owner),
+        ).filter(
+            or_(Group.is_closed == True, Group.deadline <= now)
+        ).order_by(Group.deadline.desc()).limit(CLOSED_POOL_SIZE).all()
+
+        # 超夯清單（全站熱門）
+        hot_items = get_hot_items(db, limit=10)
+
+        # 公告
+        setting = db.query(SystemSetting).first()
+        announcement = setting.announcement if setting else None
+
+        # 進行中的投票
+        active_votes = db.query(Vote).options(
+            joinedload(Vote.creator),
+            selectinload(Vote.options).selectinload(VoteOption.voters),
+        ).filter(
+            Vote.is_closed == False,
+            Vote.deadline > now,
+        ).order_by(Vote.deadline.asc()).all()
+
+        # 店家列表（啟用中）
+        stores = db.query(Store).options(
+            selectinload(Store.branches)
+        ).filter(Store.is_active == True).order_by(Store.name).all()
+
+        # 限定部門（只查非公開的）
+        group_dept_ids = _dept_map(
+            db, GroupDepartment.group_id, GroupDepartment.department_id,
+            [g.id for g in open_groups + closed_groups if not g.is_public],
+        )
+        store_dept_ids = _dept_map(
+            db, StoreDepartment.store_id, StoreDepartment.department_id,
+            [s.id for s in stores if not s.is_public],
+        )
+        vote_dept_ids = _dept_map(
+            db, VoteDepartment.vote_id, VoteDepartment.department_id,
+            [v.id for v in active_votes if not v.is_public],
+        )
+
+        return HomeBoardSnapshot(
+            built_at=now,
+            expires_at=time.monotonic() + HOME_BOARD_TTL_SECONDS,
+            open_groups=open_groups,
+            closed_groups=closed_groups,
+            hot_items=hot_items,
+            announcement=announcement,
+            active_votes=active_votes,
+            stores=stores,
+            group_dept_ids=group_dept_ids,
+            store_dept_ids=store_dept_ids,
+            vote_dept_ids=vote_dept_ids,
+        )
+    finally:
+        # 快照會被其他請求（其他 thread）讀取，不能留在這個請求的 session 裡
+        for key, obj in list(db.identity_map.items()):
+            # expunge 會沿著 cascade 帶走子物件（Vote.options 等），已移出的略過
+            if key not in existing_keys and obj in db:
+                db.expunge(obj)
+
+
+def get_home_board(db: Session) -> HomeBoardSnapshot:
+    """取得首頁快照（過期或被清除才重建）"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot and snapshot.expires_at > time.monotonic():
+        return snapshot
+
+    with _build_lock:
+        snapshot = _snapshot
+        if snapshot and snapshot.expires_at > time.monotonic():
+            return snapshot
+
+        generation = _generation
+        snapshot = _build_snapshot(db)
+        with _lock:
+            if generation == _generation:
+                _snapshot = snapshot
+    return snapshot
+
+
+def build_home_context(db: Session, user) -> dict:
+    """套用使用者可見性，組出首頁模板需要的資料"""
+    board = get_home_board(db)
+    now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+    user_dept_ids = get_user_department_ids(db, user.id)
+
+    # 快照建立後才截止的團，移到已截止
+    open_groups = [g for g in board.open_groups if not g.is_closed and g.deadline > now]
+    just_expired = [g for g in board.open_groups if g.deadline <= now]
+    closed_pool = sorted(just_expired, key=lambda g: g.deadline, reverse=True) + board.closed_groups
+
+    open_groups = filter_visible_groups(open_groups, user, user_dept_ids, board.group_dept_ids)
+    closed_groups = filter_visible_groups(closed_pool, user, user_dept_ids, board.group_dept_ids)[:10]
+
+    drink_groups = [g for g in open_groups if g.category == CategoryType.DRINK]
+    meal_groups = [g for g in open_groups if g.category == CategoryType.MEAL]
+    groupbuy_groups = [g for g in open_groups if g.category == CategoryType.GROUP_BUY]
+
+    # 我的進行中（開放團中，我是團主或已下單）
+    my_status = {}
+    if open_groups:
+        my_status = dict(db.query(Order.group_id, Order.status).filter(
+            Order.user_id == user.id,
+            Order.group_id.in_([g.id for g in open_groups]),
+        ).all())
+    my_active = []
+    for g in open_groups:
+        status = my_status.get(g.id)
+        if status:
+            my_active.append({"group": g, "status": status.value})
+        elif g.owner_id == user.id:
+            my_active.append({"group": g, "status": "owner"})
+    my_active.sort(key=lambda x: x["group"].deadline)
+
+    active_votes = [v for v in board.active_votes if v.deadline > now]
+    active_votes = filter_visible_votes(active_votes, user, user_dept_ids, board.vote_dept_ids)[:4]
+
+    return {
+        "drink_groups": drink_groups,
+        "meal_groups": meal_groups,
+        "groupbuy_groups": groupbuy_groups,
+        "closed_groups": closed_groups,
+        "hot_items": board.hot_items,
+        "announcement": board.announcement,
+        "active_votes": active_votes,
+        "stores": filter_visible_stores(board.stores, user, user_dept_ids, board.store_dept_ids),
+        "my_active": my_active,
+        "now": now,
+    }
@@ -0,0 +1,31 @@
+"""
+首頁即時事件（SSE，頻道 "home"）
+
+首頁開著 /home/events 的 EventSource，寫入端發出小事件，前端只更新受影響的卡片：
+- group_opened / group_updated：重新取該團卡片（/home/cards/{id}）插入或替換
+- group_closed / group_removed：移除卡片
+- counters：直接改卡片上的結單 / 購物車人數（不用再打 API）
+- board：公告、投票、店家等變動，前端延遲一段隨機時間後整塊刷新
+
+傳送機制見 event_hub；多個 worker 時事件只送到同一個 process 的連線，
+前端另有每 5 分鐘整塊刷新作為保底。
+"""
+import json
+
+from app.services.event_hub import publish, publish_after_commit
+
+HOME_CHANNEL = "home"
+
+
+def _payload(event_type: str, group_id: int | None, data: dict) -> str:
+    return json.dumps({"type": event_type, "group_id": group_id, **data}, ensure_ascii=False)
+
+
+def publish_home_event(event_type: str, group_id: int | None = None, **data):
+    """通知所有首頁連線（資料應已 commit）"""
+    publish(HOME_CHANNEL, _payload(event_type, group_id, data))
+
+
+def queue_home_event(db, event_type: str, group_id: int | None = None, **data):
+    """交易內登記首頁事件，commit 成功後才送出"""
+    publish_after_commit(db, HOME_CHANNEL, (event_type, group_id), _payload(event_type, group_id, data))
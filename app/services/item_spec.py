@@ -0,0 +1,64 @@
+"""
+品項規格 key（order_items.spec_key / spec_label）
+
+同一個品項 + 尺寸 + 甜度 + 冰塊 + 選項 + 加料 + 備註視為同一種規格：
+- spec_key：上述內容正規化（選項 / 加料依名稱排序）後取 sha1，購物車合併、店家總項彙總都比這個
+- spec_label：給人看的規格文字，例如「L / 半糖 / 少冰 / 加珍珠 / +椰果」（不含品名與備註）
+
+寫入時由 apply_order_totals() 一起算好（會改到品項的地方本來就要重算金額），
+舊資料由啟動時的 backfill_order_totals() 補上。
+"""
+import hashlib
+import json
+
+from app.models.order import OrderItem
+
+SPEC_LABEL_MAX = 300
+
+
+def spec_of(
+    menu_item_id: int | None,
+    item_name: str,
+    size: str | None,
+    sugar: str | None,
+    ice: str | None,
+    options,
+    toppings,
+    note: str | None,
+) -> tuple[str, str]:
+    """回傳 (spec_key, spec_label)；options / toppings 是 [(id, 名稱)]"""
+    options = sorted(options, key=lambda o: (o[1], o[0] or 0))
+    toppings = sorted(toppings, key=lambda t: (t[1], t[0] or 0))
+    canonical = json.dumps(
+        [menu_item_id, item_name, size or "", sugar or "", ice or "", options, toppings, note or ""],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    parts = [p for p in (size, sugar, ice) if p]
+    parts += [name for _, name in options]
+    parts += [f"+{name}" for _, name in toppings]
+    return hashlib.sha1(canonical.encode()).hexdigest(), " / ".join(parts)[:SPEC_LABEL_MAX]
+
+
+def order_item_spec(item: OrderItem) -> tuple[str, str]:
+    """已載入選項 / 加料的訂單品項的 (spec_key, spec_label)"""
+    return spec_of(
+        item.menu_item_id,
+        item.item_name,
+        item.size,
+        item.sugar,
+        item.ice,
+        [(o.item_option_id, o.option_name) for o in item.selected_options],
+        [(t.store_topping_id, t.topping_name) for t in item.selected_toppings],
+        item.note,
+    )
+
+
+def spec_description(item_name: str, spec_label: str | None, note: str | None, sep: str = " / ", note_prefix: str = "備註:") -> str:
+    """品名 + 規格 + 備註，匯出文字 / 核對單用"""
+    parts = [item_name]
+    if spec_label:
+        parts.append(spec_label)
+    if note:
+        parts.append(f"{note_prefix}{note}")
+    return sep.join(parts)
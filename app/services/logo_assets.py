@@ -0,0 +1,212 @@
+"""
+店家 logo 本機快取
+
+店家 logo 是外部網址（Cloudinary 或匯入時填的連結），核對單每次產生都要下載、解碼、縮圖，
+最久要等 LOGO_FETCH_TIMEOUT 秒。改成第一次抓下來就存成固定尺寸的檔案：
+- 檔名 {網址 sha1}-{尺寸}-{內容 sha1}.{副檔名}，存在 logo_cache_dir；內容變了檔名就變，
+  /logos/{檔名} 可以長期快取
+- 尺寸（LOGO_VARIANTS）：receipt 給核對單（PNG，reportlab 直接讀），card 給頁面卡片（WebP）
+- 以網址為單位 LRU，超過 LOGO_CACHE_MAX_URLS 個網址時刪掉最久沒用的檔案
+- 頁面用 logo_src()：已有檔案就回本機網址，沒有就先回原網址、在背景抓取；
+  檔案超過 LOGO_REFRESH_SECONDS 也在背景重抓，抓好前繼續用舊檔
+- 核對單用 logo_file(fetch=True)：沒有檔案時當場抓一次（之後都讀本機檔）
+- 抓取失敗的網址 LOGO_RETRY_SECONDS 內不再重試
+
+索引在記憶體，啟動後第一次使用時掃描目錄重建；多個 worker 共用同一個目錄。
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+
+from app.config import get_settings
+
+logger = logging.getLogger("logo")
+settings = get_settings()
+
+LOGO_VARIANTS = {
+    "receipt": ((400, 400), "PNG", "png"),  # 核對單（放大後解析度要夠）
+    "card": ((128, 128), "WEBP", "webp"),   # 頁面卡片（顯示 32~48px，2x 螢幕也夠）
+}
+LOGO_CACHE_MAX_URLS = 500
+LOGO_REFRESH_SECONDS = 24 * 60 * 60
+LOGO_RETRY_SECONDS = 10 * 60
+LOGO_FETCH_TIMEOUT = 5
+LOGO_MAX_BYTES = 5 * 1024 * 1024
+
+_FILENAME_RE = re.compile(r"^([0-9a-f]{20})-([a-z]+)-([0-9a-f]{12})\.(png|webp)$")
+
+
+@dataclass
+class _Entry:
+    fetched_at: float  # time.time()，沿用檔案的 mtime
+    files: dict[str, str] = field(default_factory=dict)  # 尺寸 -> 檔名
+
+
+_entries: "OrderedDict[str, _Entry]" = OrderedDict()  # 網址 key -> 檔案（LRU，最近用的在後面）
+_failed: dict[str, float] = {}  # 網址 key -> 可以再試的時間（time.monotonic()）
+_inflight: set[str] = set()
+_loaded = False
+_lock = threading.Lock()
+_fetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="logo-fetch")
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()[:20]
+
+
+def _is_remote(url: str | None) -> bool:
+    return bool(url) and url.startswith(("http://", "https://"))
+
+
+def _load_index():
+    """掃描快取目錄重建索引（呼叫端持有 _lock）"""
+    global _loaded
+    _loaded = True
+    cache_dir = settings.logo_cache_dir
+    if not os.path.isdir(cache_dir):
+        return
+    found = []
+    for name in os.listdir(cache_dir):
+        match = _FILENAME_RE.match(name)
+        if match and match.group(2) in LOGO_VARIANTS:
+            found.append((os.path.getmtime(os.path.join(cache_dir, name)), match.group(1), match.group(2), name))
+    for mtime, key, variant, name in sorted(found):
+        entry = _entries.setdefault(key, _Entry(fetched_at=mtime))
+        older = entry.files.get(variant)
+        if older:
+            _remove_file(older)
+        entry.files[variant] = name
+        entry.fetched_at = mtime
+        _entries.move_to_end(key)
+
+
+def _remove_file(name: str):
+    try:
+        os.remove(os.path.join(settings.logo_cache_dir, name))
+    except OSError:
+        pass
+
+
+def _lookup(url: str, fetch_missing: bool = True) -> _Entry | None:
+    """找本機檔案（有的話算最近使用）；過期的（與 fetch_missing 時沒有的）排背景重抓"""
+    key = _url_key(url)
+    with _lock:
+        if not _loaded:
+            _load_index()
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+    if entry is not None and len(entry.files) < len(LOGO_VARIANTS):
+        entry = None  # 目錄裡只剩部分尺寸，當作沒有
+    if (entry is None and fetch_missing) or (entry is not None and time.time() - entry.fetched_at > LOGO_REFRESH_SECONDS):
+        _schedule_fetch(url)
+    return entry
+
+
+def _schedule_fetch(url: str):
+    key = _url_key(url)
+    with _lock:
+        if key in _inflight or _failed.get(key, 0) > time.monotonic():
+            return
+        _inflight.add(key)
+    _fetch_executor.submit(_fetch_task, url)
+
+
+def _fetch_task(url: str):
+    try:
+        fetch_logo(url)
+    finally:
+        with _lock:
+            _inflight.discard(_url_key(url))
+
+
+def fetch_logo(url: str) -> bool:
+    """下載 logo 並產生各尺寸檔案，回傳是否成功"""
+    from PIL import Image
+
+    key = _url_key(url)
+    try:
+        with urllib.request.urlopen(url, timeout=LOGO_FETCH_TIMEOUT) as resp:
+            data = resp.read(LOGO_MAX_BYTES + 1)
+        if len(data) > LOGO_MAX_BYTES:
+            raise ValueError("圖片太大")
+        image = Image.open(BytesIO(data)).convert("RGBA")
+
+        os.makedirs(settings.logo_cache_dir, exist_ok=True)
+        files = {}
+        for variant, (size, fmt, ext) in LOGO_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size)
+            buf = BytesIO()
+            resized.save(buf, format=fmt)
+            content = buf.getvalue()
+            name = f"{key}-{variant}-{hashlib.sha1(content).hexdigest()[:12]}.{ext}"
+            path = os.path.join(settings.logo_cache_dir, name)
+            if not os.path.exists(path):
+                tmp = f"{path}.tmp{threading.get_ident()}"
+                with open(tmp, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, path)
+            else:
+                os.utime(path)
+            files[variant] = name
+    except Exception as e:
+        logger.warning(f"店家 logo 下載失敗 {url}：{e}")
+        with _lock:
+            _failed[key] = time.monotonic() + LOGO_RETRY_SECONDS
+        return False
+
+    with _lock:
+        old = _entries.pop(key, None)
+        _entries[key] = _Entry(fetched_at=time.time(), files=files)
+        _failed.pop(key, None)
+        evicted = []
+        while len(_entries) > LOGO_CACHE_MAX_URLS:
+            _, entry = _entries.popitem(last=False)
+            evicted.extend(entry.files.values())
+    if old is not None:
+        evicted.extend(name for name in old.files.values() if name not in files.values())
+    for name in evicted:
+        _remove_file(name)
+    return True
+
+
+def logo_src(url: str | None, variant: str = "card") -> str | None:
+    """頁面用的 logo 網址：本機有檔案回 /logos/...，沒有先回原網址（背景抓取）"""
+    if not _is_remote(url):
+        return url
+    entry = _lookup(url)
+    return f"/logos/{entry.files[variant]}" if entry else url
+
+
+def logo_file(url: str | None, variant: str = "receipt", fetch: bool = False) -> str | None:
+    """本機檔案路徑；fetch=True 時沒有檔案就當場抓（失敗或沒有 logo 回傳 None）"""
+    if not _is_remote(url):
+        return None
+    entry = _lookup(url, fetch_missing=not fetch)
+    if entry is None and fetch:
+        key = _url_key(url)
+        with _lock:
+            failed = _failed.get(key, 0) > time.monotonic()
+        if not failed and fetch_logo(url):
+            with _lock:
+                entry = _entries.get(key)
+    if entry is None:
+        return None
+    return os.path.join(settings.logo_cache_dir, entry.files[variant])
+
+
+def logo_asset_path(filename: str) -> str | None:
+    """/logos/{filename} 對應的檔案（檔名不合格式或不存在回傳 None）"""
+    if not _FILENAME_RE.match(filename):
+        return None
+    path = os.path.join(settings.logo_cache_dir, filename)
+    return path if os.path.isfile(path) else None
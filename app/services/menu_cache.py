@@ -0,0 +1,271 @@
+"""
+菜單快照（程序內快取，依 menu_id）
+
+團單頁、店家菜單頁、加品項時的價格驗證都讀同一份唯讀快照：
+分類 → 品項（含 L 價格）→ 品項選項，加上店家的加料、甜度 / 冰塊選項與分店。
+快照用幾個固定查詢一次建好，之後全部在記憶體中，不再沿著 relationship 逐層 lazy load。
+
+菜單內容有變（匯入菜單、切換版本、加料 / 分店異動、刪除店家）時呼叫 invalidate_store_menus()；
+平常最多保留 MENU_CACHE_TTL_SECONDS 秒（多 worker 時其他 process 靠這個更新）。
+每次重建 version 都會遞增（只在同一個 process 內有意義）。
+
+團單頁的菜單區塊也跟著快照走：
+- render_menu_section()：品項列表 HTML，每份快照只渲染一次
+- asset_json / fingerprint：前端用的品項資料（價格、加購選項），fingerprint 取內容雜湊，
+  網址 /menus/{menu_id}/{fingerprint}.json 內容不變網址就不變，可以長期快取
+"""
+import hashlib
+import itertools
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from sqlalchemy.orm import Session
+
+from app.models.menu import Menu, MenuCategory, MenuItem, ItemOption
+from app.models.store import StoreTopping, StoreOption, StoreBranch, OptionType
+
+MENU_CACHE_TTL_SECONDS = 300
+
+templates = Jinja2Templates(directory="app/templates")
+
+
+@dataclass(frozen=True)
+class OptionView:
+    id: int
+    name: str
+    price_diff: Decimal
+
+
+@dataclass(frozen=True)
+class ItemView:
+    id: int
+    name: str
+    price: Decimal
+    price_l: Decimal | None
+    category_id: int | None
+    options: tuple[OptionView, ...] = ()
+
+    def unit_price(self, size: str | None) -> tuple[Decimal, str | None]:
+        """依尺寸決定單價，回傳 (單價, 實際記錄的尺寸)；沒有 L 價格就不記錄尺寸"""
+        if size == 'L' and self.price_l:
+            return self.price_l, size
+        return self.price, (size if self.price_l else None)
+
+
+@dataclass(frozen=True)
+class CategoryView:
+    id: int
+    name: str
+    items: tuple[ItemView, ...] = ()
+
+
+@dataclass(frozen=True)
+class ToppingView:
+    id: int
+    name: str
+    price: Decimal
+
+
+@dataclass(frozen=True)
+class BranchView:
+    id: int
+    name: str
+    phone: str | None
+    address: str | None
+    is_active: bool
+
+
+@dataclass(frozen=True)
+class MenuSnapshot:
+    """一份菜單（含店家加料 / 選項）的唯讀快照，欄位名稱與 ORM 相同，模板可直接使用"""
+    menu_id: int
+    store_id: int
+    version: int
+    expires_at: float  # time.monotonic()
+    categories: tuple[CategoryView, ...] = ()
+    items: tuple[ItemView, ...] = ()  # 全部品項（含未分類）
+    toppings: tuple[ToppingView, ...] = ()  # 只有啟用中的加料
+    sugar_options: tuple[str, ...] = ()
+    ice_options: tuple[str, ...] = ()
+    branches: tuple[BranchView, ...] = ()
+    asset_json: str = "[]"  # 前端品項資料（見 _asset_json）
+    fingerprint: str = ""
+    items_by_id: dict = field(default_factory=dict, compare=False)
+    options_by_id: dict = field(default_factory=dict, compare=False)
+    toppings_by_id: dict = field(default_factory=dict, compare=False)
+    rendered: dict = field(default_factory=dict, compare=False)  # 渲染好的 HTML 片段
+
+    @property
+    def asset_url(self) -> str:
+        return f"/menus/{self.menu_id}/{self.fingerprint}.json"
+
+    def get_item(self, item_id: int) -> ItemView | None:
+        return self.items_by_id.get(item_id)
+
+    def get_option(self, item: ItemView, option_id: int) -> OptionView | None:
+        """取得品項的選項（不屬於這個品項的回傳 None）"""
+        option = self.options_by_id.get(option_id)
+        return option if option and option in item.options else None
+
+    def get_topping(self, topping_id: int) -> ToppingView | None:
+        return self.toppings_by_id.get(topping_id)
+
+    def get_branch(self, branch_id: int | None) -> BranchView | None:
+        return next((b for b in self.branches if b.id == branch_id), None) if branch_id else None
+
+
+_cache: dict[int, MenuSnapshot] = {}
+_generation = 0  # 每次清除 +1，避免重建途中被清除的快照又被存回去
+_versions = itertools.count(1)
+_lock = threading.Lock()
+
+
+def invalidate_store_menus(store_id: int | None = None):
+    """清除店家所有菜單的快照（store_id=None 清除全部）"""
+    global _generation
+    with _lock:
+        _generation += 1
+        if store_id is None:
+            _cache.clear()
+        else:
+            for menu_id in [mid for mid, snap in _cache.items() if snap.store_id == store_id]:
+                del _cache[menu_id]
+
+
+def _asset_json(items: tuple[ItemView, ...]) -> str:
+    """前端加品項視窗 / 隨機推薦用的品項資料（依菜單順序）"""
+    return json.dumps([
+        {
+            "id": item.id,
+            "name": item.name,
+            "price": float(item.price),
+            "price_l": float(item.price_l) if item.price_l else None,
+            "options": [
+                {"id": opt.id, "name": opt.name, "price_diff": float(opt.price_diff or 0)}
+                for opt in item.options
+            ],
+        }
+        for item in items
+    ], ensure_ascii=False, separators=(",", ":"))
+
+
+def _build(db: Session, menu_id: int) -> MenuSnapshot | None:
+    menu = db.query(Menu.id, Menu.store_id).filter(Menu.id == menu_id).first()
+    if not menu:
+        return None
+    store_id = menu.store_id
+
+    categories = db.query(MenuCategory.id, MenuCategory.name).filter(
+        MenuCategory.menu_id == menu_id
+    ).order_by(MenuCategory.sort_order, MenuCategory.id).all()
+
+    item_rows = db.query(
+        MenuItem.id, MenuItem.name, MenuItem.price, MenuItem.price_l, MenuItem.category_id,
+    ).filter(MenuItem.menu_id == menu_id).order_by(MenuItem.sort_order, MenuItem.id).all()
+
+    options_by_item: dict[int, list[OptionView]] = {}
+    if item_rows:
+        option_rows = db.query(
+            ItemOption.id, ItemOption.menu_item_id, ItemOption.name, ItemOption.price_diff,
+        ).join(MenuItem, ItemOption.menu_item_id == MenuItem.id).filter(
+            MenuItem.menu_id == menu_id
+        ).order_by(ItemOption.sort_order, ItemOption.id).all()
+        for row in option_rows:
+            options_by_item.setdefault(row.menu_item_id, []).append(
+                OptionView(id=row.id, name=row.name, price_diff=row.price_diff)
+            )
+
+    items = tuple(
+        ItemView(
+            id=row.id,
+            name=row.name,
+            price=row.price,
+            price_l=row.price_l,
+            category_id=row.category_id,
+            options=tuple(options_by_item.get(row.id, ())),
+        )
+        for row in item_rows
+    )
+
+    toppings = tuple(
+        ToppingView(id=row.id, name=row.name, price=row.price)
+        for row in db.query(StoreTopping.id, StoreTopping.name, StoreTopping.price).filter(
+            StoreTopping.store_id == store_id,
+            StoreTopping.is_active == True,
+        ).order_by(StoreTopping.sort_order, StoreTopping.id).all()
+    )
+
+    store_options = db.query(StoreOption.option_type, StoreOption.option_value).filter(
+        StoreOption.store_id == store_id
+    ).order_by(StoreOption.sort_order, StoreOption.id).all()
+
+    branches = tuple(
+        BranchView(id=row.id, name=row.name, phone=row.phone, address=row.address, is_active=row.is_active)
+        for row in db.query(
+            StoreBranch.id, StoreBranch.name, StoreBranch.phone, StoreBranch.address, StoreBranch.is_active,
+        ).filter(StoreBranch.store_id == store_id).order_by(StoreBranch.id).all()
+    )
+
+    categorized = tuple(i for c in categories for i in items if i.category_id == c.id)
+    asset_json = _asset_json(categorized + tuple(i for i in items if i.category_id is None))
+
+    return MenuSnapshot(
+        menu_id=menu_id,
+        store_id=store_id,
+        version=next(_versions),
+        expires_at=time.monotonic() + MENU_CACHE_TTL_SECONDS,
+        categories=tuple(
+            CategoryView(id=c.id, name=c.name, items=tuple(i for i in items if i.category_id == c.id))
+            for c in categories
+        ),
+        items=items,
+        toppings=toppings,
+        sugar_options=tuple(v for t, v in store_options if t == OptionType.SUGAR),
+        ice_options=tuple(v for t, v in store_options if t == OptionType.ICE),
+        branches=branches,
+        asset_json=asset_json,
+        fingerprint=hashlib.sha1(asset_json.encode()).hexdigest()[:12],
+        items_by_id={i.id: i for i in items},
+        options_by_id={o.id: o for i in items for o in i.options},
+        toppings_by_id={t.id: t for t in toppings},
+    )
+
+
+def get_menu_snapshot(db: Session, menu_id: int | None) -> MenuSnapshot | None:
+    """取得菜單快照（過期或被清除才重建）；菜單不存在回傳 None"""
+    if not menu_id:
+        return None
+    snapshot = _cache.get(menu_id)
+    if snapshot and snapshot.expires_at > time.monotonic():
+        return snapshot
+
+    generation = _generation
+    snapshot = _build(db, menu_id)
+    if snapshot:
+        with _lock:
+            if generation == _generation:
+                _cache[menu_id] = snapshot
+    return snapshot
+
+
+def get_active_menu_snapshot(db: Session, store_id: int) -> MenuSnapshot | None:
+    """店家啟用中菜單的快照"""
+    row = db.query(Menu.id).filter(
+        Menu.store_id == store_id,
+        Menu.is_active == True,
+    ).first()
+    return get_menu_snapshot(db, row.id) if row else None
+
+
+def render_menu_section(menu: MenuSnapshot) -> Markup:
+    """團單頁的菜單區塊（分類導覽 + 品項列表），同一份快照只渲染一次"""
+    html = menu.rendered.get("menu_section")
+    if html is None:
+        html = Markup(templates.get_template("partials/menu_section.html").render(menu=menu))
+        menu.rendered["menu_section"] = html
+    return html
@@ -0,0 +1,434 @@
+"""
+購物車指令（加品項、改杯數、刪品項、跟點、複製上次訂單、結單、修改、取消修改、清空訂單）
+
+每個指令都在一筆交易內完成，SQL 數固定，不隨品項 / 選項 / 加料數增加：
+1. 鎖住團單那一列（SELECT ... FOR UPDATE），同一團的訂單異動依序執行，順便檢查是否開放
+2. 一個 SELECT 載入我的訂單（含下單者、品項、選項、加料）；沒有訂單就在 commit 時一起 INSERT
+3. 在記憶體中合併 / 修改品項；新的品項、選項、加料由 unit of work 批次 INSERT（RETURNING id）
+4. 品項小計、訂單金額在記憶體中算好（apply_order_totals），
+   團單計數只加減這筆訂單異動前後的差額（shift_group_counters），不再重新 COUNT
+5. commit 後物件不 expire，直接用記憶體中的訂單渲染，不再重新查詢
+
+同一團只會有一筆「我的訂單」靠第 1 步的鎖保證（orders 沒有 (group_id, user_id) 唯一索引）。
+驗證失敗 raise HTTPException（訊息與原本的端點相同），交易由 get_db 關閉時 rollback。
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload
+
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderItemOption, OrderItemTopping, OrderStatus
+from app.services.affinity_service import get_last_store_order
+from app.services.group_counter_service import shift_group_counters
+from app.services.home_board import invalidate_home_board
+from app.services.item_spec import order_item_spec, spec_of
+from app.services.menu_cache import get_menu_snapshot
+from app.services.order_total_service import apply_order_totals
+from app.services.order_wall_events import queue_order_wall_event
+from app.services.sales_rollup_service import record_order_sales
+
+PENDING_STATUSES = (OrderStatus.DRAFT, OrderStatus.EDITING)
+
+
+def _counter_state(order: Order | None) -> tuple[int, int, Decimal]:
+    """這筆訂單對團單計數的貢獻：(已結單人數, 未結單人數, 已結單金額)"""
+    if order is None:
+        return 0, 0, Decimal("0")
+    if order.status == OrderStatus.SUBMITTED:
+        return 1, 0, order.total_amount or Decimal("0")
+    return 0, int(order.status in PENDING_STATUSES and bool(order.items)), Decimal("0")
+
+
+@dataclass
+class Cart:
+    """一次指令的工作範圍：已鎖住的團單 + 我的訂單（含品項、選項、加料）"""
+    group: Group
+    order: Order | None
+    created: bool = False
+    before: tuple[int, int, Decimal] = (0, 0, Decimal("0"))
+
+
+def _lock_group(db: Session, group_id) -> Group | None:
+    return db.query(Group).filter(Group.id == group_id).with_for_update().first()
+
+
+def _load_order(db: Session, group_id: int, user_id: int) -> Order | None:
+    return db.query(Order).options(
+        joinedload(Order.user),
+        joinedload(Order.items).joinedload(OrderItem.selected_options),
+        joinedload(Order.items).joinedload(OrderItem.selected_toppings),
+    ).filter(
+        Order.group_id == group_id,
+        Order.user_id == user_id,
+    ).order_by(Order.id).first()
+
+
+def _open(db: Session, group: Group | None, user_id: int, create: bool = False, require_open: bool = True) -> Cart:
+    if require_open and (not group or not group.is_open):
+        raise HTTPException(status_code=400, detail="團單已截止")
+    order = _load_order(db, group.id, user_id) if group else None
+    cart = Cart(group=group, order=order, before=_counter_state(order))
+    if order is None and create:
+        cart.order = Order(
+            group_id=group.id,
+            user_id=user_id,
+            status=OrderStatus.DRAFT,
+            discount_amount=Decimal("0"),
+            items=[],
+        )
+        cart.created = True
+        db.add(cart.order)
+    return cart
+
+
+def open_cart(db: Session, group_id: int, user_id: int, create: bool = False, require_open: bool = True) -> Cart:
+    """鎖住團單並載入我的訂單；create=True 時沒有訂單就建立一筆草稿"""
+    return _open(db, _lock_group(db, group_id), user_id, create=create, require_open=require_open)
+
+
+def _open_item(db: Session, item_id: int, user_id: int) -> tuple[Cart, OrderItem]:
+    """依品項 id 找到所屬團單並鎖住，確認是自己購物車裡的品項"""
+    group_id = select(Order.group_id).join(OrderItem, OrderItem.order_id == Order.id).where(
+        OrderItem.id == item_id
+    ).scalar_subquery()
+    group = _lock_group(db, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="品項不存在")
+
+    cart = _open(db, group, user_id, require_open=False)
+    item = next((i for i in cart.order.items if i.id == item_id), None) if cart.order else None
+    if not item:
+        raise HTTPException(status_code=403, detail="只能修改自己的訂單")
+    if not group.is_open:
+        raise HTTPException(status_code=400, detail="團單已截止")
+    if cart.order.status == OrderStatus.SUBMITTED:
+        raise HTTPException(status_code=400, detail="請先進入修改模式")
+    return cart, item
+
+
+def _commit(db: Session, cart: Cart, wall: bool = False) -> Order | None:
+    """算金額、加減團單計數、（需要時）推送訂單牆，commit 後回傳仍可直接渲染的訂單"""
+    order = cart.order
+    if order is not None:
+        apply_order_totals(order, order.items)
+    after = _counter_state(order)
+    shift_group_counters(
+        db, cart.group,
+        submitted=after[0] - cart.before[0],
+        pending=after[1] - cart.before[1],
+        subtotal=after[2] - cart.before[2],
+    )
+    if wall:
+        queue_order_wall_event(db, cart.group.id, order.id, group=cart.group, order=order)
+
+    expire_on_commit = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    finally:
+        db.expire_on_commit = expire_on_commit
+
+    if cart.created or wall or after[:2] != cart.before[:2]:
+        invalidate_home_board()
+    return order
+
+
+def _copy_item(source: OrderItem, quantity: int) -> OrderItem:
+    """複製品項（含選項、加料的名稱與價格）"""
+    return OrderItem(
+        menu_item_id=source.menu_item_id,
+        item_name=source.item_name,
+        size=source.size,
+        sugar=source.sugar,
+        ice=source.ice,
+        quantity=quantity,
+        unit_price=source.unit_price,
+        note=source.note,
+        selected_options=[
+            OrderItemOption(item_option_id=o.item_option_id, option_name=o.option_name, price_diff=o.price_diff)
+            for o in source.selected_options
+        ],
+        selected_toppings=[
+            OrderItemTopping(store_topping_id=t.store_topping_id, topping_name=t.topping_name, price=t.price)
+            for t in source.selected_toppings
+        ],
+    )
+
+
+def _snapshot(order: Order) -> dict:
+    """進入修改模式前保存的訂單內容（取消修改時還原）"""
+    return {
+        "items": [
+            {
+                "menu_item_id": item.menu_item_id,
+                "item_name": item.item_name,
+                "size": item.size,
+                "sugar": item.sugar,
+                "ice": item.ice,
+                "quantity": item.quantity,
+                "unit_price": str(item.unit_price),
+                "note": item.note,
+                "options": [
+                    {
+                        "item_option_id": opt.item_option_id,
+                        "option_name": opt.option_name,
+                        "price_diff": str(opt.price_diff),
+                    }
+                    for opt in item.selected_options
+                ],
+                "toppings": [
+                    {
+                        "store_topping_id": t.store_topping_id,
+                        "topping_name": t.topping_name,
+                        "price": str(t.price),
+                    }
+                    for t in item.selected_toppings
+                ],
+            }
+            for item in order.items
+        ]
+    }
+
+
+def _restore(item_data: dict) -> OrderItem:
+    return OrderItem(
+        menu_item_id=item_data["menu_item_id"],
+        item_name=item_data["item_name"],
+        size=item_data.get("size"),
+        sugar=item_data["sugar"],
+        ice=item_data["ice"],
+        quantity=item_data["quantity"],
+        unit_price=Decimal(item_data["unit_price"]),
+        note=item_data["note"],
+        selected_options=[
+            OrderItemOption(
+                item_option_id=opt["item_option_id"],
+                option_name=opt["option_name"],
+                price_diff=Decimal(opt["price_diff"]),
+            )
+            for opt in item_data["options"]
+        ],
+        # 舊的快照沒有加料
+        selected_toppings=[
+            OrderItemTopping(
+                store_topping_id=t["store_topping_id"],
+                topping_name=t["topping_name"],
+                price=Decimal(t["price"]),
+            )
+            for t in item_data.get("toppings", [])
+        ],
+    )
+
+
+# ===== 指令 =====
+
+def add_item(
+    db: Session,
+    group_id: int,
+    user_id: int,
+    menu_item_id: int,
+    size: str | None,
+    sugar: str | None,
+    ice: str | None,
+    quantity: int,
+    note: str | None,
+    options: list[int],
+    toppings: list[int],
+) -> Cart:
+    """加入品項；規格 key 相同（品項 + 規格 + 選項 + 加料 + 備註）合併杯數"""
+    group = _lock_group(db, group_id)
+    if not group or not group.is_open:
+        raise HTTPException(status_code=400, detail="團單已截止")
+
+    # 菜單品項從菜單快照取（只接受這團菜單裡的品項）
+    menu = get_menu_snapshot(db, group.menu_id)
+    menu_item = menu.get_item(menu_item_id) if menu else None
+    if not menu_item:
+        raise HTTPException(status_code=404, detail="品項不存在")
+    unit_price, size = menu_item.unit_price(size)
+
+    cart = _open(db, group, user_id, create=True)
+    order = cart.order
+    if order.status == OrderStatus.SUBMITTED:
+        raise HTTPException(status_code=400, detail="請先進入修改模式")
+
+    # 無效的選項、停用的加料直接略過
+    option_views = [o for o in (menu.get_option(menu_item, oid) for oid in options) if o]
+    topping_views = [t for t in (menu.get_topping(tid) for tid in toppings) if t]
+    spec_key, _ = spec_of(
+        menu_item_id, menu_item.name, size, sugar, ice,
+        [(o.id, o.name) for o in option_views],
+        [(t.id, t.name) for t in topping_views],
+        note,
+    )
+    # 購物車已整筆載入，直接比對品項的規格 key（舊資料還沒回填就現算）
+    existing = {item.spec_key or order_item_spec(item)[0]: item for item in order.items}.get(spec_key)
+
+    if existing:
+        existing.quantity += quantity
+    else:
+        order.items.append(OrderItem(
+            menu_item_id=menu_item_id,
+            item_name=menu_item.name,
+            size=size,
+            sugar=sugar,
+            ice=ice,
+            quantity=quantity,
+            unit_price=unit_price,
+            note=note,
+            selected_options=[
+                OrderItemOption(item_option_id=o.id, option_name=o.name, price_diff=o.price_diff)
+                for o in option_views
+            ],
+            selected_toppings=[
+                OrderItemTopping(store_topping_id=t.id, topping_name=t.name, price=t.price)
+                for t in topping_views
+            ],
+        ))
+
+    _commit(db, cart)
+    return cart
+
+
+def set_item_quantity(db: Session, item_id: int, user_id: int, quantity: int) -> Cart:
+    """更新品項杯數（0 以下刪除）"""
+    cart, item = _open_item(db, item_id, user_id)
+    if quantity <= 0:
+        cart.order.items.remove(item)
+    else:
+        item.quantity = quantity
+    _commit(db, cart)
+    return cart
+
+
+def remove_item(db: Session, item_id: int, user_id: int) -> Cart:
+    """刪除品項"""
+    cart, item = _open_item(db, item_id, user_id)
+    cart.order.items.remove(item)
+    _commit(db, cart)
+    return cart
+
+
+def follow_item(db: Session, group_id: int, user_id: int, source_item_id: int) -> Cart:
+    """跟點：複製別人的品項（一杯）；已結單的訂單自動進入修改模式"""
+    group = _lock_group(db, group_id)
+    if not group or not group.is_open:
+        raise HTTPException(status_code=400, detail="團單已截止")
+
+    source = db.query(OrderItem).options(
+        joinedload(OrderItem.selected_options),
+        joinedload(OrderItem.selected_toppings),
+    ).filter(OrderItem.id == source_item_id).first()
+    if not source:
+        raise HTTPException(status_code=404, detail="品項不存在")
+
+    cart = _open(db, group, user_id, create=True)
+    order = cart.order
+    was_submitted = order.status == OrderStatus.SUBMITTED
+    if was_submitted:
+        record_order_sales(db, order, sign=-1, group=group, items=order.items)
+        order.status = OrderStatus.EDITING
+
+    order.items.append(_copy_item(source, quantity=1))
+    _commit(db, cart, wall=was_submitted)
+    return cart
+
+
+def copy_last(db: Session, group_id: int, user_id: int) -> Cart:
+    """複製我上次在同一家店的訂單（只複製還在菜單上的品項）；已結單的訂單自動進入修改模式"""
+    group = _lock_group(db, group_id)
+    if not group:
+        raise HTTPException(status_code=404, detail="團單不存在")
+    if not group.is_open:
+        raise HTTPException(status_code=400, detail="團單已截止")
+
+    previous = get_last_store_order(db, user_id, group.store_id, exclude_group_id=group_id)
+    if not previous:
+        raise HTTPException(status_code=404, detail="找不到上次訂單")
+
+    cart = _open(db, group, user_id, create=True)
+    order = cart.order
+    was_submitted = order.status == OrderStatus.SUBMITTED
+    if was_submitted:
+        record_order_sales(db, order, sign=-1, group=group, items=order.items)
+        order.status = OrderStatus.EDITING
+
+    menu = get_menu_snapshot(db, group.menu_id)
+    order.items.extend(
+        _copy_item(item, quantity=item.quantity)
+        for item in previous.items
+        if menu and menu.get_item(item.menu_item_id)
+    )
+    _commit(db, cart, wall=was_submitted)
+    return cart
+
+
+def submit(db: Session, group_id: int, user_id: int) -> Cart:
+    """結單"""
+    cart = open_cart(db, group_id, user_id)
+    order = cart.order
+    if not order or not order.items:
+        raise HTTPException(status_code=400, detail="請先加入品項")
+
+    was_submitted = order.status == OrderStatus.SUBMITTED
+    order.status = OrderStatus.SUBMITTED
+    order.snapshot = None  # 清除快照
+    if not was_submitted:
+        record_order_sales(db, order, group=cart.group, items=order.items)
+    _commit(db, cart, wall=True)
+    return cart
+
+
+def start_edit(db: Session, group_id: int, user_id: int) -> Cart:
+    """進入修改模式（保存目前內容，取消修改時還原）"""
+    cart = open_cart(db, group_id, user_id)
+    order = cart.order
+    if not order:
+        raise HTTPException(status_code=404, detail="訂單不存在")
+    if order.status != OrderStatus.SUBMITTED:
+        raise HTTPException(status_code=400, detail="只能修改已結單的訂單")
+
+    record_order_sales(db, order, sign=-1, group=cart.group, items=order.items)
+    order.status = OrderStatus.EDITING
+    order.snapshot = _snapshot(order)
+    _commit(db, cart, wall=True)
+    return cart
+
+
+def cancel_edit(db: Session, group_id: int, user_id: int) -> Cart:
+    """取消修改：品項還原成進入修改前的內容，回到已結單"""
+    cart = open_cart(db, group_id, user_id, require_open=False)
+    order = cart.order
+    if not order:
+        raise HTTPException(status_code=404, detail="訂單不存在")
+    if order.status != OrderStatus.EDITING:
+        raise HTTPException(status_code=400, detail="目前不在修改模式")
+    if not order.snapshot:
+        raise HTTPException(status_code=400, detail="無法還原訂單")
+
+    order.items = [_restore(item_data) for item_data in order.snapshot["items"]]
+    order.status = OrderStatus.SUBMITTED
+    order.snapshot = None
+    record_order_sales(db, order, group=cart.group, items=order.items)
+    _commit(db, cart, wall=True)
+    return cart
+
+
+def clear(db: Session, group_id: int, user_id: int) -> Cart:
+    """清空我的訂單（品項全部刪除，回到草稿）"""
+    cart = open_cart(db, group_id, user_id)
+    order = cart.order
+    if not order:
+        return cart
+
+    was_submitted = order.status == OrderStatus.SUBMITTED
+    if was_submitted:
+        record_order_sales(db, order, sign=-1, group=cart.group, items=order.items)
+    order.items = []
+    order.status = OrderStatus.DRAFT
+    order.snapshot = None
+    _commit(db, cart, wall=was_submitted)
+    return cart
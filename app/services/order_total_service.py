@@ -0,0 +1,74 @@
+"""
+訂單金額（寫入時維護）
+
+order_items.line_total、orders.items_subtotal / total_amount 存在資料庫，
+顯示、加總、排序都直接讀欄位，不用再載入品項、選項、加料逐筆計算。
+品項的規格 key / 文字（order_items.spec_key / spec_label，見 item_spec）也在這裡一起算。
+
+會改到品項或折扣的端點在 commit 前呼叫 refresh_order_totals()；
+舊資料由啟動時的 backfill_order_totals() 補算。
+"""
+from decimal import Decimal
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, selectinload
+
+from app.models.order import Order, OrderItem
+from app.services.item_spec import order_item_spec
+
+
+def calc_line_total(item: OrderItem) -> Decimal:
+    """品項小計 =（單價 + 選項加價 + 加料）× 數量"""
+    options_total = sum((opt.price_diff for opt in item.selected_options), Decimal("0"))
+    toppings_total = sum((t.price for t in item.selected_toppings), Decimal("0"))
+    return (item.unit_price + options_total + toppings_total) * item.quantity
+
+
+def refresh_order_totals(db: Session, order: Order):
+    """重算一筆訂單的品項小計與訂單金額（commit 由呼叫端負責）"""
+    db.flush()
+    # 品項 / 選項 / 加料常用 xxx_id=... 直接 add，關聯集合可能是舊的，重新載入
+    items = db.query(OrderItem).options(
+        selectinload(OrderItem.selected_options),
+        selectinload(OrderItem.selected_toppings),
+    ).filter(OrderItem.order_id == order.id).populate_existing().all()
+    apply_order_totals(order, items)
+
+
+def apply_order_totals(order: Order, items: list[OrderItem]):
+    """用已載入的品項 / 選項 / 加料算金額，不查資料庫（集合必須是最新的，見 order_commands）
+
+    值沒變的欄位 flush 時不會產生 UPDATE。
+    """
+    subtotal = Decimal("0")
+    for item in items:
+        item.line_total = calc_line_total(item)
+        item.spec_key, item.spec_label = order_item_spec(item)
+        subtotal += item.line_total
+
+    order.items_subtotal = subtotal
+    # 應付金額 = 品項原價總和 - 團主折扣（不小於 0）
+    total = subtotal - (order.discount_amount or Decimal("0"))
+    order.total_amount = total if total > 0 else Decimal("0")
+
+
+def backfill_order_totals(db: Session, only_missing: bool = True, batch_size: int = 200) -> int:
+    """補算訂單金額，回傳處理的訂單數
+
+    only_missing=True 只補還沒有金額、或品項還沒有規格 key 的訂單（新增欄位後的舊資料）。
+    """
+    query = db.query(Order.id)
+    if only_missing:
+        query = query.filter(or_(
+            Order.total_amount.is_(None),
+            Order.id.in_(db.query(OrderItem.order_id).filter(OrderItem.spec_key.is_(None))),
+        ))
+    order_ids = [oid for (oid,) in query.order_by(Order.id).all()]
+
+    for start in range(0, len(order_ids), batch_size):
+        batch = db.query(Order).filter(Order.id.in_(order_ids[start:start + batch_size])).all()
+        for order in batch:
+            refresh_order_totals(db, order)
+        db.commit()
+        db.expunge_all()
+    return len(order_ids)
@@ -0,0 +1,73 @@
+"""
+訂單牆即時推送（SSE，頻道 "group:{id}"）
+
+團單頁開著 /groups/{id}/orders/wall/events，有人結單 / 修改 / 刪除訂單時，
+伺服器只把那一筆訂單的片段渲染一次，同一份推給所有正在看這團的人：
+- order：{order_id, html, count, total}；html 為 null 表示從牆上移除（或盲點模式不顯示內容）
+- wall：請客、截止、抽獎等會影響整面牆的變動，前端延遲一段隨機時間後整面重抓
+- remind：自動催單（見 deadline_scheduler），{user_ids}，只有名單上的人會看到提醒
+
+片段內容不能因瀏覽者而不同（團主折扣工具由前端的 canManage 決定要不要顯示）。
+"""
+import json
+
+from fastapi.templating import Jinja2Templates
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderStatus
+from app.services.event_hub import publish, publish_after_commit
+
+templates = Jinja2Templates(directory="app/templates")
+
+
+def group_channel(group_id: int) -> str:
+    return f"group:{group_id}"
+
+
+def render_wall_entry(order: Order, group: Group) -> str:
+    """渲染訂單牆上的一筆訂單"""
+    return templates.get_template("partials/order_wall_entry.html").render(order=order, group=group)
+
+
+def queue_order_wall_event(db: Session, group_id: int, order_id: int, group: Group | None = None, order: Order | None = None):
+    """訂單進出訂單牆或內容改變時登記推送，commit 後才送出
+
+    在 refresh_group_counters 之後呼叫（人數 / 金額直接讀團單上的計數欄位）。
+    已經載入團單 / 訂單（訂單含下單者、品項、選項、加料）的呼叫端可以直接傳入，不再重新查詢。
+    """
+    db.flush()
+    if group is None:
+        group = db.query(Group).filter(Group.id == group_id).first()
+    if not group:
+        return
+
+    html = None
+    if order is not None:
+        if order.status == OrderStatus.SUBMITTED and not (group.is_blind_mode and group.is_open):
+            html = render_wall_entry(order, group)
+    elif not (group.is_blind_mode and group.is_open):
+        order = db.query(Order).options(
+            joinedload(Order.user),
+            selectinload(Order.items).selectinload(OrderItem.selected_options),
+            selectinload(Order.items).selectinload(OrderItem.selected_toppings),
+        ).filter(
+            Order.id == order_id,
+            Order.status == OrderStatus.SUBMITTED,
+        ).populate_existing().first()
+        if order:
+            html = render_wall_entry(order, group)
+
+    payload = json.dumps({
+        "type": "order",
+        "order_id": order_id,
+        "html": html,
+        "count": group.submitted_orders or 0,
+        "total": str(group.submitted_subtotal or 0),
+    }, ensure_ascii=False)
+    publish_after_commit(db, group_channel(group_id), ("order", order_id), payload)
+
+
+def publish_wall_refresh(group_id: int):
+    """整面訂單牆都要更新（請客、截止、抽獎⋯），在 commit 之後呼叫"""
+    publish(group_channel(group_id), json.dumps({"type": "wall"}))
@@ -0,0 +1,120 @@
+"""
+核對單快取（PDF / PNG，程序內 LRU）
+
+團主分享到 LINE 時常常連按好幾次下載，每次都重查訂單、重畫 PDF、PNG 還要逐頁 2.5 倍點陣化再拼接。
+產生好的檔案依 (group_id, groups.version, 格式) 存在記憶體：
+- 訂單、折扣、請客、截止、編輯都會讓 version +1，key 自然換掉，不需要另外清除
+- 同一團存入新版本時順便丟掉舊版本；總大小超過 RECEIPT_CACHE_MAX_BYTES 時從最久沒用的丟
+- PNG 由 PDF 點陣化而來，先取（或產生）同版本的 PDF
+- 同一個 key 同時只會產生一次，其他請求等它完成後直接拿
+
+團單截止時（手動或截止排程）呼叫 prewarm_receipts()，在背景先產生好，第一次下載就不用等。
+只預先產生剛截止的團（截止時間在 PREWARM_RECENT_MINUTES 內），而且核對單匯出沒人排隊時才做，
+不跟團主的下載搶匯出名額。
+使用者改名、店家換 logo 不會改 version，核對單會沿用舊內容直到下一次團單異動。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.group import Group
+from app.services.export_executor import export_idle, run_export
+
+logger = logging.getLogger("receipt")
+
+TAIPEI_TZ = timezone(timedelta(hours=8))
+RECEIPT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+PREWARM_RECENT_MINUTES = 10  # 截止超過這麼久的團不預先產生（手動提早截止的團截止時間還沒到，也算剛截止）
+
+_cache: "OrderedDict[tuple[int, int, str], bytes]" = OrderedDict()
+_cache_bytes = 0
+_building: dict[tuple[int, int, str], threading.Lock] = {}
+_lock = threading.Lock()
+_prewarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="receipt-prewarm")
+
+
+def _get(key: tuple[int, int, str]) -> bytes | None:
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+        return data
+
+
+def _put(key: tuple[int, int, str], data: bytes):
+    global _cache_bytes
+    group_id, version, _ = key
+    with _lock:
+        # 同一團的舊版本用不到了
+        for old in [k for k in _cache if k[0] == group_id and k[1] != version]:
+            _cache_bytes -= len(_cache.pop(old))
+        _cache[key] = data
+        _cache_bytes += len(data)
+        while _cache_bytes > RECEIPT_CACHE_MAX_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+def _get_or_build(key: tuple[int, int, str], build) -> bytes:
+    data = _get(key)
+    if data is not None:
+        return data
+    with _lock:
+        key_lock = _building.setdefault(key, threading.Lock())
+    try:
+        with key_lock:
+            data = _get(key)
+            if data is None:
+                data = build()
+                _put(key, data)
+    finally:
+        with _lock:
+            _building.pop(key, None)
+    return data
+
+
+def get_receipt_pdf(db: Session, group: Group) -> bytes:
+    """核對單 PDF（同一版本只產生一次；資料在這裡查，畫圖交給匯出執行器）"""
+    def build():
+        from app.services.receipt_service import collect_receipt, render_receipt_pdf
+        return run_export("receipt_pdf", render_receipt_pdf, collect_receipt(db, group))
+
+    return _get_or_build((group.id, group.version or 0, "pdf"), build)
+
+
+def get_receipt_png(db: Session, group: Group) -> bytes:
+    """核對單 PNG（由同版本的 PDF 點陣化）"""
+    def build():
+        from app.services.receipt_service import render_receipt_png
+        return run_export("receipt_png", render_receipt_png, get_receipt_pdf(db, group))
+
+    return _get_or_build((group.id, group.version or 0, "png"), build)
+
+
+def _prewarm(group_id: int):
+    db = SessionLocal()
+    try:
+        group = db.query(Group).filter(Group.id == group_id).first()
+        if not group or not group.submitted_orders:
+            return
+        now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+        if group.deadline < now - timedelta(minutes=PREWARM_RECENT_MINUTES):
+            return
+        if not export_idle("receipt_pdf", "receipt_png"):
+            logger.info(f"核對單匯出忙碌中，略過預先產生（group {group_id}）")
+            return
+        get_receipt_png(db, group)  # 會一併產生 PDF
+    except Exception as e:
+        logger.error(f"核對單預先產生失敗（group {group_id}）：{e}")
+    finally:
+        db.close()
+
+
+def prewarm_receipts(group_id: int):
+    """團單截止後在背景產生核對單（commit 之後呼叫，不等結果）"""
+    _prewarm_executor.submit(_prewarm, group_id)
@@ -9,8 +9,6 @@
 PNG 由 pypdfium2 將 PDF render 成圖（同源、清晰）。
 """
 from io import BytesIO
-from collections import defaultdict
-from decimal import Decimal
 
 from sqlalchemy.orm import Session
 
@@ -24,7 +22,9 @@ from reportlab.pdfbase.ttfonts import TTFont
 import os
 
 from app.models.group import Group
-from app.models.order import Order, OrderStatus
+from app.services.group_settlement import get_settlement
+from app.services.item_spec import spec_description
+from app.services.logo_assets import logo_file
 
 # 主題色（經典奶茶：淺底深字）
 THEME = colors.HexColor("#5B4733")        # 深咖啡：白底上的標題/價格文字、色塊上的字
@@ -48,86 +48,63 @@ def _ensure_font():
         _font_registered = True
 
 
-def _store_display_name(group: Group) -> str:
-    """店名（店家已刪用快照）"""
-    if group.store is not None:
-        return group.store.name
-    return getattr(group, "store_name", None) or "（店家已移除）"
+def collect_receipt(db: Session, group: Group) -> dict:
+    """收集核對單資料：店家總項彙總 + 每人明細（由團單結算產生，見 group_settlement）
 
-
-def _collect(db: Session, group: Group):
-    """收集核對單資料：店家總項彙總 + 每人明細"""
-    orders = db.query(Order).filter(
-        Order.group_id == group.id,
-        Order.status == OrderStatus.SUBMITTED,
-    ).all()
-
-    # 店家總項：彙總相同品項（品名+規格+選項+加料）
-    summary = defaultdict(lambda: {"quantity": 0, "unit": Decimal("0")})
+    回傳只含基本型別（字串、數字、Decimal、datetime）的 dict，
+    可以直接送到匯出 process（見 export_executor）由 render_receipt_pdf() 畫出來。
+    """
+    settlement = get_settlement(db, group)
+
+    # 店家總項：同一種規格（品名+規格+選項+加料+備註）一列
+    summary = [
+        (spec_description(row.item_name, row.spec_label, row.note, sep=" ", note_prefix="註:"),
+         {"quantity": row.quantity, "amount": row.amount})
+        for row in settlement.summary
+    ]
     # 每人明細
-    people = []
-
-    for order in sorted(orders, key=lambda o: o.user.show_name):
-        person = {
-            "name": order.user.show_name,
-            "items": [],
-            "subtotal": order.items_subtotal,       # 折扣前
-            "discount": order.discount_amount or Decimal("0"),
-            "discount_note": order.discount_note,
-            "total": order.total_amount,            # 折扣後應付
+    people = [
+        {
+            "name": person.name,
+            "items": [
+                {
+                    "desc": spec_description(item.item_name, item.spec_label, item.note, sep=" ", note_prefix="註:"),
+                    "qty": item.quantity,
+                    "subtotal": item.subtotal,
+                }
+                for item in person.items
+            ],
+            "subtotal": person.subtotal,       # 折扣前
+            "discount": person.discount,
+            "discount_note": person.discount_note,
+            "total": person.total,             # 折扣後應付
         }
-        for item in order.items:
-            parts = [item.item_name]
-            if item.size:
-                parts.append(f"({item.size})")
-            if item.sugar:
-                parts.append(item.sugar)
-            if item.ice:
-                parts.append(item.ice)
-            for opt in item.selected_options:
-                parts.append(opt.option_name)
-            for top in item.selected_toppings:
-                parts.append(f"+{top.topping_name}")
-            if item.note:
-                parts.append(f"註:{item.note}")
-            key = " ".join(parts)
-
-            summary[key]["quantity"] += item.quantity
-            summary[key]["unit"] = item.unit_price + item.options_total + item.toppings_total
-
-            person["items"].append({
-                "desc": key,
-                "qty": item.quantity,
-                "subtotal": item.subtotal,
-            })
-        people.append(person)
-
-    total_qty = sum(v["quantity"] for v in summary.values())
-    items_total = sum(v["quantity"] * v["unit"] for v in summary.values())
-    # 總折扣（所有人的店家優惠加總）— 店家實收要扣掉
-    total_discount = sum(
-        (o.discount_amount or Decimal("0")) for o in orders
-    )
-    total_amount = items_total - total_discount
-    if total_amount < 0:
-        total_amount = Decimal("0")
+        for person in settlement.people
+    ]
 
     return {
-        "summary": sorted(summary.items()),
+        "group_name": settlement.group_name,
+        "store_name": settlement.store_name,
+        "logo_path": logo_file(group.store.logo_url, "receipt", fetch=True) if group.store is not None else None,
+        "deadline": settlement.deadline,
+        "summary": summary,
         "people": people,
-        "total_qty": total_qty,
-        "items_total": items_total,        # 折扣前品項原價
-        "total_discount": total_discount,  # 總優惠
-        "total_amount": total_amount,      # 店家實收（折後）
+        "total_qty": settlement.total_qty,
+        "items_total": settlement.items_total,        # 折扣前品項原價
+        "total_discount": settlement.total_discount,  # 總優惠
+        "total_amount": settlement.store_total,       # 店家實收（折後）
         "people_count": len(people),
     }
 
 
 def generate_receipt_pdf(db: Session, group: Group) -> BytesIO:
     """產生核對單 PDF"""
-    _ensure_font()
-    data = _collect(db, group)
+    return BytesIO(render_receipt_pdf(collect_receipt(db, group)))
 
+
+def render_receipt_pdf(data: dict) -> bytes:
+    """依 collect_receipt() 的資料畫出核對單 PDF（不碰資料庫）"""
+    _ensure_font()
     buf = BytesIO()
     W, H = A4
     c = canvas.Canvas(buf, pagesize=A4)
@@ -147,20 +124,11 @@ def generate_receipt_pdf(db: Session, group: Group) -> BytesIO:
 
     # 店家 logo（若有，畫在左側白底圓角框）
     logo_drawn = False
-    if group.store is not None and getattr(group.store, "logo_url", None):
+    if data["logo_path"]:
         try:
-            import urllib.request
-            with urllib.request.urlopen(group.store.logo_url, timeout=5) as resp:
-                logo_data = resp.read()
-            # 縮圖避免大圖塞進 PDF（最長邊 400px，logo 放大後解析度要夠）
-            from PIL import Image
-            pil_logo = Image.open(BytesIO(logo_data)).convert("RGBA")
-            pil_logo.thumbnail((400, 400))
-            logo_buf = BytesIO()
-            pil_logo.save(logo_buf, format="PNG")
-            logo_buf.seek(0)
+            # 已縮好的本機檔（最長邊 400px，見 logo_assets）
             from reportlab.lib.utils import ImageReader
-            logo_img = ImageReader(logo_buf)
+            logo_img = ImageReader(data["logo_path"])
             logo_size = 30 * mm
             c.setFillColor(colors.white)
             c.setStrokeColor(DIVIDER)
@@ -176,10 +144,10 @@ def generate_receipt_pdf(db: Session, group: Group) -> BytesIO:
     text_x = margin + (36 * mm if logo_drawn else 0)
     c.setFillColor(THEME)
     c.setFont(_FONT, 18)
-    c.drawString(text_x, H - 16 * mm, _store_display_name(group))
+    c.drawString(text_x, H - 16 * mm, data["store_name"])
     c.setFillColor(GRAY)
     c.setFont(_FONT, 10)
-    c.drawString(text_x, H - 23 * mm, f"訂單核對單　{group.deadline.strftime('%Y/%m/%d %H:%M')} 截止")
+    c.drawString(text_x, H - 23 * mm, f"訂單核對單　{data['deadline'].strftime('%Y/%m/%d %H:%M')} 截止")
 
     y = H - header_h - 10 * mm
 
@@ -207,7 +175,7 @@ def generate_receipt_pdf(db: Session, group: Group) -> BytesIO:
             _ensure_font()
             y = H - margin
         qty = info["quantity"]
-        line_total = qty * info["unit"]
+        line_total = info["amount"]
         row_h = 7 * mm
         # 斑馬紋：奇數列淺底
         if row_idx % 2 == 1:
@@ -316,12 +284,11 @@ def generate_receipt_pdf(db: Session, group: Group) -> BytesIO:
     # 頁尾
     c.setFillColor(LIGHT_GRAY)
     c.setFont(_FONT, 8)
-    c.drawCentredString(W / 2, 10 * mm, f"SELA 快點來點餐　|　{group.name}")
+    c.drawCentredString(W / 2, 10 * mm, f"SELA 快點來點餐　|　{data['group_name']}")
 
     c.showPage()
     c.save()
-    buf.seek(0)
-    return buf
+    return buf.getvalue()
 
 
 def generate_receipt_png(db: Session, group: Group) -> BytesIO:
@@ -330,11 +297,15 @@ def generate_receipt_png(db: Session, group: Group) -> BytesIO:
     人多時核對單 PDF 會超過一頁；全部頁面 render 後直向拼接成「一張長圖」，
     團主貼 LINE 一次就能分享完整內容（避免只剩第一頁、每人明細不見）。
     """
-    pdf_buf = generate_receipt_pdf(db, group)
+    return BytesIO(render_receipt_png(generate_receipt_pdf(db, group).getvalue()))
+
+
+def render_receipt_png(pdf_bytes: bytes) -> bytes:
+    """核對單 PDF 轉 PNG（所有頁面直向拼接）"""
     import pypdfium2 as pdfium
     from PIL import Image
 
-    pdf = pdfium.PdfDocument(pdf_buf.getvalue())
+    pdf = pdfium.PdfDocument(pdf_bytes)
     images = []
     for i in range(len(pdf)):
         bitmap = pdf[i].render(scale=2.5)  # 2.5x 高解析，貼 LINE 清晰
@@ -355,5 +326,4 @@ def generate_receipt_png(db: Session, group: Group) -> BytesIO:
 
     out = BytesIO()
     merged.save(out, format="PNG")
-    out.seek(0)
-    return out
+    return out.getvalue()
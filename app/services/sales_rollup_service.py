@@ -0,0 +1,212 @@
+"""
+品項銷量彙總（item_sales_daily）
+
+已結單訂單的品項依「下單日 × 店家 × 品項 × 規格 × 用戶」累計杯數，
+熱門品項、常點品項都查這張表（小範圍索引查詢），不再每次 GROUP BY order_items。
+
+維護方式：訂單進入 / 離開「已結單」狀態時呼叫 record_order_sales()
+- 結單、取消修改（回到已結單）：sign=+1
+- 進入修改、跟點 / 複製上次訂單把已結單改回購物車、刪除訂單或團單：sign=-1
+已結單的訂單不能直接改品項，所以只要在狀態轉換時增減即可。
+每次增減也會更新使用者 × 店家點餐習慣（見 affinity_service）。
+數字若對不起來，用 scripts/rebuild_sales_rollup.py 從歷史訂單重建。
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.group import Group
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.sales import ItemSalesDaily
+from app.models.store import Store
+from app.services.affinity_service import update_affinity
+
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+
+def _sales_day(created_at: datetime | None) -> date:
+    """訂單 created_at（UTC）換成台北日期"""
+    if created_at is None:
+        created_at = datetime.utcnow()
+    return (created_at + timedelta(hours=8)).date()
+
+
+def _today() -> date:
+    return datetime.now(TAIPEI_TZ).date()
+
+
+def _add_sales(db: Session, key: dict, quantity: int, line_count: int):
+    """把增量加到彙總列（沒有就新增）"""
+    filters = [
+        getattr(ItemSalesDaily, col) == val if val is not None else getattr(ItemSalesDaily, col).is_(None)
+        for col, val in key.items()
+    ]
+    row = db.query(ItemSalesDaily).filter(*filters).limit(1).with_for_update().first()
+    if row:
+        row.quantity += quantity
+        row.line_count += line_count
+    else:
+        db.add(ItemSalesDaily(**key, quantity=quantity, line_count=line_count))
+
+
+def record_order_sales(
+    db: Session,
+    order: Order,
+    sign: int = 1,
+    group: Group | None = None,
+    items: list[OrderItem] | None = None,
+):
+    """把一筆訂單目前的品項加進（sign=1）或扣出（sign=-1）彙總，commit 由呼叫端負責
+
+    已載入團單 / 目前品項的呼叫端可以直接傳入，不再重新查詢。
+    """
+    db.flush()
+    if group is None:
+        group = db.query(Group).filter(Group.id == order.group_id).first()
+    if not group or not group.store_id:
+        return
+
+    # 同一訂單內相同品項 / 規格先合併，減少寫入次數
+    merged = defaultdict(lambda: [0, 0])
+    if items is None:
+        items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+    for item in items:
+        k = (item.menu_item_id, item.item_name, item.size, item.sugar, item.ice)
+        merged[k][0] += item.quantity
+        merged[k][1] += 1
+
+    sales_date = _sales_day(order.created_at)
+    for (menu_item_id, item_name, size, sugar, ice), (quantity, line_count) in merged.items():
+        _add_sales(db, {
+            "sales_date": sales_date,
+            "store_id": group.store_id,
+            "user_id": order.user_id,
+            "menu_item_id": menu_item_id,
+            "item_name": item_name,
+            "size": size,
+            "sugar": sugar,
+            "ice": ice,
+        }, sign * quantity, sign * line_count)
+
+    update_affinity(db, order, group.store_id, items, sign)
+
+
+def remove_group_sales(db: Session, group_id: int):
+    """刪團前把該團已結單的訂單從彙總扣掉"""
+    submitted = db.query(Order).filter(
+        Order.group_id == group_id,
+        Order.status == OrderStatus.SUBMITTED,
+    ).all()
+    for order in submitted:
+        record_order_sales(db, order, sign=-1)
+
+
+def rebuild_sales_rollup(db: Session) -> int:
+    """清空後從所有已結單訂單重建彙總，回傳寫入列數"""
+    rows = db.query(
+        Order.created_at,
+        Order.user_id,
+        Group.store_id,
+        OrderItem.menu_item_id,
+        OrderItem.item_name,
+        OrderItem.size,
+        OrderItem.sugar,
+        OrderItem.ice,
+        OrderItem.quantity,
+    ).join(Order, OrderItem.order_id == Order.id).join(Group, Order.group_id == Group.id).filter(
+        Order.status == OrderStatus.SUBMITTED,
+        Group.store_id.isnot(None),
+    ).all()
+
+    totals = defaultdict(lambda: [0, 0])
+    for created_at, user_id, store_id, menu_item_id, item_name, size, sugar, ice, quantity in rows:
+        k = (_sales_day(created_at), store_id, user_id, menu_item_id, item_name, size, sugar, ice)
+        totals[k][0] += quantity
+        totals[k][1] += 1
+
+    db.query(ItemSalesDaily).delete()
+    db.bulk_insert_mappings(ItemSalesDaily, [
+        {
+            "sales_date": sales_date,
+            "store_id": store_id,
+            "user_id": user_id,
+            "menu_item_id": menu_item_id,
+            "item_name": item_name,
+            "size": size,
+            "sugar": sugar,
+            "ice": ice,
+            "quantity": quantity,
+            "line_count": line_count,
+        }
+        for (sales_date, store_id, user_id, menu_item_id, item_name, size, sugar, ice), (quantity, line_count)
+        in totals.items()
+    ])
+    db.commit()
+    return len(totals)
+
+
+def backfill_sales_rollup(db: Session) -> int:
+    """彙總表還是空的（剛建立）就從歷史訂單重建，回傳寫入列數"""
+    if db.query(ItemSalesDaily.id).first():
+        return 0
+    return rebuild_sales_rollup(db)
+
+
+# ===== 查詢（都是 item_sales_daily 上的小範圍查詢）=====
+
+def global_hot_items(db: Session, days: int = 30, limit: int = 10):
+    """全站熱門品項（最近 days 天）：[(item_name, store_name, store_logo, total_qty)]"""
+    since = _today() - timedelta(days=days)
+    total_qty = func.sum(ItemSalesDaily.quantity)
+    return db.query(
+        ItemSalesDaily.item_name,
+        Store.name.label('store_name'),
+        Store.logo_url.label('store_logo'),
+        total_qty.label('total_qty'),
+    ).join(Store, Store.id == ItemSalesDaily.store_id).filter(
+        ItemSalesDaily.sales_date >= since,
+    ).group_by(
+        ItemSalesDaily.item_name,
+        Store.name,
+        Store.logo_url,
+    ).having(total_qty > 0).order_by(total_qty.desc()).limit(limit).all()
+
+
+def store_hot_items(db: Session, store_id: int, days: int = 30, limit: int = 5):
+    """店家熱門品項（全站，最近 days 天）：[(item_name, menu_item_id, total_qty)]"""
+    since = _today() - timedelta(days=days)
+    total_qty = func.sum(ItemSalesDaily.quantity)
+    return db.query(
+        ItemSalesDaily.item_name,
+        ItemSalesDaily.menu_item_id,
+        total_qty.label('total_qty'),
+    ).filter(
+        ItemSalesDaily.store_id == store_id,
+        ItemSalesDaily.sales_date >= since,
+    ).group_by(
+        ItemSalesDaily.item_name,
+        ItemSalesDaily.menu_item_id,
+    ).having(total_qty > 0).order_by(total_qty.desc()).limit(limit).all()
+
+
+def user_favorite_specs(db: Session, user_id: int, store_id: int, limit: int = 10):
+    """用戶在店家最常點的品項 + 規格：[(item_name, sugar, ice, size, total_qty, menu_item_id)]"""
+    total_qty = func.sum(ItemSalesDaily.quantity)
+    return db.query(
+        ItemSalesDaily.item_name,
+        ItemSalesDaily.sugar,
+        ItemSalesDaily.ice,
+        ItemSalesDaily.size,
+        total_qty.label('total_qty'),
+        func.max(ItemSalesDaily.menu_item_id).label('menu_item_id'),
+    ).filter(
+        ItemSalesDaily.user_id == user_id,
+        ItemSalesDaily.store_id == store_id,
+    ).group_by(
+        ItemSalesDaily.item_name,
+        ItemSalesDaily.sugar,
+        ItemSalesDaily.ice,
+        ItemSalesDaily.size,
+    ).having(total_qty > 0).order_by(total_qty.desc()).limit(limit).all()
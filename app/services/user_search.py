@@ -0,0 +1,129 @@
+"""
+使用者搜尋（程序內 n-gram 索引）
+
+轉移團主、部門加成員都只需要「打幾個字找人」，不必把整張 users 表送進頁面。
+索引只存 id、名稱、暱稱、是否訪客，用一個查詢建好後都在記憶體中比對：
+- 名稱與暱稱轉小寫後，每個字（unigram）與相鄰兩字（bigram）各對應一組 user id
+- 中文名字沒有空白分詞，打「小明」要能找到「王小明」，所以用字元 n-gram 而不是前綴
+- 查詢字串取 bigram（只有一個字就用 unigram）交集，再以子字串確認
+- 排序：名稱 / 暱稱開頭相符 > 其他位置相符，同級依顯示名稱
+
+名稱有變（登入更新 LINE 名稱、改暱稱、新增 / 刪除使用者）時呼叫 invalidate_user_search()；
+平常最多保留 USER_SEARCH_TTL_SECONDS 秒（多 worker 時其他 process 靠這個更新）。
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import Session
+
+from app.models.user import User
+
+USER_SEARCH_TTL_SECONDS = 60
+USER_SEARCH_LIMIT = 10
+USER_SEARCH_MAX_QUERY = 30
+
+
+@dataclass(frozen=True)
+class UserHit:
+    id: int
+    show_name: str
+    display_name: str
+    is_guest: bool
+
+
+@dataclass
+class _Index:
+    expires_at: float  # time.monotonic()
+    users: dict[int, UserHit] = field(default_factory=dict)
+    keys: dict[int, tuple[str, ...]] = field(default_factory=dict)  # 小寫的暱稱 / 名稱
+    grams: dict[str, set[int]] = field(default_factory=dict)
+
+
+_index: _Index | None = None
+_generation = 0  # 每次清除 +1，避免重建途中被清除的索引又被存回去
+_lock = threading.Lock()
+
+
+def invalidate_user_search():
+    """清除搜尋索引（下次搜尋時重建）"""
+    global _index, _generation
+    with _lock:
+        _generation += 1
+        _index = None
+
+
+def _grams(text: str) -> set[str]:
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _build(db: Session) -> _Index:
+    index = _Index(expires_at=time.monotonic() + USER_SEARCH_TTL_SECONDS)
+    for user_id, display_name, nickname, is_guest in db.query(
+        User.id, User.display_name, User.nickname, User.is_guest,
+    ).all():
+        index.users[user_id] = UserHit(
+            id=user_id,
+            show_name=nickname or display_name,
+            display_name=display_name,
+            is_guest=bool(is_guest),
+        )
+        keys = tuple(dict.fromkeys(k.lower() for k in (nickname, display_name) if k))
+        index.keys[user_id] = keys
+        for key in keys:
+            for gram in _grams(key):
+                index.grams.setdefault(gram, set()).add(user_id)
+    return index
+
+
+def _get_index(db: Session) -> _Index:
+    global _index
+    index = _index
+    if index and index.expires_at > time.monotonic():
+        return index
+
+    generation = _generation
+    index = _build(db)
+    with _lock:
+        if generation == _generation:
+            _index = index
+    return index
+
+
+def search_users(
+    db: Session,
+    q: str,
+    limit: int = USER_SEARCH_LIMIT,
+    exclude_ids=(),
+    include_guests: bool = True,
+) -> list[UserHit]:
+    """依名稱 / 暱稱找使用者（不分大小寫、可搜中間的字），回傳最相符的前 limit 筆"""
+    q = (q or "").strip().lower()[:USER_SEARCH_MAX_QUERY]
+    if not q:
+        return []
+
+    index = _get_index(db)
+    grams = [q] if len(q) == 1 else [q[i:i + 2] for i in range(len(q) - 1)]
+    candidates = None
+    for gram in sorted(set(grams), key=lambda g: len(index.grams.get(g, ()))):
+        ids = index.grams.get(gram)
+        if not ids:
+            return []
+        candidates = set(ids) if candidates is None else candidates & ids
+        if not candidates:
+            return []
+
+    excluded = set(exclude_ids)
+    ranked = []
+    for user_id in candidates:
+        hit = index.users[user_id]
+        if user_id in excluded or (hit.is_guest and not include_guests):
+            continue
+        keys = index.keys[user_id]
+        if any(key.startswith(q) for key in keys):
+            ranked.append((0, hit.show_name, user_id))
+        elif any(q in key for key in keys):
+            ranked.append((1, hit.show_name, user_id))
+
+    ranked.sort()
+    return [index.users[user_id] for _, _, user_id in ranked[:limit]]
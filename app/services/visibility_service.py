@@ -0,0 +1,100 @@
+"""
+可見性條件（團單 / 店家 / 投票）
+
+「公開 OR 擁有者 OR 管理員 OR 部門有交集」寫成單一 SQL 條件，
+直接放進 query 的 filter，不用再逐筆查 GroupDepartment / StoreDepartment。
+
+用法：
+    db.query(Group).filter(group_visible_clause(user), ...)
+
+首頁快照的資料已在記憶體中，改用下方 filter_visible_* 版本。
+"""
+from sqlalchemy import or_, select, true
+
+from app.models.group import Group
+from app.models.store import Store
+from app.models.vote import Vote, VoteDepartment
+from app.models.department import UserDepartment, GroupDepartment, StoreDepartment
+
+
+def _shares_department(link_model, link_fk, target_id, user_id: int):
+    """EXISTS：該筆資料限定的部門（link_model）與用戶所屬部門有交集"""
+    return (
+        select(UserDepartment.id)
+        .join(link_model, link_model.department_id == UserDepartment.department_id)
+        .where(link_fk == target_id, UserDepartment.user_id == user_id)
+        .exists()
+    )
+
+
+def group_visible_clause(user):
+    """團單可見：公開、團主本人、管理員、或部門交集"""
+    if user.is_admin:
+        return true()
+    return or_(
+        Group.is_public == True,
+        Group.owner_id == user.id,
+        _shares_department(GroupDepartment, GroupDepartment.group_id, Group.id, user.id),
+    )
+
+
+def store_visible_clause(user):
+    """店家可見：公開、管理員、或部門交集"""
+    if user.is_admin:
+        return true()
+    return or_(
+        Store.is_public == True,
+        _shares_department(StoreDepartment, StoreDepartment.store_id, Store.id, user.id),
+    )
+
+
+def vote_visible_clause(user):
+    """投票可見：公開、發起人、管理員、或部門交集"""
+    if user.is_admin:
+        return true()
+    return or_(
+        Vote.is_public == True,
+        Vote.creator_id == user.id,
+        _shares_department(VoteDepartment, VoteDepartment.vote_id, Vote.id, user.id),
+    )
+
+
+# ===== 記憶體版（首頁快照用：資料已載入，只需套用使用者條件）=====
+
+def get_user_department_ids(db, user_id: int) -> set[int]:
+    """取得用戶所屬部門 ID"""
+    return {
+        dept_id for (dept_id,) in db.query(UserDepartment.department_id).filter(
+            UserDepartment.user_id == user_id
+        ).all()
+    }
+
+
+def filter_visible_groups(groups, user, user_dept_ids: set[int], group_dept_ids: dict[int, set[int]]):
+    """過濾用戶可見的團單（group_dept_ids：group_id -> 限定部門）"""
+    if user.is_admin:
+        return list(groups)
+    return [
+        g for g in groups
+        if g.is_public or g.owner_id == user.id or group_dept_ids.get(g.id, set()) & user_dept_ids
+    ]
+
+
+def filter_visible_stores(stores, user, user_dept_ids: set[int], store_dept_ids: dict[int, set[int]]):
+    """過濾用戶可見的店家（store_dept_ids：store_id -> 限定部門）"""
+    if user.is_admin:
+        return list(stores)
+    return [
+        s for s in stores
+        if s.is_public or store_dept_ids.get(s.id, set()) & user_dept_ids
+    ]
+
+
+def filter_visible_votes(votes, user, user_dept_ids: set[int], vote_dept_ids: dict[int, set[int]]):
+    """過濾用戶可見的投票（vote_dept_ids：vote_id -> 限定部門）"""
+    if user.is_admin:
+        return list(votes)
+    return [
+        v for v in votes
+        if v.is_public or v.creator_id == user.id or vote_dept_ids.get(v.id, set()) & user_dept_ids
+    ]
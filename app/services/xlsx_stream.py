@@ -0,0 +1,255 @@
+"""
+串流 XLSX 寫入器
+
+openpyxl 的 Workbook 要把整份活頁簿建在記憶體、最後一次 save 到 BytesIO，
+write_only 模式也要先寫完暫存檔才能送出。後台一次匯出好幾個月的訂單時，
+改用這個寫入器：XLSX 本身是 zip，每個工作表的 XML 邊產生邊壓縮，
+壓好的資料隨時可以用 drain() 取出送給 StreamingResponse，記憶體只留一小段緩衝。
+
+- 字串用 inline string（不需要最後才寫得出來的 sharedStrings）
+- 樣式固定幾種（STYLE_*），對應 excel_service 原本的表頭 / 金額 / 合計樣式
+- zip 寫入不能 seek，每個檔案後面接 data descriptor（Excel、LibreOffice、Numbers 都能開）
+- 同一時間只能寫一個工作表；add_sheet() 會結束前一個
+
+用法：
+    writer = XlsxStreamWriter()
+    writer.add_sheet("訂單明細", widths=[12, 25])
+    writer.append(["訂購人", "品項"], style=STYLE_HEADER)
+    ...
+    yield writer.drain()
+    writer.close()
+    yield writer.drain()
+"""
+import re
+import zipfile
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+STYLE_DEFAULT = 0
+STYLE_HEADER = 1
+STYLE_MONEY = 2
+STYLE_BOLD = 3
+STYLE_BOLD_MONEY = 4
+STYLE_DISCOUNT = 5  # 折扣（紅字金額）
+
+SHEET_NAME_MAX = 31
+
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_SHEET_NAME_INVALID = re.compile(r"[\[\]:*?/\\]")
+
+_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="&quot;$&quot;#,##0"/></numFmts>'
+    '<fonts count="4">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FF5B4733"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '<font><sz val="11"/><color rgb="FFC0392B"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="3">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFC9A977"/><bgColor rgb="FFC9A977"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="6">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="164" fontId="2" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1"/>'
+    '<xf numFmtId="164" fontId="3" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+@lru_cache(maxsize=256)
+def column_letter(index: int) -> str:
+    """1 -> A、27 -> AA"""
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+class _ChunkSink:
+    """zip 的輸出端：收集壓縮好的資料，drain() 時交出去（不支援 seek，zipfile 會改用 data descriptor）"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class XlsxStreamWriter:
+    def __init__(self, compresslevel: int = 6):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._sheets: list[str] = []
+        self._sheet = None
+        self._row = 0
+        self._buffer: list[str] = []
+
+    # ===== 工作表 =====
+
+    def _unique_sheet_name(self, name: str) -> str:
+        name = _SHEET_NAME_INVALID.sub("_", _ILLEGAL_XML_CHARS.sub("", name or "")).strip("'") or "工作表"
+        base = name[:SHEET_NAME_MAX]
+        used = {s.lower() for s in self._sheets}
+        candidate, n = base, 1
+        while candidate.lower() in used:
+            n += 1
+            suffix = f" ({n})"
+            candidate = base[:SHEET_NAME_MAX - len(suffix)] + suffix
+        return candidate
+
+    def add_sheet(self, name: str, widths: list[float] | None = None, freeze_rows: int = 0) -> str:
+        """開始新的工作表（結束前一個），回傳實際使用的名稱（Excel 限 31 字、不可重複）"""
+        self._end_sheet()
+        name = self._unique_sheet_name(name)
+        self._sheets.append(name)
+        self._sheet = self._zip.open(f"xl/worksheets/sheet{len(self._sheets)}.xml", mode="w")
+        self._row = 0
+
+        head = [
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        ]
+        if freeze_rows:
+            head.append(
+                '<sheetViews><sheetView workbookViewId="0">'
+                f'<pane ySplit="{freeze_rows}" topLeftCell="A{freeze_rows + 1}" activePane="bottomLeft" state="frozen"/>'
+                '</sheetView></sheetViews>'
+            )
+        if widths:
+            head.append("<cols>")
+            head.extend(
+                f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+                for i, width in enumerate(widths, 1)
+            )
+            head.append("</cols>")
+        head.append("<sheetData>")
+        self._sheet.write("".join(head).encode())
+        return name
+
+    def _end_sheet(self):
+        if self._sheet is None:
+            return
+        self._flush_rows()
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._sheet = None
+
+    # ===== 資料列 =====
+
+    def append(self, values, style: int = STYLE_DEFAULT, styles: dict[int, int] | None = None):
+        """寫入一列；None 為空白格。styles 可以指定個別欄（從 0 起算）的樣式"""
+        if self._sheet is None:
+            self.add_sheet("工作表1")
+        self._row += 1
+        row = self._row
+        cells = []
+        for i, value in enumerate(values):
+            if value is None:
+                continue
+            ref = f"{column_letter(i + 1)}{row}"
+            s = styles.get(i, style) if styles else style
+            style_attr = f' s="{s}"' if s else ""
+            if isinstance(value, bool):
+                cells.append(f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>')
+            elif isinstance(value, (int, float)):
+                cells.append(f'<c r="{ref}"{style_attr}><v>{value}</v></c>')
+            else:
+                text = escape(_ILLEGAL_XML_CHARS.sub("", str(value)))
+                cells.append(f'<c r="{ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        self._buffer.append(f'<row r="{row}">{"".join(cells)}</row>')
+        if len(self._buffer) >= 500:
+            self._flush_rows()
+
+    def _flush_rows(self):
+        if self._buffer:
+            self._sheet.write("".join(self._buffer).encode())
+            self._buffer.clear()
+
+    # ===== 輸出 =====
+
+    def drain(self) -> bytes:
+        """目前已壓縮好的資料（可能是空的）"""
+        return self._sink.drain()
+
+    def close(self):
+        """結束最後一個工作表並寫入活頁簿結構；之後再 drain() 一次取得檔案結尾"""
+        if not self._sheets:
+            self.add_sheet("工作表1")
+        self._end_sheet()
+        count = len(self._sheets)
+
+        sheet_overrides = "".join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(1, count + 1)
+        )
+        self._zip.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{sheet_overrides}</Types>'
+        ))
+        self._zip.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'
+        ))
+        sheets = "".join(
+            f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+            for i, name in enumerate(self._sheets, 1)
+        )
+        self._zip.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets>{sheets}</sheets></workbook>'
+        ))
+        sheet_rels = "".join(
+            f'<Relationship Id="rId{i}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{i}.xml"/>'
+            for i in range(1, count + 1)
+        )
+        self._zip.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{sheet_rels}'
+            f'<Relationship Id="rId{count + 1}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+            'Target="styles.xml"/></Relationships>'
+        ))
+        self._zip.writestr("xl/styles.xml", _STYLES_XML)
+        self._zip.close()
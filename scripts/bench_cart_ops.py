@@ -0,0 +1,138 @@
+"""
+購物車操作壓力測試：每秒能處理幾次加品項 / 改杯數 / 結單⋯，每次操作執行幾個 SQL
+執行方式: python -m scripts.bench_cart_ops [--rounds 30] [--users 10] [--query-latency 0.002]
+
+- 每位使用者在同一團反覆跑一輪購物車流程：
+  加品項（含選項、加料）→ 相同品項再加（合併杯數）→ 加另一個品項 → 改杯數 → 刪品項
+  → 結單 → 進入修改 → 跟點 → 取消修改 → 清空
+- 依操作種類統計延遲（p50 / p99）、平均 SQL 數，最後列出整體每秒操作數
+- --query-latency 模擬 PostgreSQL 網路往返（每個 SQL 前 sleep），SQL 數越少差越多
+"""
+import argparse
+import re
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from scripts.bench_common import setup_bench_db, seed_bench_data, summarize
+
+SEEDED_ORDERS = 6  # 團裡原本就有的訂單（跟點的來源）
+
+
+def prepare(group_id: int) -> dict:
+    """在這團的菜單加一個選項、店家加一個加料，回傳要用的 id"""
+    from app.database import SessionLocal
+    from app.models import Group, MenuItem, OrderItem, Order
+    from app.models.menu import ItemOption
+    from app.models.store import StoreTopping
+    from app.services.menu_cache import invalidate_store_menus
+
+    db = SessionLocal()
+    try:
+        group = db.query(Group).filter(Group.id == group_id).first()
+        items = db.query(MenuItem).filter(MenuItem.menu_id == group.menu_id).order_by(MenuItem.id).limit(2).all()
+        option = ItemOption(menu_item_id=items[0].id, name="加珍珠", price_diff=Decimal("10"))
+        topping = StoreTopping(store_id=group.store_id, name="椰果", price=Decimal("5"), is_active=True)
+        db.add_all([option, topping])
+        db.commit()
+        follow_id = db.query(OrderItem.id).join(Order, OrderItem.order_id == Order.id).filter(
+            Order.group_id == group_id,
+        ).order_by(OrderItem.id).limit(1).scalar()
+        invalidate_store_menus()
+        return {
+            "item": items[0].id,
+            "other_item": items[1].id,
+            "option": option.id,
+            "topping": topping.id,
+            "follow": follow_id,
+        }
+    finally:
+        db.close()
+
+
+def run_round(client, group_id: int, ids: dict, record):
+    """一位使用者跑一輪購物車流程，record(操作名稱, response)"""
+    base = f"/groups/{group_id}/orders"
+    drink = {"menu_item_id": ids["item"], "sugar": "半糖", "ice": "少冰", "options": [ids["option"]], "toppings": [ids["topping"]]}
+
+    record("add", client.post(f"{base}/items", data=drink))
+    record("add_merge", client.post(f"{base}/items", data={**drink, "quantity": 2}))
+    resp = record("add", client.post(f"{base}/items", data={"menu_item_id": ids["other_item"], "sugar": "無糖", "ice": "去冰"}))
+    item_ids = [int(i) for i in re.findall(r"/orders/items/(\d+)", resp.text)]
+    record("set_quantity", client.put(f"/orders/items/{item_ids[-1]}", data={"quantity": 3}))
+    record("delete_item", client.delete(f"/orders/items/{item_ids[-1]}"))
+    record("submit", client.post(f"{base}/submit"))
+    record("edit", client.post(f"{base}/edit"))
+    record("follow", client.post(f"{base}/follow/{ids['follow']}"))
+    record("cancel_edit", client.post(f"{base}/cancel"))
+    record("clear", client.delete(base))
+
+
+class Recorder:
+    """記錄每次操作的延遲與 SQL 數（從上一次操作結束開始算）"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.latencies = defaultdict(list)
+        self.sql_counts = defaultdict(list)
+        self.statements = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+        self.mark()
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def mark(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+
+    def __call__(self, name: str, resp):
+        elapsed = time.perf_counter() - self.started
+        assert resp.status_code == 200, (name, resp.status_code, resp.text[:200])
+        self.latencies[name].append(elapsed)
+        self.sql_counts[name].append(self.statements)
+        self.mark()
+        return resp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=30, help="每位使用者跑幾輪")
+    parser.add_argument("--users", type=int, default=10, help="幾位使用者輪流操作")
+    parser.add_argument("--query-latency", type=float, default=0.0, help="每個 SQL 額外延遲（秒）")
+    args = parser.parse_args()
+
+    app = setup_bench_db(query_latency=args.query_latency)
+    sessions = seed_bench_data(n_users=args.users + SEEDED_ORDERS + 1, n_groups=1, orders_per_group=SEEDED_ORDERS)
+    ids = prepare(group_id=1)
+    # 種子訂單屬於前 SEEDED_ORDERS 位使用者，操作的人從後面挑（一開始購物車是空的）
+    writers = sessions[SEEDED_ORDERS:SEEDED_ORDERS + args.users]
+
+    from fastapi.testclient import TestClient
+    from app.database import engine
+
+    with TestClient(app) as client:
+        # 暖機（菜單快照、登入快取）
+        client.cookies.set("access_token", sessions[-1]["token"])
+        run_round(client, 1, ids, lambda name, resp: resp)
+
+        record = Recorder(engine)
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for session in writers:
+                client.cookies.set("access_token", session["token"])
+                record.mark()
+                run_round(client, 1, ids, record)
+        elapsed = time.perf_counter() - started
+
+    total_ops = sum(len(samples) for samples in record.latencies.values())
+    print(f"\n購物車操作（{args.users} 人 × {args.rounds} 輪，query latency {args.query_latency * 1000:.1f}ms）")
+    for name, samples in record.latencies.items():
+        avg_sql = sum(record.sql_counts[name]) / len(record.sql_counts[name])
+        print(f"{summarize(name, samples)}  SQL={avg_sql:5.1f}")
+    print(f"合計 {total_ops} 次操作 / {elapsed:.2f}s = {total_ops / elapsed:.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
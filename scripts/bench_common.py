@@ -0,0 +1,146 @@
+"""
+壓力測試共用工具：暫存 SQLite 資料庫、種子資料、登入 token、延遲統計
+由 scripts/bench_*.py 使用，不要直接執行
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, '.')
+
+
+def setup_bench_db(query_latency: float = 0.0):
+    """建立暫存 SQLite 資料庫並回傳 FastAPI app
+
+    必須在 import app.* 之前呼叫（設定檔會讀 DATABASE_URL）。
+    query_latency > 0 時，每個 SQL 執行前 sleep 指定秒數，模擬 PostgreSQL 網路往返。
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="sela-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    os.environ["DEBUG"] = "false"
+
+    from sqlalchemy import event
+    from app.database import engine, Base
+    from app import models  # noqa: F401
+    from app.models import department, treat, vote, template  # noqa: F401
+
+    Base.metadata.create_all(bind=engine)
+
+    if query_latency > 0:
+        @event.listens_for(engine, "before_cursor_execute")
+        def _simulate_rtt(conn, cursor, statement, parameters, context, executemany):
+            time.sleep(query_latency)
+
+    from app.main import app
+    return app
+
+
+def seed_bench_data(n_users: int = 50, n_groups: int = 12, orders_per_group: int = 8) -> list[dict]:
+    """建立使用者、店家、菜單、團單與訂單，回傳 [{user_id, token}]"""
+    from app.database import SessionLocal
+    from app.models import User, Store, Menu, MenuCategory, MenuItem, Group, Order, OrderItem
+    from app.models.order import OrderStatus
+    from app.models.store import CategoryType
+    from app.services.auth import create_access_token, get_system_token_version
+    from app.services.order_total_service import backfill_order_totals
+    from app.services.group_counter_service import recompute_group_counters
+    from app.services.sales_rollup_service import rebuild_sales_rollup
+    from app.services.affinity_service import rebuild_user_store_affinity
+
+    db = SessionLocal()
+    try:
+        users = []
+        for i in range(n_users):
+            u = User(line_user_id=f"bench-user-{i}", display_name=f"壓測{i}", nickname=f"壓測{i}")
+            db.add(u)
+            users.append(u)
+        db.flush()
+
+        stores = []
+        for i, category in enumerate([CategoryType.DRINK, CategoryType.MEAL, CategoryType.GROUP_BUY]):
+            store = Store(name=f"壓測店家{i}", category=category, is_active=True, is_public=True)
+            db.add(store)
+            db.flush()
+            menu = Menu(store_id=store.id, is_active=True)
+            db.add(menu)
+            db.flush()
+            cat = MenuCategory(menu_id=menu.id, name="招牌", sort_order=0)
+            db.add(cat)
+            db.flush()
+            items = []
+            for j in range(20):
+                item = MenuItem(menu_id=menu.id, category_id=cat.id, name=f"品項{j}", price=30 + j * 5, sort_order=j)
+                db.add(item)
+                items.append(item)
+            db.flush()
+            stores.append((store, menu, items))
+
+        # deadline 存的是台北時間（naive）
+        deadline = datetime.now(timezone(timedelta(hours=8))).replace(tzinfo=None) + timedelta(hours=3)
+        for g in range(n_groups):
+            store, menu, items = stores[g % len(stores)]
+            group = Group(
+                store_id=store.id,
+                menu_id=menu.id,
+                store_name=store.name,
+                owner_id=users[g % n_users].id,
+                name=f"壓測團{g}",
+                category=store.category,
+                deadline=deadline,
+                is_public=True,
+            )
+            db.add(group)
+            db.flush()
+            for k in range(orders_per_group):
+                order = Order(
+                    group_id=group.id,
+                    user_id=users[(g + k) % n_users].id,
+                    status=OrderStatus.SUBMITTED if k % 2 == 0 else OrderStatus.DRAFT,
+                )
+                db.add(order)
+                db.flush()
+                item = items[k % len(items)]
+                db.add(OrderItem(
+                    order_id=order.id,
+                    menu_item_id=item.id,
+                    item_name=item.name,
+                    quantity=1 + k % 3,
+                    unit_price=item.price,
+                ))
+        db.commit()
+
+        token_version = get_system_token_version(db)
+        sessions = [
+            {"user_id": u.id, "token": create_access_token(u.id, u.line_user_id, token_version)}
+            for u in users
+        ]
+
+        # 訂單是直接寫入的，補算訂單金額、團單計數、銷量彙總與點餐習慣
+        backfill_order_totals(db, only_missing=False)
+        recompute_group_counters(db)
+        rebuild_sales_rollup(db)
+        rebuild_user_store_affinity(db)
+        return sessions
+    finally:
+        db.close()
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """最近排名法百分位數（毫秒）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank] * 1000
+
+
+def summarize(name: str, samples: list[float]) -> str:
+    return (
+        f"{name:<14} n={len(samples):<5} "
+        f"p50={percentile(samples, 50):8.1f}ms  "
+        f"p99={percentile(samples, 99):8.1f}ms  "
+        f"max={max(samples) * 1000 if samples else 0:8.1f}ms"
+    )
@@ -0,0 +1,74 @@
+"""
+事件迴圈壓力測試：午餐尖峰時大量同時開首頁，量測各端點延遲
+執行方式: python -m scripts.bench_event_loop [--clients 40] [--requests 5] [--query-latency 0.005]
+
+- 同時有 --clients 個已登入使用者各自連打 /home
+- 另一個探針持續打不碰資料庫的 /auth/login，量測事件迴圈被卡住多久
+- 使用暫存 SQLite，--query-latency 模擬每個 SQL 的網路往返時間
+"""
+import argparse
+import asyncio
+import time
+
+from scripts.bench_common import setup_bench_db, seed_bench_data, summarize
+
+PROBE_INTERVAL = 0.01  # 探針間隔（秒）
+
+
+async def run(app, sessions: list[dict], clients: int, requests_per_client: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    results = {"/home": [], "/auth/login": []}
+    done = asyncio.Event()
+
+    async def home_client(session: dict):
+        async with httpx.AsyncClient(
+            transport=transport,
+            base_url="http://bench",
+            cookies={"access_token": session["token"]},
+        ) as client:
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                resp = await client.get("/home")
+                results["/home"].append(time.perf_counter() - start)
+                assert resp.status_code == 200, resp.status_code
+
+    async def probe():
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            while not done.is_set():
+                # 從「預計送出」開始計時，事件迴圈被卡住的時間也會算進去
+                start = time.perf_counter() + PROBE_INTERVAL
+                await asyncio.sleep(PROBE_INTERVAL)
+                await client.get("/auth/login")
+                results["/auth/login"].append(time.perf_counter() - start)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.gather(*(home_client(sessions[i % len(sessions)]) for i in range(clients)))
+    done.set()
+    await probe_task
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=40, help="同時連線的使用者數")
+    parser.add_argument("--requests", type=int, default=5, help="每個使用者打幾次 /home")
+    parser.add_argument("--query-latency", type=float, default=0.005, help="每個 SQL 額外延遲（秒）")
+    args = parser.parse_args()
+
+    app = setup_bench_db(query_latency=args.query_latency)
+    sessions = seed_bench_data(n_users=max(args.clients, 10))
+
+    start = time.perf_counter()
+    results = asyncio.run(run(app, sessions, args.clients, args.requests))
+    elapsed = time.perf_counter() - start
+
+    print(f"clients={args.clients} requests={args.requests} query_latency={args.query_latency * 1000:.1f}ms")
+    for name, samples in results.items():
+        print(summarize(name, samples))
+    print(f"/home 吞吐量: {len(results['/home']) / elapsed:.1f} req/s（總時間 {elapsed:.2f}s）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+團單頁 SQL 查詢數檢查：查詢數要固定，不隨訂單數 / 品項數增加
+執行方式: python -m scripts.bench_group_page [--orders 40] [--verbose]
+
+- 以團員、團主、管理員身分各開一次團單頁（先暖機一次，菜單快照與登入快取已建好）
+- 計算每次請求執行的 SQL 數，超過 MAX_STATEMENTS 就以 exit code 1 結束
+- 再多塞一倍訂單重量一次，查詢數必須不變
+"""
+import argparse
+import sys
+
+from scripts.bench_common import setup_bench_db, seed_bench_data
+
+# 團單頁（load_group_page）的查詢上限
+MAX_STATEMENTS = {
+    "member": 3,  # 團單（含點餐習慣）、訂單、熱門
+    "owner": 3,   # 轉移團主改用搜尋，不再載入全部使用者
+    "admin": 3,
+}
+
+
+def pick_viewers(sessions: list[dict], group_id: int) -> dict[str, dict]:
+    """找出這團的團主、一位團員，並把另一位設為管理員"""
+    from app.database import SessionLocal
+    from app.models import Group, User
+
+    db = SessionLocal()
+    try:
+        owner_id = db.query(Group.owner_id).filter(Group.id == group_id).scalar()
+        others = [s for s in sessions if s["user_id"] != owner_id]
+        db.query(User).filter(User.id == others[1]["user_id"]).update({"is_admin": True})
+        db.commit()
+        return {
+            "member": others[0],
+            "owner": next(s for s in sessions if s["user_id"] == owner_id),
+            "admin": others[1],
+        }
+    finally:
+        db.close()
+
+
+def add_orders(group_id: int, sessions: list[dict], count: int):
+    """幫還沒下單的使用者在這團各加一筆已結單的訂單"""
+    from app.database import SessionLocal
+    from app.models import Group, MenuItem, Order, OrderItem
+    from app.models.order import OrderStatus
+    from app.services.group_counter_service import refresh_group_counters
+    from app.services.order_total_service import refresh_order_totals
+
+    db = SessionLocal()
+    try:
+        group = db.query(Group).filter(Group.id == group_id).first()
+        item = db.query(MenuItem).filter(MenuItem.menu_id == group.menu_id).first()
+        ordered = {uid for (uid,) in db.query(Order.user_id).filter(Order.group_id == group_id)}
+        for session in [s for s in sessions if s["user_id"] not in ordered][:count]:
+            order = Order(group_id=group_id, user_id=session["user_id"], status=OrderStatus.SUBMITTED)
+            db.add(order)
+            db.flush()
+            for _ in range(3):
+                db.add(OrderItem(
+                    order_id=order.id, menu_item_id=item.id, item_name=item.name,
+                    sugar="半糖", ice="少冰", quantity=1, unit_price=item.price,
+                ))
+            db.flush()
+            db.refresh(order)
+            refresh_order_totals(db, order)
+        refresh_group_counters(db, group_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+def measure(client, viewers: dict[str, dict], group_id: int, verbose: bool) -> dict[str, int]:
+    from sqlalchemy import event
+    from app.database import engine
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        counts = {}
+        for role, session in viewers.items():
+            client.cookies.set("access_token", session["token"])
+            client.get(f"/groups/{group_id}")  # 暖機
+            statements.clear()
+            resp = client.get(f"/groups/{group_id}")
+            assert resp.status_code == 200, (role, resp.status_code)
+            counts[role] = len(statements)
+            if verbose:
+                print(f"[{role}]")
+                for statement in statements:
+                    print("   ", " ".join(statement.split())[:160])
+        return counts
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=40, help="這團一開始有幾筆訂單")
+    parser.add_argument("--verbose", action="store_true", help="列出每個 SQL")
+    args = parser.parse_args()
+
+    app = setup_bench_db()
+    sessions = seed_bench_data(n_users=args.orders * 2 + 10, n_groups=1, orders_per_group=args.orders)
+    viewers = pick_viewers(sessions, group_id=1)
+
+    from fastapi.testclient import TestClient
+
+    failed = False
+    with TestClient(app) as client:
+        before = measure(client, viewers, 1, args.verbose)
+        add_orders(1, sessions, args.orders)
+        after = measure(client, viewers, 1, args.verbose)
+
+    for role, limit in MAX_STATEMENTS.items():
+        ok = before[role] <= limit and after[role] == before[role]
+        failed |= not ok
+        print(f"{role:7s} {before[role]} → {after[role]} statements (max {limit}) {'OK' if ok else 'FAIL'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
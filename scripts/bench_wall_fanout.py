@@ -0,0 +1,140 @@
+"""
+訂單牆推送壓力測試：幾百人同時開著同一團的團單頁，量測一筆訂單變動推到所有人要多久
+執行方式: python -m scripts.bench_wall_fanout [--viewers 300] [--changes 10] [--query-latency 0.005]
+
+- --viewers 個連線訂閱 /groups/{id}/orders/wall/events（SSE）
+- 一位使用者反覆「修改訂單 → 送出」，每次異動都等所有連線收到才進行下一次
+- 對照組：同樣人數同時重抓整面 /orders/wall（改版前每次 orderUpdated 的做法）
+- SSE 需要真的 HTTP 串流，這裡在背景 thread 起一個 uvicorn，使用暫存 SQLite
+"""
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+from scripts.bench_common import setup_bench_db, seed_bench_data, summarize
+
+DELIVERY_TIMEOUT = 30  # 一次異動最多等幾秒讓所有連線收到
+
+
+def start_server(app) -> str:
+    """背景 thread 起 uvicorn，回傳 base url"""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="127.0.0.1", port=port, lifespan="off", log_level="warning",
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def pick_writer(sessions: list[dict]) -> tuple[int, dict]:
+    """找一位在某團已結單的使用者，回傳 (group_id, session)"""
+    from app.database import SessionLocal
+    from app.models.order import Order, OrderStatus
+
+    tokens = {s["user_id"]: s for s in sessions}
+    db = SessionLocal()
+    try:
+        order = db.query(Order).filter(
+            Order.status == OrderStatus.SUBMITTED,
+            Order.user_id.in_(list(tokens)),
+        ).order_by(Order.group_id).first()
+        return order.group_id, tokens[order.user_id]
+    finally:
+        db.close()
+
+
+async def run(base_url: str, sessions: list[dict], group_id: int, writer: dict, viewers: int, changes: int) -> dict:
+    import httpx
+
+    results = {"POST": [], "fan-out": [], "wall GET": []}
+    state = {"sent_at": 0.0, "received": 0}
+    all_received = asyncio.Event()
+    connected = 0
+    all_connected = asyncio.Event()
+
+    limits = httpx.Limits(max_connections=viewers + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+
+        async def viewer(session: dict):
+            nonlocal connected
+            cookies = {"access_token": session["token"]}
+            async with client.stream("GET", f"/groups/{group_id}/orders/wall/events", cookies=cookies) as resp:
+                assert resp.status_code == 200, resp.status_code
+                async for line in resp.aiter_lines():
+                    if line.startswith("retry:"):
+                        connected += 1
+                        if connected == viewers:
+                            all_connected.set()
+                    elif line.startswith("data:"):
+                        results["fan-out"].append(time.perf_counter() - state["sent_at"])
+                        state["received"] += 1
+                        if state["received"] == viewers:
+                            all_received.set()
+
+        tasks = [asyncio.create_task(viewer(sessions[i % len(sessions)])) for i in range(viewers)]
+        await asyncio.wait_for(all_connected.wait(), DELIVERY_TIMEOUT)
+
+        writer_cookies = {"access_token": writer["token"]}
+        for i in range(changes * 2):
+            action = "edit" if i % 2 == 0 else "submit"
+            state["received"] = 0
+            all_received.clear()
+            state["sent_at"] = time.perf_counter()
+            resp = await client.post(f"/groups/{group_id}/orders/{action}", cookies=writer_cookies)
+            results["POST"].append(time.perf_counter() - state["sent_at"])
+            assert resp.status_code == 200, (action, resp.status_code)
+            await asyncio.wait_for(all_received.wait(), DELIVERY_TIMEOUT)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 對照組：所有人同時重抓整面訂單牆
+        async def refetch(session: dict):
+            start = time.perf_counter()
+            resp = await client.get(f"/groups/{group_id}/orders/wall", cookies={"access_token": session["token"]})
+            results["wall GET"].append(time.perf_counter() - start)
+            assert resp.status_code == 200, resp.status_code
+
+        start = time.perf_counter()
+        await asyncio.gather(*(refetch(sessions[i % len(sessions)]) for i in range(viewers)))
+        results["refetch_elapsed"] = time.perf_counter() - start
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=300, help="同時開著團單頁的連線數")
+    parser.add_argument("--changes", type=int, default=10, help="「修改 → 送出」來回幾次")
+    parser.add_argument("--query-latency", type=float, default=0.005, help="每個 SQL 額外延遲（秒）")
+    args = parser.parse_args()
+
+    app = setup_bench_db(query_latency=args.query_latency)
+    sessions = seed_bench_data(n_users=50, n_groups=1, orders_per_group=30)
+    group_id, writer = pick_writer(sessions)
+    base_url = start_server(app)
+
+    results = asyncio.run(run(base_url, sessions, group_id, writer, args.viewers, args.changes))
+
+    print(f"viewers={args.viewers} changes={args.changes * 2} query_latency={args.query_latency * 1000:.1f}ms")
+    print(summarize("POST", results["POST"]))
+    print(summarize("fan-out", results["fan-out"]))
+    print(summarize("wall GET", results["wall GET"]))
+    print(
+        f"每次異動：推送 {args.viewers} 人全部收到 max={max(results['fan-out']) * 1000:.1f}ms；"
+        f"對照組 {args.viewers} 人重抓整面牆共 {results['refetch_elapsed']:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
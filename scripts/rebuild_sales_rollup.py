@@ -0,0 +1,30 @@
+"""
+從歷史訂單重建品項銷量彙總（item_sales_daily）與使用者 × 店家點餐習慣（user_store_affinity）
+執行方式: python -m scripts.rebuild_sales_rollup
+
+彙總平常由結單 / 修改 / 刪除訂單時增減；手動改過資料庫或熱門品項、常點、上次訂單不對時執行。
+"""
+import sys
+sys.path.insert(0, '.')
+
+from app.database import SessionLocal, engine, Base
+from app.models import sales  # noqa: F401
+from app.services.sales_rollup_service import rebuild_sales_rollup
+from app.services.affinity_service import rebuild_user_store_affinity
+
+
+def main():
+    Base.metadata.create_all(bind=engine, tables=[sales.ItemSalesDaily.__table__, sales.UserStoreAffinity.__table__])
+
+    db = SessionLocal()
+    try:
+        count = rebuild_sales_rollup(db)
+        print(f"✅ 已重建銷量彙總：{count} 列")
+        count = rebuild_user_store_affinity(db)
+        print(f"✅ 已重建點餐習慣：{count} 列")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+重算訂單金額（order_items.line_total、orders.items_subtotal / total_amount）
+與團單訂單計數（groups.submitted_orders / pending_orders / submitted_subtotal）
+執行方式: python -m scripts.recompute_group_counters [--missing-only]
+
+平常由下單 / 結單 / 折扣等端點維護；手動改過資料庫或懷疑數字不對時執行。
+"""
+import argparse
+import sys
+sys.path.insert(0, '.')
+
+from app.database import SessionLocal
+from app.services.order_total_service import backfill_order_totals
+from app.services.group_counter_service import recompute_group_counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--missing-only", action="store_true", help="只補還沒有金額的訂單、還沒有計數的團")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        # 團單金額加總訂單金額，先算訂單
+        count = backfill_order_totals(db, only_missing=args.missing_only)
+        print(f"✅ 已重算 {count} 筆訂單金額")
+        count = recompute_group_counters(db, only_missing=args.missing_only)
+        print(f"✅ 已重算 {count} 個團單")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()